@@ -40,13 +40,13 @@ class ISQdata:
             fid = open(filename, 'rb')
             
             # Read header
-            check = fid.read(4)  # char check[16]
+            check = fid.read(16)  # char check[16]
             headerinfo['data_type_id'] = struct.unpack('I', fid.read(4))[0]  # int data_type
             headerinfo['type'] = 'int16'  # standard for ISQ
             headerinfo['nr_of_bytes'] = struct.unpack('I', fid.read(4))[0]  # int nr_of_bytes
 
             # Dimensions
-            fid.seek(44, 1)  # skip 44 bytes to x_dim
+            fid.seek(44, 0)  # fseek to x_dim
             headerinfo['x_dim'] = struct.unpack('I', fid.read(4))[0]
             headerinfo['y_dim'] = struct.unpack('I', fid.read(4))[0]
             headerinfo['z_dim'] = struct.unpack('I', fid.read(4))[0]
@@ -94,61 +94,179 @@ class ISQdata:
         return headerinfo
 
     @staticmethod
-    def readdata(filename, x_min, y_min, z_min, x_size, y_size, z_size):
+    def memmap(filename, headerinfo=None):
+        """
+        Memory-map the image data of a Scanco ISQ file.
+        No data is read from disk until the returned array is sliced.
+
+        Args:
+            filename (str): Path to the ISQ file.
+            headerinfo (dict, optional): Header information from readheader. Read from the file if not given.
+
+        Returns:
+            np.memmap: Read-only 3D int16 array with the (z, y, x) layout of the file.
+        """
+        if headerinfo is None:
+            headerinfo = ISQdata.readheader(filename, leaveopen=False)
+
+        return np.memmap(filename, dtype='<i2', mode='r', offset=headerinfo['offset'],
+                         shape=(headerinfo['z_dim'], headerinfo['y_dim'], headerinfo['x_dim']))
+
+    @staticmethod
+    def readdata(filename, x_min, y_min, z_min, x_size=None, y_size=None, z_size=None):
         """
         Read a portion of Scanco ISQ data.
 
         Args:
             filename (str): Path to the ISQ file.
             x_min, y_min, z_min (int): Starting indices (1-based) for x, y, z.
-            x_size, y_size, z_size (int): Number of elements to read along x, y, z.
+            x_size, y_size, z_size (int): Number of elements to read along x, y, z. Defaults to the rest of the volume.
 
         Returns:
-            np.ndarray: 3D numpy array with the read data.
+            np.ndarray: 3D numpy array with the read data (rows x cols x slices = y x x x z).
         """
         try:
             headerinfo = ISQdata.readheader(filename, leaveopen=False)
         except FileNotFoundError:
             raise FileNotFoundError('Input file missing!')
 
-        data = np.zeros((x_size, y_size, z_size), dtype=np.int16)
+        if x_size is None:
+            x_size = headerinfo['x_dim'] - x_min + 1
+        if y_size is None:
+            y_size = headerinfo['y_dim'] - y_min + 1
+        if z_size is None:
+            z_size = headerinfo['z_dim'] - z_min + 1
 
-        with open(filename, 'rb') as fid:
-            fid.seek(headerinfo['offset'], 0)
-
-            # Seek initial frames
-            fid.seek(headerinfo['x_dim'] * headerinfo['y_dim'] * (z_min - 1) * 2, 1)
-
-            print('Reading ISQ data...')
-            for kk in range(z_size):
-                fid.seek(headerinfo['x_dim'] * (y_min - 1) * 2, 1)
-                for jj in range(y_size):
-                    fid.seek((x_min - 1) * 2, 1)
-                    data[:, jj, kk] = np.fromfile(fid, dtype=np.int16, count=x_size)
-                    fid.seek((headerinfo['x_dim'] - (x_min + x_size - 1)) * 2, 1)
+        data = ISQdata.memmap(filename, headerinfo)
 
-                fid.seek(headerinfo['x_dim'] * (headerinfo['y_dim'] - (y_min + y_size - 1)) * 2, 1)
-
-            print(' done!')
+        print('Reading ISQ data...')
+        data = data[z_min - 1:z_min - 1 + z_size, y_min - 1:y_min - 1 + y_size, x_min - 1:x_min - 1 + x_size]
 
         # Compensate for MATLAB row-column convention
-        data = np.transpose(data, (1, 0, 2))
+        data = np.array(np.transpose(data, (1, 2, 0)), dtype=np.int16)
+        print(' done!')
+
         return data
 
     @staticmethod
-    def resample(filename, resamplefactor, method='box'):
+    def resample(filename, resamplefactor, method='box', sigma=None, output=None, dtype=np.int16):
         """
         Loads and resamples large ISQ data to smaller size.
+        The data is streamed from disk in slabs of resamplefactor slices (plus a small halo for method 'gaussian'),
+        reduced on the fly and written incrementally to the output. Peak memory is a few slabs, not the whole scan.
+
+        Args:
+            filename (str): Path to the ISQ file.
+            resamplefactor (int): Integer downsampling factor along x, y and z.
+            method (str, optional): 'box' averages blocks of resamplefactor^3 voxels. 'gaussian' applies a Gaussian
+                                    anti-aliasing filter before the block average. Defaults to 'box'.
+            sigma (float, optional): Standard deviation of the anti-aliasing filter in voxels.
+                                     Defaults to (resamplefactor - 1) / 2.
+            output (str or np.ndarray, optional): Output .npy file (written through a memory map) or array of the
+                                                  output shape. Defaults to a new array.
+            dtype (optional): Output data type. Defaults to np.int16 (rounded block means).
+
+        Returns:
+            np.ndarray: Resampled data (rows x cols x slices = y x x x z).
+                        Incomplete blocks at the end of each axis are averaged over the available voxels.
         """
-        data = None
-        # Placeholder for resampling logic
-        return data
+        import scipy.ndimage as ndimage
+
+        headerinfo = ISQdata.readheader(filename, leaveopen=False)
+        data = ISQdata.memmap(filename, headerinfo)
+        f = int(resamplefactor)
+        z_dim, y_dim, x_dim = data.shape
+
+        # block start indices and sizes for each axis
+        starts = [np.arange(0, n, f) for n in data.shape]
+        counts = [np.diff(np.append(start, n)) for start, n in zip(starts, data.shape)]
+        out_shape = (len(starts[1]), len(starts[2]), len(starts[0]))
+
+        if output is None:
+            resampled = np.empty(out_shape, dtype=dtype)
+        elif isinstance(output, str):
+            resampled = np.lib.format.open_memmap(output, mode='w+', dtype=dtype, shape=out_shape)
+        else:
+            resampled = output
+            if resampled.shape != out_shape:
+                raise ValueError('Output shape {0} does not match resampled shape {1}.'.format(resampled.shape, out_shape))
+
+        if method == 'box':
+            halo = 0
+        elif method == 'gaussian':
+            if sigma is None:
+                sigma = (f - 1) / 2
+            # support of scipy.ndimage.gaussian_filter1d (truncate=4.0)
+            halo = int(4.0 * sigma + 0.5)
+        else:
+            raise IOError('{0} method unknown.'.format(method))
+
+        def reduce_xy(z0, z1):
+            """Sum over blocks in y and x of slices [z0, z1). For method 'gaussian' the slices are first filtered in-plane."""
+            reduced = np.empty((z1 - z0, out_shape[0], out_shape[1]))
+            for z in range(z0, z1):
+                if method == 'gaussian':
+                    image = ndimage.gaussian_filter(data[z].astype(np.float32), sigma=sigma, mode='nearest')
+                else:
+                    image = data[z].astype(np.int64)
+                image = np.add.reduceat(image, starts[1], axis=0)
+                reduced[z - z0] = np.add.reduceat(image, starts[2], axis=1)
+            return reduced
+
+        # the Gaussian along z and the block sum along y and x act on different axes and commute:
+        # keep a rolling buffer of slices already reduced in-plane and filter these along z
+        buffer = np.empty((0, out_shape[0], out_shape[1]))
+        buffer_z0 = 0
+        norm = np.outer(counts[1], counts[2])
+
+        print('Resampling ISQ data...')
+        for k, (z0, n) in enumerate(zip(starts[0], counts[0])):
+            z1 = z0 + n
+            read_z0, read_z1 = max(z0 - halo, 0), min(z1 + halo, z_dim)
+
+            # drop the slices behind the halo and read the new ones
+            buffer = buffer[read_z0 - buffer_z0:]
+            buffer_z0 = read_z0
+            new_z0 = buffer_z0 + buffer.shape[0]
+            if new_z0 < read_z1:
+                buffer = np.concatenate((buffer, reduce_xy(new_z0, read_z1)))
+
+            if method == 'gaussian':
+                slab = ndimage.gaussian_filter1d(buffer, sigma, axis=0, mode='nearest')[z0 - buffer_z0:z1 - buffer_z0]
+            else:
+                slab = buffer[z0 - buffer_z0:z1 - buffer_z0]
+
+            block = np.sum(slab, axis=0) / (n * norm)
+            if np.issubdtype(resampled.dtype, np.integer):
+                block = np.rint(block)
+            resampled[:, :, k] = block
+
+        if isinstance(resampled, np.memmap):
+            resampled.flush()
+        print(' done!')
+
+        return resampled
 
     @staticmethod
     def readslices(filename, offset, rows, cols, zmin, zmax):
         """
         Fast read for slices portion of ISQ data.
+        Whole slices are read with a single sequential read.
+
+        Args:
+            filename (str): Path to the ISQ file.
+            offset (int): Data offset in bytes (headerinfo['offset']).
+            rows, cols (int): Slice dimensions (y_dim, x_dim).
+            zmin, zmax (int): First and last slice (1-based, inclusive).
+
+        Returns:
+            np.ndarray: 3D int16 array (rows x cols x slices).
         """
-        data = np.zeros((rows, cols, zmax-zmin+1), dtype=np.int16)
-        # Placeholder for slice reading logic
-        return data
\ No newline at end of file
+        nz = zmax - zmin + 1
+        data = np.empty((nz, rows, cols), dtype='<i2')
+        with open(filename, 'rb') as fid:
+            fid.seek(offset + (zmin - 1) * rows * cols * 2, 0)
+            if fid.readinto(memoryview(data).cast('B')) != data.nbytes:
+                raise EOFError('ISQ file shorter than expected from its header.')
+
+        return np.array(np.transpose(data, (1, 2, 0)), dtype=np.int16)
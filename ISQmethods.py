@@ -72,42 +72,285 @@ def readheader(filename):
 
     return headerinfo
 
+def ISQmemmap(filename, header=None):
+    """
+    Memory-map the image data of a Scanco ISQ file.
+    No data is read from disk until the returned array is sliced: sub-volumes cost one strided copy (np.array(view))
+    or none (views).
+
+    Args:
+        filename (str): Path to the ISQ file.
+        header (dict, optional): Header information from readheader. Read from the file if not given.
+
+    Returns:
+        np.memmap: Read-only 3D int16 array with (z, y, x) layout.
+    """
+    if header is None:
+        header = readheader(filename)
+
+    return np.memmap(filename, dtype='<i2', mode='r', offset=header['offset'],
+                     shape=(header['z_dim'], header['y_dim'], header['x_dim']))
+
 def readdata(filename, x_min, y_min, z_min, x_size, y_size, z_size):
     """
     Read a portion of Scanco ISQ data.
 
     Args:
         filename (str): Path to the ISQ file.
-        x_min, y_min, z_min (int): Starting indices (1-based) for x, y, z.
+        x_min, y_min, z_min (int): Starting indices (0-based) for x, y, z.
         x_size, y_size, z_size (int): Number of elements to read along x, y, z.
 
     Returns:
         np.ndarray: 3D numpy array with the read data.
     """
     try:
-        headerinfo = readheader(filename)
+        data = ISQmemmap(filename)
     except FileNotFoundError:
         raise FileNotFoundError('Input file missing!')
 
-    data = np.zeros((z_size, y_size, x_size), dtype=np.int16)
+    print('Reading ISQ data...')
+    data = np.array(data[z_min:z_min + z_size, y_min:y_min + y_size, x_min:x_min + x_size], dtype=np.int16)
+    print(' done!')
 
-    with open(filename, 'rb') as fid:
-        fid.seek(headerinfo['offset'], 0)
+    return data
 
-        # Seek initial frames
-        fid.seek(headerinfo['x_dim'] * headerinfo['y_dim'] * (z_min) * 2, 1)
+def _readinto(fid, buffer):
+    """
+    Fill buffer with the next bytes of fid. Repeats short reads (e.g. on network file systems).
+    """
+    view = memoryview(buffer).cast('B')
+    n_read = 0
+    while n_read < view.nbytes:
+        n = fid.readinto(view[n_read:])
+        if not n:
+            raise EOFError('ISQ file shorter than expected from its header.')
+        n_read += n
 
-        print('Reading ISQ data...')
-        for kk in range(z_size):
-            print(f'\r Reading slice {kk + 1} of {z_size}', end='')
-            fid.seek(headerinfo['x_dim'] * (y_min) * 2, 1)
-            for jj in range(y_size):
-                fid.seek((x_min) * 2, 1)
-                data[kk, jj, :] = np.fromfile(fid, dtype=np.int16, count=x_size)
-                fid.seek((headerinfo['x_dim'] - (x_min + x_size)) * 2, 1)
+def readslices(filename, z_min=0, z_max=None, stride=1, header=None, block_bytes=2**28):
+    """
+    Read whole ISQ slices in large sequential blocks.
 
-            fid.seek(headerinfo['x_dim'] * (headerinfo['y_dim'] - (y_min + y_size)) * 2, 1)
+    Args:
+        filename (str): Path to the ISQ file.
+        z_min, z_max (int): Slice range [z_min, z_max) (0-based). Defaults to all slices.
+        stride (int, optional): Read every stride-th slice only. Defaults to 1.
+        header (dict, optional): Header information from readheader.
+        block_bytes (int, optional): Size of the read blocks in bytes.
 
-        print(' done!')
+    Yields:
+        tuple: (z, slices) with z the slice indices of the block and slices the (len(z), y, x) int16 data.
+        The slices buffer is reused by the next block: copy the data that is needed.
+    """
+    if header is None:
+        header = readheader(filename)
+    if z_max is None:
+        z_max = header['z_dim']
 
-    return data
+    slice_shape = (header['y_dim'], header['x_dim'])
+    slice_bytes = 2 * slice_shape[0] * slice_shape[1]
+
+    if stride == 1:
+        block_size = max(1, min(block_bytes // slice_bytes, z_max - z_min))
+    else:
+        block_size = 1
+    buffer = np.empty((block_size,) + slice_shape, dtype='<i2')
+
+    with open(filename, 'rb', buffering=0) as fid:
+        for z0 in range(z_min, z_max, block_size * stride):
+            n = min(block_size, z_max - z0)
+            fid.seek(header['offset'] + z0 * slice_bytes, 0)
+            _readinto(fid, buffer[:n])
+            yield np.arange(z0, z0 + n * stride, stride), buffer[:n]
+
+def readplane(filename, plane='XY', index=None, thickness=1, stride=1, z_min=0, z_size=None, header=None):
+    """
+    Read orthogonal plane (or thin slab) from ISQ file.
+    XY and XZ planes are read directly through the memory map (an XZ row is one contiguous run of each slice).
+    YZ planes are extracted from whole slices read in large sequential blocks.
+
+    Args:
+        filename (str): Path to the ISQ file.
+        plane (str): 'XY', 'XZ' or 'YZ'.
+        index (int, optional): Index (0-based) of the plane along its normal axis (z, y or x). Defaults to the mid-plane.
+        thickness (int, optional): Number of planes of the slab. Defaults to 1.
+        stride (int, optional): Sampling stride along all axes (e.g. for thumbnails). Defaults to 1.
+        z_min (int, optional): First slice. Defaults to 0.
+        z_size (int, optional): Number of slices. Defaults to all slices from z_min.
+        header (dict, optional): Header information from readheader.
+
+    Returns:
+        np.ndarray: 2D plane (XY: (y, x); XZ: (z, x); YZ: (z, y)) or, for thickness > 1, 3D slab with (z, y, x) layout.
+    """
+    if header is None:
+        header = readheader(filename)
+    if z_size is None:
+        z_size = header['z_dim'] - z_min
+    z_max = z_min + z_size
+
+    if plane == 'XY':
+        if index is None:
+            index = z_min + z_size // 2
+        slab = np.array(ISQmemmap(filename, header)[index:index + thickness, ::stride, ::stride], dtype=np.int16)
+
+    elif plane == 'XZ':
+        if index is None:
+            index = header['y_dim'] // 2
+        # about 1/y_dim of the data is read
+        slab = np.array(ISQmemmap(filename, header)[z_min:z_max:stride, index:index + thickness, ::stride],
+                        dtype=np.int16)
+
+    elif plane == 'YZ':
+        if index is None:
+            index = header['x_dim'] // 2
+        cut = np.s_[:, ::stride, index:index + thickness]
+
+        slab = None
+        for z, slices in readslices(filename, z_min, z_max, stride, header):
+            if slab is None:
+                n_z = len(range(z_min, z_max, stride))
+                slab = np.empty((n_z,) + slices[cut].shape[1:], dtype=np.int16)
+            k = (z[0] - z_min) // stride
+            slab[k:k + len(z)] = slices[cut]
+
+    else:
+        raise ValueError('{0} plane unknown.'.format(plane))
+
+    if thickness == 1:
+        return np.squeeze(slab, axis=('XY', 'XZ', 'YZ').index(plane))
+    return slab
+
+def readmidplanes(filename, slice_x=None, slice_y=None, slice_z=None, stride=1, z_min=0, z_size=None, header=None):
+    """
+    Read the three orthogonal planes through given point of an ISQ file in one sequential pass.
+    The output can be passed to recon_utils.plot_midplanes and recon_utils.writemidplanes.
+
+    Args:
+        filename (str): Path to the ISQ file.
+        slice_x, slice_y, slice_z (int, optional): Plane indices (0-based). Default to the mid-planes.
+        stride (int, optional): Sampling stride along all axes. Defaults to 1.
+        z_min (int, optional): First slice. Defaults to 0.
+        z_size (int, optional): Number of slices. Defaults to all slices from z_min.
+        header (dict, optional): Header information from readheader.
+
+    Returns:
+        tuple: (XY, XZ, YZ) planes.
+    """
+    if header is None:
+        header = readheader(filename)
+    if z_size is None:
+        z_size = header['z_dim'] - z_min
+    z_max = z_min + z_size
+    if slice_x is None:
+        slice_x = header['x_dim'] // 2
+    if slice_y is None:
+        slice_y = header['y_dim'] // 2
+    if slice_z is None:
+        slice_z = z_min + z_size // 2
+
+    XY = np.array(ISQmemmap(filename, header)[slice_z, ::stride, ::stride], dtype=np.int16)
+    n_z = len(range(z_min, z_max, stride))
+    XZ = np.empty((n_z, len(range(0, header['x_dim'], stride))), dtype=np.int16)
+    YZ = np.empty((n_z, len(range(0, header['y_dim'], stride))), dtype=np.int16)
+
+    for z, slices in readslices(filename, z_min, z_max, stride, header):
+        k = (z[0] - z_min) // stride
+        XZ[k:k + len(z)] = slices[:, slice_y, ::stride]
+        YZ[k:k + len(z)] = slices[:, ::stride, slice_x]
+
+    return XY, XZ, YZ
+
+def _downsample2(data):
+    """
+    2x box mean along all axes. Odd dimensions are padded repeating the last element.
+    """
+    pad = [(0, n % 2) for n in data.shape]
+    if any(p for _, p in pad):
+        data = np.pad(data, pad, mode='edge')
+    z, y, x = data.shape
+    sums = data.reshape(z // 2, 2, y // 2, 2, x // 2, 2).sum(axis=(1, 3, 5), dtype=np.float64)
+    mean = sums / 8
+    if np.issubdtype(data.dtype, np.integer):
+        mean = np.rint(mean)
+    return mean.astype(data.dtype)
+
+def ISQ2zarr(filename, group, chunk_size=(128, 512, 512), levels=4, compressor='default', z_size=None, overwrite=True):
+    """
+    Convert ISQ file to a zarr multiscale image (OME-Zarr 0.4 layout) without loading the whole scan.
+    The scan is streamed in blocks of chunk_size[0] slices and chunk_size[1] rows. The levels of the pyramid
+    (2x, 4x, 8x, ..) are computed in the same pass by 2x box mean of the previous level. The chunks of level L are
+    2**L times smaller along z and y, so that each block writes whole chunks at every level (each chunk is
+    compressed and written once). Data is stored as native int16. Memory use is a few blocks.
+
+    Args:
+        filename (str): Path to the ISQ file.
+        group (zarr.hierarchy.Group or str): Output zarr group or path of the group.
+        chunk_size (tuple, optional): Chunk size (z, y, x) of the full resolution level. Level L has chunks
+                                      (chunk_size[0] // 2**L, chunk_size[1] // 2**L, chunk_size[2]).
+                                      chunk_size[0] and chunk_size[1] must be divisible by 2**(levels-1).
+                                      Defaults to (128, 512, 512).
+        levels (int, optional): Number of pyramid levels including full resolution. Defaults to 4.
+        compressor (optional): zarr compressor (e.g. numcodecs.Blosc(cname='zstd', clevel=3)). Defaults to the zarr default.
+        z_size (int, optional): Number of slices to convert. Defaults to all slices.
+        overwrite (bool, optional): Overwrite existing arrays. Defaults to True.
+
+    Returns:
+        zarr.hierarchy.Group: Group containing the arrays '0', '1', .. and the attributes 'multiscales' and 'ISQheader'.
+    """
+    import zarr
+
+    header = readheader(filename)
+    data = ISQmemmap(filename, header)
+    if z_size is not None:
+        data = data[:z_size]
+
+    if isinstance(group, str):
+        group = zarr.open_group(group, mode='a')
+
+    factor = 2 ** (levels - 1)
+    if chunk_size[0] % factor or chunk_size[1] % factor:
+        raise ValueError('chunk_size[0] and chunk_size[1] must be divisible by {0}.'.format(factor))
+
+    # pyramid arrays
+    shape = data.shape
+    arrays = []
+    for level in range(levels):
+        # chunks matching the downsampled blocks
+        chunks = (chunk_size[0] >> level, chunk_size[1] >> level, chunk_size[2])
+        arrays.append(group.create_dataset(str(level), shape=shape, chunks=chunks, dtype=np.int16,
+                                           compressor=compressor, overwrite=overwrite))
+        shape = tuple((n + 1) // 2 for n in shape)
+
+    print('Converting ISQ data to zarr...')
+    for z0 in range(0, data.shape[0], chunk_size[0]):
+        for y0 in range(0, data.shape[1], chunk_size[1]):
+            block = np.array(data[z0:z0 + chunk_size[0], y0:y0 + chunk_size[1], :], dtype=np.int16)
+            for level, array in enumerate(arrays):
+                if level > 0:
+                    block = _downsample2(block)
+                z, y = z0 >> level, y0 >> level
+                array[z:z + block.shape[0], y:y + block.shape[1], :] = block
+    print(' done!')
+
+    # metadata
+    voxel_size = [header['z_dim_um'] / header['z_dim'], header['y_dim_um'] / header['y_dim'],
+                  header['x_dim_um'] / header['x_dim']]
+    datasets = []
+    for level in range(levels):
+        scale = [float(s * 2 ** level) for s in voxel_size]
+        # voxel centers of the downsampled levels are shifted by half of the binned voxels
+        translation = [float(s * (2 ** level - 1) / 2) for s in voxel_size]
+        datasets.append({'path': str(level),
+                         'coordinateTransformations': [{'type': 'scale', 'scale': scale},
+                                                       {'type': 'translation', 'translation': translation}]})
+
+    group.attrs['multiscales'] = [{
+        'version': '0.4',
+        'name': header['samplename'],
+        'axes': [{'name': axis, 'type': 'space', 'unit': 'micrometer'} for axis in 'zyx'],
+        'datasets': datasets,
+        'type': 'mean',
+    }]
+    group.attrs['ISQheader'] = {key: int(value) if isinstance(value, np.integer) else value
+                                for key, value in header.items()}
+
+    return group
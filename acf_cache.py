@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Content-addressed on-disk cache of the ROI ACFs and fabric ellipsoids of fabric_pointset.
+Entries are .npz files in a local directory, optionally compressed with fast deflate (level 1).
+The least recently used entries are evicted when the size of the cache exceeds max_bytes.
+
+Cache levels:
+    'acf': float32 ACF of each ROI. The key is the hash of the ROI data, ROIsize and FFT backend.
+        Reruns with different ACF thresholds, zoom settings or fit methods skip the FFTs.
+    'fit': fitted ellipsoid (evecs, radii) of each point. The key is the hash of the image identity, ROI bounds and
+        of all fabric parameters. Reruns skip reading the ROIs and the whole fabric computation.
+
+"""
+
+__author__ = ["Gianluca Iori"]
+__date__ = "2026-10-17"
+__copyright__ = "Copyright (c) 2024, ORMIR"
+__docformat__ = "restructuredtext en"
+__license__ = "GPL"
+__version__ = "1.4"
+__maintainer__ = "Gianluca Iori"
+__email__ = "gianthk.iori@gmail.com"
+
+import os
+import glob
+import hashlib
+import threading
+import zipfile
+import numpy as np
+
+
+def _update(h, item):
+    """Feed item into the hash h."""
+
+    if isinstance(item, np.ndarray):
+        h.update(repr((item.shape, item.dtype.str)).encode())
+        h.update(np.ascontiguousarray(item).data)
+    elif isinstance(item, (tuple, list)):
+        h.update(b"(")
+        for i in item:
+            _update(h, i)
+        h.update(b")")
+    else:
+        h.update(repr(item).encode())
+        h.update(b",")
+
+
+def cache_key(*items):
+    """Hex digest of the content of items (arrays, numbers, strings and nested tuples or lists of them)."""
+
+    h = hashlib.blake2b(digest_size=20)
+    for item in items:
+        _update(h, item)
+    return h.hexdigest()
+
+
+def image_key(I, slab_size=64):
+    """Identity of a 3D image for the keys of the 'fit' cache level.
+    np.memmap and h5py datasets are identified by file name, size and modification time.
+    Other arrays (numpy arrays, zarr arrays, ..) by the hash of their content, read in slabs of slab_size slices.
+
+    Parameters
+    ----------
+    I
+        3D image data.
+    slab_size : int
+        Number of slices hashed at once.
+
+    Returns
+    -------
+    key : str
+        Image key.
+    """
+
+    filename = None
+    if isinstance(I, np.memmap) and I.filename is not None:
+        filename, name = I.filename, I.offset
+    elif hasattr(I, "file") and hasattr(I.file, "filename"):
+        # h5py dataset
+        filename, name = I.file.filename, I.name
+
+    if filename is not None:
+        stat = os.stat(filename)
+        return cache_key(
+            os.path.realpath(filename),
+            name,
+            tuple(I.shape),
+            np.dtype(I.dtype).str,
+            stat.st_size,
+            stat.st_mtime_ns,
+        )
+
+    h = hashlib.blake2b(digest_size=20)
+    _update(h, (tuple(I.shape), np.dtype(I.dtype).str))
+    for z in range(0, I.shape[0], slab_size):
+        _update(h, np.asarray(I[z : z + slab_size]))
+    return h.hexdigest()
+
+
+class ACFCache:
+    """On-disk LRU cache of ROI ACFs or fabric ellipsoids. Safe for concurrent threads and processes.
+
+    Parameters
+    ----------
+    directory : str
+        Cache directory. Created if not existing. Entries of previous runs are reused.
+    max_bytes : int
+        Maximum size of the cache on disk in bytes. Defaults to 4 GB.
+    level : str
+        'acf' (cache the ACF of each ROI) or 'fit' (cache the fitted ellipsoid of each point).
+    compress : bool
+        Compress the entries (about 0.4x the size of float32 ACFs). Defaults to False: reading a compressed ACF
+        costs about as much as recomputing it, uncompressed entries are about 8x faster to read.
+    """
+
+    def __init__(self, directory, max_bytes=2**32, level="acf", compress=False):
+        if level not in ["acf", "fit"]:
+            raise IOError("{0} cache level unknown.".format(level))
+
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.level = level
+        self.compress = compress
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._nbytes = sum(size for path, size, mtime in self._entries())
+
+    def __getstate__(self):
+        # the lock is not picklable (worker processes)
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "ACFCache('{0}', level='{1}'): {2} hits, {3} misses ({4:.0%} hit rate)".format(
+            self.directory, self.level, self.hits, self.misses, self.hit_rate
+        )
+
+    @property
+    def hit_rate(self):
+        """Fraction of get calls served by the cache."""
+
+        n = self.hits + self.misses
+        return self.hits / n if n > 0 else 0.0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def _entries(self):
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, "*.npz")):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime_ns))
+        return entries
+
+    def get(self, key):
+        """Cached arrays of key.
+
+        Returns
+        -------
+        arrays : dict
+            Arrays stored with put, or None if key is not in the cache.
+        """
+
+        path = self._path(key)
+        try:
+            with np.load(path) as f:
+                arrays = {name: f[name] for name in f.files}
+            # last use time for the LRU eviction
+            os.utime(path)
+        except (OSError, ValueError, zipfile.BadZipFile):
+            # missing, evicted or partially written entry
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return arrays
+
+    def put(self, key, **arrays):
+        """Store arrays under key. The least recently used entries are evicted if the cache exceeds max_bytes."""
+
+        path = self._path(key)
+        # write to a private file and rename: readers never see partial entries
+        tmp = "{0}.{1}.{2}.tmp".format(path, os.getpid(), threading.get_ident())
+        # np.savez_compressed uses the slow default deflate level
+        compression = zipfile.ZIP_DEFLATED if self.compress else zipfile.ZIP_STORED
+        with zipfile.ZipFile(tmp, "w", compression=compression, compresslevel=1) as f:
+            for name, array in arrays.items():
+                with f.open(name + ".npy", "w", force_zip64=True) as npy:
+                    np.lib.format.write_array(npy, np.asanyarray(array))
+        size = os.path.getsize(tmp)
+        try:
+            # overwritten entry
+            size -= os.path.getsize(path)
+        except FileNotFoundError:
+            pass
+        os.replace(tmp, path)
+
+        with self._lock:
+            self._nbytes += size
+            evict = self._nbytes > self.max_bytes
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in max_bytes."""
+
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda entry: entry[2])
+            nbytes = sum(size for path, size, mtime in entries)
+            for path, size, mtime in entries:
+                if nbytes <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                nbytes -= size
+            self._nbytes = nbytes
+
+    def clear(self):
+        """Remove all entries and reset the hit statistics."""
+
+        with self._lock:
+            for path, size, mtime in self._entries():
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self._nbytes = 0
+            self.hits = 0
+            self.misses = 0
@@ -13,30 +13,42 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 def data_regularize(data, type="spherical", divs=10):
-    limits = np.array([
-        [min(data[:, 0]), max(data[:, 0])],
-        [min(data[:, 1]), max(data[:, 1])],
-        [min(data[:, 2]), max(data[:, 2])]])
-        
-    regularized = []
+    """Regularize point cloud: points are replaced by the mean of the points in each sector.
+    All points are binned in one pass (np.digitize) and the sector means are computed with np.bincount.
+
+    Parameters
+    ----------
+    data : ndarray
+        (Nx3) Points [X, Y, Z].
+    type : str
+        'cubic': mean of the points in each cube of a (divs-1)^3 grid over the bounding box of the data.
+        'spherical': mean of the points in each spherical sector ((divs-1) polar x (2*divs-1) azimuthal sectors)
+        around the center of the bounding box.
+    divs : int
+        Number of divisions.
+
+    Returns
+    -------
+    regularized : ndarray
+        (Mx3) Mean points of the non-empty sectors.
+    """
+    limits = np.stack([np.min(data, axis=0), np.max(data, axis=0)], axis=1)
 
     if type == "cubic": # take mean from points in the cube
-        
+
         X = np.linspace(*limits[0], num=divs)
         Y = np.linspace(*limits[1], num=divs)
         Z = np.linspace(*limits[2], num=divs)
 
-        for i in range(divs-1):
-            for j in range(divs-1):
-                for k in range(divs-1):
-                    points_in_sector = []
-                    for point in data:
-                        if (point[0] >= X[i] and point[0] < X[i+1] and
-                                point[1] >= Y[j] and point[1] < Y[j+1] and
-                                point[2] >= Z[k] and point[2] < Z[k+1]):
-                            points_in_sector.append(point)
-                    if len(points_in_sector) > 0:
-                        regularized.append(np.mean(np.array(points_in_sector), axis=0))
+        # sector index of each point; points on the upper limit of the grid are excluded
+        i = np.digitize(data[:, 0], X) - 1
+        j = np.digitize(data[:, 1], Y) - 1
+        k = np.digitize(data[:, 2], Z) - 1
+        inside = ((i >= 0) & (i < divs - 1) &
+                  (j >= 0) & (j < divs - 1) &
+                  (k >= 0) & (k < divs - 1))
+        sector = (i * (divs - 1) + j) * (divs - 1) + k
+        n_sectors = (divs - 1) ** 3
 
     elif type == "spherical": #take mean from points in the sector
         divs_u = divs 
@@ -50,34 +62,34 @@ def data_regularize(data, type="spherical", divs=10):
     
         #spherical coordinates around center
         r_s = np.sqrt(d_c[:, 0]**2. + d_c[:, 1]**2. + d_c[:, 2]**2.)
-        d_s = np.array([
-            r_s,
-            np.arccos(d_c[:, 2] / r_s),
-            np.arctan2(d_c[:, 1], d_c[:, 0])]).T
+        with np.errstate(invalid="ignore", divide="ignore"):
+            d_s = np.array([
+                r_s,
+                np.arccos(d_c[:, 2] / r_s),
+                np.arctan2(d_c[:, 1], d_c[:, 0])]).T
 
         u = np.linspace(0, np.pi, num=divs_u)
         v = np.linspace(-np.pi, np.pi, num=divs_v)
 
-        for i in range(divs_u - 1):
-            for j in range(divs_v - 1):
-                points_in_sector = []
-                for k, point in enumerate(d_s):
-                    if (point[1] >= u[i] and point[1] < u[i + 1] and
-                            point[2] >= v[j] and point[2] < v[j + 1]):
-                        points_in_sector.append(data[k])
-
-                if len(points_in_sector) > 0:
-                    regularized.append(np.mean(np.array(points_in_sector), axis=0))
-# Other strategy of finding mean values in sectors
-#                    p_sec = np.array(points_in_sector)
-#                    R = np.mean(p_sec[:,0])
-#                    U = (u[i] + u[i+1])*0.5
-#                    V = (v[j] + v[j+1])*0.5
-#                    x = R*math.sin(U)*math.cos(V)
-#                    y = R*math.sin(U)*math.sin(V)
-#                    z = R*math.cos(U)
-#                    regularized.append(center + np.array([x,y,z]))
-    return np.array(regularized)
+        # sector index of each point; points in the center (undefined angles) are excluded
+        i = np.digitize(d_s[:, 1], u) - 1
+        j = np.digitize(d_s[:, 2], v) - 1
+        inside = ((i >= 0) & (i < divs_u - 1) &
+                  (j >= 0) & (j < divs_v - 1))
+        sector = i * (divs_v - 1) + j
+        n_sectors = (divs_u - 1) * (divs_v - 1)
+
+    else:
+        return np.array([])
+
+    # mean of the points in each sector
+    sector = sector[inside]
+    counts = np.bincount(sector, minlength=n_sectors)
+    sums = np.stack([np.bincount(sector, weights=data[inside, c], minlength=n_sectors)
+                     for c in range(3)], axis=1)
+    non_empty = counts > 0
+
+    return sums[non_empty] / counts[non_empty, None]
 
 # https://github.com/minillinim/ellipsoid
 def ellipsoid_plot(center, radii, rotation, ax=None, plot_axes=False, cage_color='b', cage_alpha=0.2):
@@ -159,3 +171,132 @@ def ellipsoid_fit(X):
 
     return center, evecs, radii, v
 
+
+def ellipsoid_fit_batch(X, offsets):
+    """Fit ellipsoids to a ragged set of point clouds at once.
+    Vectorized version of ellipsoid_fit: the 9x9 normal equations of all point clouds are built with
+    segmented (zero-padded, batched) matrix products, solved with one stacked np.linalg.solve and the 3x3 ellipsoid matrices
+    are eigendecomposed with one stacked np.linalg.eigh.
+
+    Parameters
+    ----------
+    X : ndarray
+        (Nx3) Concatenated point clouds [X, Y, Z].
+    offsets : ndarray
+        (B+1) Start index of each point cloud in X. offsets[-1] is the total number of points.
+
+    Returns
+    -------
+    center : ndarray
+        (Bx3) Ellipsoid centers.
+    evecs : ndarray
+        (Bx3x3) Ellipsoid eigenvectors as rows (same convention as ellipsoid_fit).
+        Eigenvectors are sorted by ascending eigenvalue.
+    radii : ndarray
+        (Bx3) Ellipsoid radii.
+    v : ndarray
+        (Bx10) Ellipsoid algebraic parameters.
+        Point clouds with less than 9 points or a singular fit return NaNs.
+    """
+    offsets = np.asarray(offsets, dtype=np.intp)
+    X = np.asarray(X, dtype=np.float64)[:offsets[-1]]
+    n_fits = offsets.shape[0] - 1
+
+    center = np.full((n_fits, 3), np.nan)
+    evecs = np.full((n_fits, 3, 3), np.nan)
+    radii = np.full((n_fits, 3), np.nan)
+    v = np.full((n_fits, 10), np.nan)
+
+    counts = np.diff(offsets)
+    valid = counts >= 9
+    if not np.any(valid):
+        return center, evecs, radii, v
+
+    # normal equations of each point cloud with batched matrix products.
+    # point clouds sorted by size are zero-padded to equal size in blocks of at most block_size points
+    block_size = 2 ** 16
+    clouds = np.flatnonzero(valid)[np.argsort(counts[valid], kind="stable")]
+    counts_sorted = counts[clouds]
+    starts_sorted = np.concatenate([[0], np.cumsum(counts_sorted)])
+    cloud = np.repeat(np.arange(clouds.shape[0]), counts_sorted)
+    pos = np.arange(starts_sorted[-1]) - starts_sorted[cloud]
+    points = offsets[clouds][cloud] + pos
+
+    G = np.empty((n_fits, 10, 10))
+    i = 0
+    while i < clouds.shape[0]:
+        cost = np.arange(1, clouds.shape[0] - i + 1) * counts_sorted[i:]
+        j = i + max(1, np.searchsorted(cost, block_size, side="right"))
+        block = slice(starts_sorted[i], starts_sorted[j])
+        X_pad = np.zeros((j - i, 3, counts_sorted[j - 1]))
+        X_pad[cloud[block] - i, :, pos[block]] = X[points[block]]
+        x = X_pad[:, 0, :]
+        y = X_pad[:, 1, :]
+        z = X_pad[:, 2, :]
+        D = np.stack([x * x + y * y - 2 * z * z,
+                      x * x + z * z - 2 * y * y,
+                      2 * x * y,
+                      2 * x * z,
+                      2 * y * z,
+                      2 * x,
+                      2 * y,
+                      2 * z,
+                      np.arange(x.shape[1]) < counts_sorted[i:j, None],  # zero on padding
+                      x * x + y * y + z * z], axis=1)  # rhs for LLSQ in the last row
+        G[clouds[i:j]] = D @ np.swapaxes(D, 1, 2)
+        i = j
+    DD = G[valid, :9, :9]
+    Dd2 = G[valid, :9, 9]
+
+    u = _solve_batch(DD, Dd2)
+    a = u[:, 0] + 1 * u[:, 1] - 1
+    b = u[:, 0] - 2 * u[:, 1] - 1
+    c = u[:, 1] - 2 * u[:, 0] - 1
+    v_valid = np.concatenate([a[:, None], b[:, None], c[:, None], u[:, 2:]], axis=1)
+
+    A = np.empty((v_valid.shape[0], 4, 4))
+    A[:, [0, 1, 2, 3], [0, 1, 2, 3]] = v_valid[:, [0, 1, 2, 9]]
+    A[:, 0, 1] = A[:, 1, 0] = v_valid[:, 3]
+    A[:, 0, 2] = A[:, 2, 0] = v_valid[:, 4]
+    A[:, 1, 2] = A[:, 2, 1] = v_valid[:, 5]
+    A[:, 0, 3] = A[:, 3, 0] = v_valid[:, 6]
+    A[:, 1, 3] = A[:, 3, 1] = v_valid[:, 7]
+    A[:, 2, 3] = A[:, 3, 2] = v_valid[:, 8]
+
+    center_valid = _solve_batch(- A[:, :3, :3], v_valid[:, 6:9])
+
+    translation_matrix = np.tile(np.eye(4), (v_valid.shape[0], 1, 1))
+    translation_matrix[:, 3, :3] = center_valid
+
+    R = translation_matrix @ A @ np.swapaxes(translation_matrix, 1, 2)
+
+    M = R[:, :3, :3] / - R[:, 3, 3, None, None]
+    finite = np.all(np.isfinite(M), axis=(1, 2))
+    evals_valid = np.full((M.shape[0], 3), np.nan)
+    evecs_valid = np.full((M.shape[0], 3, 3), np.nan)
+    evals_valid[finite], evecs_valid[finite] = np.linalg.eigh(M[finite])
+    evecs_valid = np.swapaxes(evecs_valid, 1, 2)
+
+    radii_valid = np.sqrt(1. / np.abs(evals_valid))
+    radii_valid *= np.sign(evals_valid)
+
+    center[valid] = center_valid
+    evecs[valid] = evecs_valid
+    radii[valid] = radii_valid
+    v[valid] = v_valid
+
+    return center, evecs, radii, v
+
+
+def _solve_batch(a, b):
+    """Stacked np.linalg.solve. Singular systems return NaNs instead of raising LinAlgError."""
+    try:
+        return np.linalg.solve(a, b[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        x = np.full(b.shape, np.nan)
+        for k in range(a.shape[0]):
+            try:
+                x[k] = np.linalg.solve(a[k], b[k])
+            except np.linalg.LinAlgError:
+                pass
+        return x
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+FFT backends for the computation of the 3D Auto Correlation Function (ACF).
+Each backend keeps the zero-padded FFT input buffer of every FFT shape. Repeated ACFs of equal-size ROIs
+therefore do not allocate and zero the padding from scratch.
+
+Available backends:
+    'numpy': numpy.fft. The half spectrum is written in a scratch buffer.
+    'scipy': scipy.fft (multi-threaded through workers). pocketfft caches the FFT plans; the spectrum is allocated
+        by scipy.fft at each call (no output argument).
+    'pyfftw': pyFFTW (multi-threaded FFTW plans). FFTW plans and all their buffers are reused. Requires pyFFTW module.
+
+"""
+
+__author__ = ["Gianluca Iori"]
+__date__ = "2026-10-17"
+__copyright__ = "Copyright (c) 2024, ORMIR"
+__docformat__ = "restructuredtext en"
+__license__ = "GPL"
+__version__ = "1.4"
+__maintainer__ = "Gianluca Iori"
+__email__ = "gianthk.iori@gmail.com"
+
+import os
+import importlib.util
+from abc import ABC, abstractmethod
+import threading
+import numpy as np
+
+_backends = {}
+
+
+class FFTBackend(ABC):
+    """Real-to-complex 3D FFTs with scratch buffers cached per FFT shape and thread.
+    The FFTs transform the last three axes. Leading axes are batch axes (stacks of equally sized images).
+
+    Parameters
+    ----------
+    workers : int
+        Number of threads of each FFT. Defaults to 1.
+    """
+
+    name = None
+
+    def __init__(self, workers=None):
+        if workers is None:
+            workers = 1
+        elif workers < 0:
+            workers = os.cpu_count()
+        self.workers = workers
+        self._local = threading.local()
+
+    def _scratch(self):
+        if not hasattr(self._local, "buffers"):
+            self._local.buffers = {}
+        return self._local.buffers
+
+    def _empty(self, shape, dtype):
+        return np.empty(shape, dtype=dtype)
+
+    def real_buffer(self, fft_shape, dtype):
+        """Zero-initialized real input buffer of the forward FFT for given FFT shape.
+
+        Parameters
+        ----------
+        fft_shape : tuple
+            FFT shape (with leading batch axes).
+        dtype
+            np.float32 or np.float64.
+
+        Returns
+        -------
+        buffer : ndarray
+            Scratch buffer. The buffer is reused by the next call with the same FFT shape and dtype.
+        """
+
+        key = ("real", fft_shape, np.dtype(dtype).str)
+        buffers = self._scratch()
+        if key not in buffers:
+            buffers[key] = self._empty(fft_shape, dtype)
+            buffers[key][...] = 0
+        return buffers[key]
+
+    def spectrum_buffer(self, fft_shape, dtype):
+        """Scratch buffer of the (Hermitian) half spectrum for given FFT shape."""
+
+        key = ("spectrum", fft_shape, np.dtype(dtype).str)
+        buffers = self._scratch()
+        if key not in buffers:
+            shape = fft_shape[:-1] + (fft_shape[-1] // 2 + 1,)
+            buffers[key] = self._empty(shape, np.result_type(dtype, np.complex64))
+        return buffers[key]
+
+    @abstractmethod
+    def rfftn(self, a):
+        """Forward real-to-complex FFT of the real buffer a.
+
+        Returns
+        -------
+        F : ndarray
+            Half spectrum. May be a scratch buffer of the backend.
+        """
+
+    @abstractmethod
+    def irfftn(self, F, fft_shape):
+        """Inverse complex-to-real FFT. F may be overwritten.
+
+        Returns
+        -------
+        a : ndarray
+            Real array of shape F.shape[:-3] + fft_shape owned by the caller.
+        """
+
+
+class NumpyFFT(FFTBackend):
+    """numpy.fft backend. The FFTs are single-threaded."""
+
+    name = "numpy"
+
+    def rfftn(self, a):
+        F = self.spectrum_buffer(a.shape, a.dtype)
+        return np.fft.rfftn(a, axes=(-3, -2, -1), out=F)
+
+    def irfftn(self, F, fft_shape):
+        return np.fft.irfftn(F, s=fft_shape, axes=(-3, -2, -1))
+
+
+class ScipyFFT(FFTBackend):
+    """scipy.fft backend. pocketfft caches the FFT plans internally. The spectrum is allocated at each call."""
+
+    name = "scipy"
+
+    def __init__(self, workers=None):
+        super().__init__(workers)
+        import scipy.fft
+
+        self._fft = scipy.fft
+
+    def rfftn(self, a):
+        return self._fft.rfftn(a, axes=(-3, -2, -1), workers=self.workers)
+
+    def irfftn(self, F, fft_shape):
+        return self._fft.irfftn(
+            F, s=fft_shape, axes=(-3, -2, -1), workers=self.workers, overwrite_x=True
+        )
+
+
+class PyFFTW(FFTBackend):
+    """pyFFTW backend. FFTW plans are computed once per FFT shape and executed on SIMD aligned buffers.
+
+    Parameters
+    ----------
+    workers : int
+        Number of FFTW threads.
+    planner_effort : str
+        FFTW planner flag ('FFTW_ESTIMATE', 'FFTW_MEASURE', ..).
+    """
+
+    name = "pyfftw"
+
+    def __init__(self, workers=None, planner_effort="FFTW_MEASURE"):
+        super().__init__(workers)
+        import pyfftw
+
+        self._pyfftw = pyfftw
+        self.planner_effort = planner_effort
+
+    def _empty(self, shape, dtype):
+        return self._pyfftw.empty_aligned(shape, dtype=dtype)
+
+    def _plans(self, fft_shape, dtype):
+        key = ("plans", fft_shape, np.dtype(dtype).str)
+        buffers = self._scratch()
+        if key not in buffers:
+            # planning overwrites the arrays: plan on dedicated buffers before use
+            a = self._empty(fft_shape, dtype)
+            F = self._empty(
+                fft_shape[:-1] + (fft_shape[-1] // 2 + 1,),
+                np.result_type(dtype, np.complex64),
+            )
+            b = self._empty(fft_shape, dtype)
+            forward = self._pyfftw.FFTW(
+                a,
+                F,
+                axes=(-3, -2, -1),
+                direction="FFTW_FORWARD",
+                flags=(self.planner_effort,),
+                threads=self.workers,
+            )
+            backward = self._pyfftw.FFTW(
+                F,
+                b,
+                axes=(-3, -2, -1),
+                direction="FFTW_BACKWARD",
+                flags=(self.planner_effort, "FFTW_DESTROY_INPUT"),
+                threads=self.workers,
+            )
+            a[...] = 0
+            buffers[key] = (forward, backward)
+        return buffers[key]
+
+    def real_buffer(self, fft_shape, dtype):
+        return self._plans(fft_shape, dtype)[0].input_array
+
+    def rfftn(self, a):
+        forward = self._plans(a.shape, a.dtype)[0]
+        if a is not forward.input_array:
+            forward.input_array[...] = a
+        forward.execute()
+        return forward.output_array
+
+    def irfftn(self, F, fft_shape):
+        backward = self._plans(F.shape[:-3] + tuple(fft_shape), F.real.dtype)[1]
+        if F is not backward.input_array:
+            backward.input_array[...] = F
+        return backward().copy()
+
+
+def get_backend(backend=None, workers=None):
+    """Get FFT backend. Backend instances are cached by name and number of workers.
+
+    Parameters
+    ----------
+    backend : str or FFTBackend
+        'numpy', 'scipy' or 'pyfftw'. If None (default), scipy.fft is used.
+    workers : int
+        Number of FFT threads. -1 uses all CPUs.
+
+    Returns
+    -------
+    backend : FFTBackend
+        FFT backend.
+    """
+
+    if isinstance(backend, FFTBackend):
+        return backend
+
+    if backend is None:
+        backend = "scipy"
+
+    if backend == "pyfftw" and importlib.util.find_spec("pyfftw") is None:
+        import warnings
+
+        warnings.warn("pyfftw module not found. Switching to scipy FFT backend")
+        backend = "scipy"
+
+    key = (backend, workers)
+    if key not in _backends:
+        if backend == "numpy":
+            _backends[key] = NumpyFFT(workers)
+        elif backend == "scipy":
+            _backends[key] = ScipyFFT(workers)
+        elif backend == "pyfftw":
+            _backends[key] = PyFFTW(workers)
+        else:
+            raise IOError("{0} FFT backend unknown.".format(backend))
+
+    return _backends[key]
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+3D integral image (summed-area table) for fast Region Of Interest (ROI) statistics of large images.
+Box sums, means (e.g. BV/TV of a binary image) and mask coverage of any number of ROIs are computed with 8 table lookups
+per ROI, independent of the ROI size.
+
+"""
+
+__author__ = ["Gianluca Iori"]
+__date__ = "2026-10-17"
+__copyright__ = "Copyright (c) 2024, ORMIR"
+__docformat__ = "restructuredtext en"
+__license__ = "GPL"
+__version__ = "1.4"
+__maintainer__ = "Gianluca Iori"
+__email__ = "gianthk.iori@gmail.com"
+
+import json
+import numpy as np
+
+
+class IntegralImage:
+    """3D integral image (summed-area table).
+    The table is zero-padded at the start of each axis: table[k, j, i] is the sum of the image over
+    [:k*binning, :j*binning, :i*binning].
+
+    With binning > 1 the table is computed on the block sums of the image (binning^3 times smaller). Queries on box
+    bounds aligned to the bins are exact; other bounds are interpolated assuming uniform values within each bin.
+
+    Parameters
+    ----------
+    table : ndarray
+        Summed-area table (can be a np.memmap).
+    shape : tuple
+        Image shape [Z, Y, X].
+    binning : int
+        Binning of the table.
+    """
+
+    def __init__(self, table, shape, binning=1):
+        self.table = table
+        self.shape = tuple(int(n) for n in shape)
+        self.binning = int(binning)
+        # voxel coordinates of the bin edges for each axis
+        self._edges = [
+            np.minimum(np.arange(m) * self.binning, n)
+            for m, n in zip(table.shape, self.shape)
+        ]
+
+    @classmethod
+    def from_image(cls, data, binning=1, filename=None, chunk_size=64):
+        """Compute the integral image of a 3D image chunk-wise along z.
+
+        Parameters
+        ----------
+        data
+            3D image [Z, Y, X]. Any array supporting slicing (numpy array, np.memmap, zarr array, ..).
+            Boolean data (masks) are counted.
+        binning : int
+            Binning of the table.
+        filename : str
+            Store the table as .npy file (written through a memory map) with the image shape and binning in filename + '.json'.
+        chunk_size : int
+            Number of table slices computed at once (chunk_size * binning image slices are read at once).
+
+        Returns
+        -------
+        integral_image : IntegralImage
+        """
+
+        if np.issubdtype(data.dtype, np.floating):
+            dtype = np.float64
+        else:
+            dtype = np.int64
+
+        builder = IntegralImageBuilder(data.shape, binning, dtype, filename)
+        step = chunk_size * builder.binning
+        for z0 in range(0, data.shape[0], step):
+            builder.append(np.asarray(data[z0 : z0 + step]))
+        return builder.finish()
+
+    @classmethod
+    def load(cls, filename, mmap_mode="r"):
+        """Load integral image stored by from_image.
+
+        Parameters
+        ----------
+        filename : str
+            .npy table file.
+        mmap_mode : str
+            Memory map mode of the table (None loads the table in memory).
+        """
+
+        with open(filename + ".json") as f:
+            meta = json.load(f)
+        return cls(
+            np.load(filename, mmap_mode=mmap_mode), meta["shape"], meta["binning"]
+        )
+
+    def _table_at(self, z, y, x):
+        """Table values at voxel coordinates (vectorized). Coordinates are clipped to the image."""
+
+        coors = [
+            np.clip(np.asarray(c, dtype=np.float64), 0, n)
+            for c, n in zip((z, y, x), self.shape)
+        ]
+
+        if self.binning == 1:
+            return self.table[tuple(c.astype(np.intp) for c in coors)]
+
+        # trilinear interpolation of the table between the bin edges
+        lower, weights = [], []
+        for c, edges in zip(coors, self._edges):
+            f = np.interp(c, edges, np.arange(len(edges)))
+            i0 = np.minimum(np.floor(f).astype(np.intp), len(edges) - 2)
+            lower.append(i0)
+            weights.append(f - i0)
+
+        value = 0
+        for dz in (0, 1):
+            wz = weights[0] if dz else 1 - weights[0]
+            for dy in (0, 1):
+                wy = weights[1] if dy else 1 - weights[1]
+                for dx in (0, 1):
+                    wx = weights[2] if dx else 1 - weights[2]
+                    value = (
+                        value
+                        + wz
+                        * wy
+                        * wx
+                        * self.table[lower[0] + dz, lower[1] + dy, lower[2] + dx]
+                    )
+        return value
+
+    def box_sum(self, z0, z1, y0, y1, x0, x1):
+        """Sum of the image over the boxes [z0:z1, y0:y1, x0:x1]. Vectorized over arrays of boxes.
+        Boxes are clipped to the image."""
+
+        t = self._table_at
+        return (
+            t(z1, y1, x1)
+            - t(z0, y1, x1)
+            - t(z1, y0, x1)
+            - t(z1, y1, x0)
+            + t(z0, y0, x1)
+            + t(z0, y1, x0)
+            + t(z1, y0, x0)
+            - t(z0, y0, x0)
+        )
+
+    def volume(self, z0, z1, y0, y1, x0, x1):
+        """Number of voxels of the boxes inside the image."""
+
+        size = 1
+        for c0, c1, n in zip((z0, y0, x0), (z1, y1, x1), self.shape):
+            size = size * np.maximum(
+                np.clip(np.asarray(c1), 0, n) - np.clip(np.asarray(c0), 0, n), 0
+            )
+        return size
+
+    def mean(self, z0, z1, y0, y1, x0, x1):
+        """Mean of the image over the boxes. For binary images this is the fraction of True voxels (e.g. BV/TV or mask coverage).
+        Empty boxes return NaN."""
+
+        volume = self.volume(z0, z1, y0, y1, x0, x1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.box_sum(z0, z1, y0, y1, x0, x1) / volume
+
+    def occupied(self, z0, z1, y0, y1, x0, x1, fraction=1.0):
+        """True for the boxes whose mean is at least fraction (binary images: boxes with at least fraction of True voxels)."""
+
+        # tolerance for the floating point sums
+        return self.mean(z0, z1, y0, y1, x0, x1) >= fraction - 1e-9
+
+
+class IntegralImageBuilder:
+    """Incremental construction of an IntegralImage from consecutive z-chunks of an image.
+    Used to build integral images of images computed on the fly (e.g. gradient products) without storing them.
+
+    Parameters
+    ----------
+    shape : tuple
+        Image shape [Z, Y, X].
+    binning : int
+        Binning of the table.
+    dtype
+        Data type of the table (np.int64 or np.float64).
+    filename : str
+        Store the table as .npy file (see IntegralImage.from_image).
+    """
+
+    def __init__(self, shape, binning=1, dtype=np.float64, filename=None):
+        self.shape = tuple(int(n) for n in shape)
+        self.binning = int(binning)
+        self.dtype = np.dtype(dtype)
+        self.filename = filename
+        self.table_shape = tuple(-(-n // self.binning) + 1 for n in self.shape)
+
+        if filename is None:
+            self.table = np.zeros(self.table_shape, dtype=self.dtype)
+        else:
+            self.table = np.lib.format.open_memmap(
+                filename, mode="w+", dtype=self.dtype, shape=self.table_shape
+            )
+            self.table[0] = 0
+            self.table[:, 0] = 0
+            self.table[:, :, 0] = 0
+
+        self._starts = [np.arange(0, n, self.binning) for n in self.shape[1:]]
+        self._plane = np.zeros(self.table_shape[1:], dtype=self.dtype)
+        self._z = 0
+
+    def append(self, chunk):
+        """Add the next z-chunk of the image. All chunks but the last must have a multiple of binning slices."""
+
+        b = self.binning
+        if self._z % b:
+            raise ValueError("Chunks must have a multiple of binning slices.")
+        chunk = np.asarray(chunk).astype(self.dtype, copy=False)
+        k0 = self._z // b
+        self._z += chunk.shape[0]
+
+        # block sums
+        if b > 1:
+            chunk = np.add.reduceat(chunk, np.arange(0, chunk.shape[0], b), axis=0)
+            chunk = np.add.reduceat(chunk, self._starts[0], axis=1)
+            chunk = np.add.reduceat(chunk, self._starts[1], axis=2)
+
+        # cumulative sums: the last plane of the previous chunk continues the sum along z
+        sums = np.zeros((chunk.shape[0],) + self.table_shape[1:], dtype=self.dtype)
+        np.cumsum(chunk, axis=0, out=sums[:, 1:, 1:])
+        np.cumsum(sums[:, 1:, 1:], axis=1, out=sums[:, 1:, 1:])
+        np.cumsum(sums[:, 1:, 1:], axis=2, out=sums[:, 1:, 1:])
+        sums += self._plane
+        self.table[k0 + 1 : k0 + 1 + sums.shape[0]] = sums
+        self._plane = sums[-1]
+
+    def finish(self):
+        """Integral image of the appended chunks."""
+
+        if self._z != self.shape[0]:
+            raise ValueError(
+                "{0} of {1} slices appended.".format(self._z, self.shape[0])
+            )
+        if self.filename is not None:
+            self.table.flush()
+            with open(self.filename + ".json", "w") as f:
+                json.dump({"shape": self.shape, "binning": self.binning}, f)
+
+        return IntegralImage(self.table, self.shape, self.binning)
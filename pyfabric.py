@@ -25,11 +25,20 @@ from tqdm.contrib import itertools
 from scipy import ndimage
 import matplotlib.pyplot as plt
 import importlib
+import functools
+import os
+import mmap
+import threading
+import collections
+import fft_backend as fftb
+import acf_cache
+from integral_image import IntegralImage, IntegralImageBuilder
+from scipy.fft import next_fast_len
 
 #################################################################################
 
 
-def ACF(I):
+def ACF(I, method="rfft", fast_len=True, shape=None, backend=None, workers=None):
     """Calculate 3D Auto Correlation Function (ACF) of given image.
     Taking advantage of the Wiener–Khintchine theorem (https://mathworld.wolfram.com/Wiener-KhinchinTheorem.html)
     the ACF is computed in the Fourier domain as:
@@ -42,6 +51,19 @@ def ACF(I):
     ----------
     I
         3D image.
+    method : str
+        'rfft': Real-to-complex FFT (default). 8 and 16 bit images are processed in single precision.
+        'fftn': Full complex FFT in double precision.
+    fast_len : bool
+        Zero-pad the image to the next even 5-smooth FFT size before the transform (method='rfft' only).
+        Typical ROI sizes (40, 50, 60, 100..) are already fast sizes and are not padded.
+    shape : [int, int, int]
+        Canonical FFT shape (method='rfft' only). Smaller images (e.g. ROIs clipped at the image boundary) are zero-padded
+        to this shape so that they reuse the FFT plan and buffers of the full-size ROIs.
+    backend : str or fft_backend.FFTBackend
+        FFT backend for method='rfft': 'numpy', 'scipy' (default) or 'pyfftw'.
+    workers : int
+        Number of FFT threads (method='rfft' only). -1 uses all CPUs.
 
     Returns
     -------
@@ -49,8 +71,122 @@ def ACF(I):
         3D Auto Correlation Function.
     """
 
-    Ev = np.fft.fftshift(np.fft.fftn(I))
-    return np.abs(np.fft.ifftshift(np.fft.ifftn(Ev * np.conj(Ev))))
+    if method == "rfft":
+        return ACF_rfft(
+            I, fast_len=fast_len, shape=shape, backend=backend, workers=workers
+        )
+
+    elif method == "fftn":
+        Ev = np.fft.fftshift(np.fft.fftn(I))
+        return np.abs(np.fft.ifftshift(np.fft.ifftn(Ev * np.conj(Ev))))
+
+    else:
+        raise IOError("{0} method unknown.".format(method))
+
+
+def ACF_rfft(I, fast_len=True, shape=None, backend=None, workers=None):
+    """Calculate 3D Auto Correlation Function (ACF) of given image using real-to-complex FFTs.
+    The power spectrum of a real image is Hermitian: only half of it is computed with rfftn and transformed back with irfftn.
+    |F|^2 is computed in place in the FFT output buffer. The ACF is centered by modulating the power spectrum
+    with a (-1)^(k0+k1+k2) checkerboard instead of shifting the ACF in the spatial domain.
+    Images with 8 or 16 bit integer data are processed in single precision (float32/complex64).
+    Scratch buffers (and FFTW plans) are cached by the FFT backend for each FFT shape.
+
+    Parameters
+    ----------
+    I
+        3D image.
+    fast_len : bool
+        Zero-pad the image to the next even 5-smooth FFT size before the transform.
+    shape : [int, int, int]
+        Canonical FFT shape. Smaller images are zero-padded to this shape.
+    backend : str or fft_backend.FFTBackend
+        FFT backend: 'numpy', 'scipy' (default) or 'pyfftw'.
+    workers : int
+        Number of FFT threads. -1 uses all CPUs.
+
+    Returns
+    -------
+    ACF
+        3D Auto Correlation Function. The ACF has the same shape as I and its zero lag lies at the same voxel as for ACF(I, method='fftn').
+    """
+
+    I = np.asarray(I)
+    if I.dtype.itemsize <= 2 or I.dtype == np.float32:
+        dtype = np.float32
+    else:
+        dtype = np.float64
+
+    if shape is None:
+        shape = I.shape
+    else:
+        shape = tuple(max(n, m) for n, m in zip(shape, I.shape))
+
+    if fast_len:
+        # even FFT sizes allow centering the ACF in the Fourier domain
+        fft_shape = tuple(2 * next_fast_len((n + 1) // 2, real=True) for n in shape)
+    else:
+        fft_shape = tuple(shape)
+
+    fft = fftb.get_backend(backend, workers)
+
+    # copy the image in the zero-padded FFT input buffer
+    a = fft.real_buffer(fft_shape, dtype)
+    n0, n1, n2 = I.shape
+    a[n0:] = 0
+    a[:n0, n1:] = 0
+    a[:n0, :n1, n2:] = 0
+    a[:n0, :n1, :n2] = I
+
+    return _ACF_centered(fft, a, fft_shape, I.shape)
+
+
+def _ACF_centered(fft, a, fft_shape, shape):
+    """Centered ACF of the zero-padded real FFT input buffer a. Leading axes of a are batch axes.
+    The ACF is cropped to shape around its zero lag.
+    """
+
+    F = fft.rfftn(a)
+
+    # |F|^2 and centering of the ACF in one pass; the result is written in the real part of F
+    F_re = F.real
+    F_im = F.imag
+    s0, s1, s2 = _checkerboard(F.shape[-3:], fft_shape, a.dtype.type)
+    ne.evaluate("(F_re*F_re + F_im*F_im) * s0 * s1 * s2", out=F_re)
+    F_im[...] = 0
+
+    I_ACF = fft.irfftn(F, fft_shape)
+    np.abs(I_ACF, out=I_ACF)
+
+    # odd FFT sizes cannot be centered with the checkerboard
+    odd_axes = [ax - 3 for ax, n in enumerate(fft_shape) if n % 2]
+    if odd_axes:
+        I_ACF = np.fft.ifftshift(I_ACF, axes=odd_axes)
+
+    # crop the padded ACF around its zero lag
+    crop = (Ellipsis,) + tuple(
+        (
+            slice(n // 2 - (m - m // 2), n // 2 - (m - m // 2) + m)
+            if n != m
+            else slice(None)
+        )
+        for n, m in zip(fft_shape, shape)
+    )
+    return I_ACF[crop]
+
+
+@functools.lru_cache(maxsize=16)
+def _checkerboard(shape, fft_shape, dtype):
+    """(-1)^k modulation vectors of the power spectrum for each axis. Odd axes of the FFT are not modulated."""
+
+    signs = []
+    for ax, (n, m) in enumerate(zip(shape, fft_shape)):
+        s = np.ones(n, dtype=dtype)
+        if m % 2 == 0:
+            s[1::2] = -1
+        s.flags.writeable = False
+        signs.append(s.reshape([-1 if i == ax else 1 for i in range(len(shape))]))
+    return tuple(signs)
 
 
 def zoom_center(ACF, size=None, zoom_factor=None):
@@ -152,6 +288,202 @@ def envelope(bw, method="marching_cubes"):
     return vertices
 
 
+def ellipsoid_moments(bw, subvoxel=True):
+    """Fit ellipsoid to a binary blob from its voxel second moments (inertia tensor).
+    Mesh-free alternative to envelope + ellipsoid_fit. Only the connected component containing the center of the image
+    (zero lag of the ACF) is considered. For a solid ellipsoid with semi-axes (a, b, c), the eigenvalues of the covariance
+    matrix of the voxel coordinates are (a^2/5, b^2/5, c^2/5).
+
+    Parameters
+    ----------
+    bw : ndarray
+        Binary image.
+    subvoxel : bool
+        Treat voxels as unit cubes instead of points (adds the 1/12 variance of a unit cube to each axis).
+        This places the boundary of the blob half a voxel outside of the boundary voxel centers, as the marching_cubes envelope.
+
+    Returns
+    -------
+    center : float
+        Ellipsoid center [X, Y, Z].
+    evecs : float
+        (3x3) Ellipsoid eigenvectors as rows (same convention as ellipsoid_fit.ellipsoid_fit).
+    radii : float
+        Ellipsoid radii.
+    """
+
+    labels, n_labels = ndimage.label(bw)
+
+    # connected component at the center of the image
+    label = labels[tuple(n - n // 2 for n in bw.shape)]
+    if label == 0:
+        if n_labels == 0:
+            return np.full(3, np.nan), np.full((3, 3), np.nan), np.full(3, np.nan)
+        # largest component
+        label = np.argmax(np.bincount(labels.ravel())[1:]) + 1
+
+    # voxel coordinates [X, Y, Z]
+    z, y, x = np.nonzero(labels == label)
+    coors = np.stack([x, y, z], axis=1).astype(np.float64)
+
+    center = coors.mean(axis=0)
+    coors -= center
+    cov = coors.T @ coors / coors.shape[0]
+    if subvoxel:
+        cov += np.identity(3) / 12
+
+    evals, evecs = np.linalg.eigh(cov)
+    radii = np.sqrt(5 * evals)
+
+    return center, evecs.T, radii
+
+
+def _ellipsoid(
+    bw, method="marching_cubes", scale=1, regularize=None, regularize_divs=10
+):
+    """Fabric ellipsoid of binary ACF.
+
+    Parameters
+    ----------
+    bw : ndarray
+        Binary ACF.
+    method : str
+        'marching_cubes' or 'pymcubes': ellipsoid fit to the envelope of bw.
+        'moments': ellipsoid from the second moments of bw (ellipsoid_moments).
+    scale : float
+        Coordinates of the ellipsoid are divided by scale.
+    regularize : str
+        Regularize the envelope before the fit with ellipsoid_fit.data_regularize ('cubic' or 'spherical').
+    regularize_divs : int
+        Number of divisions of data_regularize.
+
+    Returns
+    -------
+    center : float
+        Ellipsoid center.
+    evecs : float
+        (3x3) Ellipsoid eigenvectors.
+    radii : float
+        Ellipsoid radii.
+    """
+
+    if method == "moments":
+        center, evecs, radii = ellipsoid_moments(bw)
+        return center / scale, evecs, radii / scale
+
+    env_points = envelope(bw, method=method)
+    if regularize is not None:
+        # fit to the sector means of the dense envelope
+        env_points = ef.data_regularize(
+            env_points, type=regularize, divs=regularize_divs
+        )
+    center, evecs, radii, v = ef.ellipsoid_fit(env_points / scale)
+    # center, evecs, radii, v = ef.ellipsoid_fit((env_points*[1,-1,1])/scale)
+
+    return center, evecs, radii
+
+
+def MIL_directions(max_step=2):
+    """Lattice directions for the Mean Intercept Length.
+    All primitive integer vectors with components in [-max_step, max_step]; of each pair of opposite vectors only one is kept.
+
+    Parameters
+    ----------
+    max_step : int
+        Maximum absolute value of the vector components. max_step=2 gives 49 directions.
+
+    Returns
+    -------
+    directions : int
+        (Nx3) Direction vectors [X, Y, Z].
+    """
+
+    r = np.arange(-max_step, max_step + 1)
+    directions = np.stack(np.meshgrid(r, r, r, indexing="ij"), axis=-1).reshape(-1, 3)
+    directions = directions[np.gcd.reduce(directions, axis=1) == 1]
+
+    # first non-zero component positive
+    first = directions[np.arange(len(directions)), np.argmax(directions != 0, axis=1)]
+    return directions[first > 0]
+
+
+def MIL(bw, directions=None):
+    """Mean Intercept Length (MIL) of a binary image along lattice directions.
+    For each direction v the image is compared with itself shifted by v: every voxel pair is a segment of length |v|
+    of a test line, and the pairs with different phase are the intercepts. MIL(v) = |v| * pairs / intercepts.
+
+    Parameters
+    ----------
+    bw : ndarray
+        3D binary image.
+    directions : int
+        (Nx3) Direction vectors [X, Y, Z]. Defaults to MIL_directions().
+
+    Returns
+    -------
+    MIL : float
+        (N) Mean Intercept Length [voxels] for each direction. inf for directions without intercepts.
+    """
+
+    bw = np.asarray(bw, dtype=bool)
+    if directions is None:
+        directions = MIL_directions()
+
+    lengths = np.full(len(directions), np.inf)
+    for i, v in enumerate(directions):
+        # shifted views along [z, y, x]
+        a = tuple(slice(max(-d, 0), n - max(d, 0)) for d, n in zip(v[::-1], bw.shape))
+        b = tuple(slice(max(d, 0), n - max(-d, 0)) for d, n in zip(v[::-1], bw.shape))
+        pairs = bw[a].size
+        intercepts = np.count_nonzero(bw[a] != bw[b])
+        if intercepts > 0:
+            lengths[i] = np.linalg.norm(v) * pairs / intercepts
+
+    return lengths
+
+
+def MIL_ellipsoid(bw, directions=None):
+    """Fabric ellipsoid of a binary image from the Mean Intercept Length.
+    The ellipsoid is fitted with ellipsoid_fit.ellipsoid_fit to the points +/-MIL(v) * v/|v|.
+
+    Parameters
+    ----------
+    bw : ndarray
+        3D binary image.
+    directions : int
+        (Nx3) Direction vectors [X, Y, Z]. Defaults to MIL_directions().
+
+    Returns
+    -------
+    center : float
+        Ellipsoid center.
+    evecs : float
+        (3x3) Ellipsoid eigenvectors.
+    radii : float
+        Ellipsoid radii [voxels].
+    """
+
+    if directions is None:
+        directions = MIL_directions()
+
+    lengths = MIL(bw, directions)
+    valid = np.isfinite(lengths)
+    if np.count_nonzero(valid) < 9:
+        return np.full(3, np.nan), np.full((3, 3), np.nan), np.full(3, np.nan)
+
+    points = (
+        lengths[valid, None]
+        * directions[valid]
+        / np.linalg.norm(directions[valid], axis=1)[:, None]
+    )
+    try:
+        center, evecs, radii, v = ef.ellipsoid_fit(np.concatenate([points, -points]))
+    except np.linalg.LinAlgError:
+        return np.full(3, np.nan), np.full((3, 3), np.nan), np.full(3, np.nan)
+
+    return center, evecs, radii
+
+
 def set_axes_equal(ax):
     """Make axes of 3D plot have equal scale so that spheres appear as spheres,
     cubes as cubes, etc..  This is one possible solution to Matplotlib's
@@ -217,11 +549,11 @@ def to01(I):
     data_max = np.nanmax(I)
     df = np.float32(data_max - data_min)
     mn = np.float32(data_min)
-    scl = ne.evaluate("(I-mn)/df", truediv=True)
-    return scl.astype(np.float32)
+    # float32 output: no further copy
+    return ne.evaluate("(I-mn)/df", truediv=True)
 
 
-def to01andbinary(I, t):
+def to01andbinary(I, t, data_range=None):
     """Normalize data to 0-1 range and segment with given threshold.
 
     Parameters
@@ -230,6 +562,8 @@ def to01andbinary(I, t):
         Input data.
     t : float
         Threshold in the 0-1 range.
+    data_range : tuple
+        Precomputed (min, max) of the data. Reuse it when segmenting the same data with several thresholds.
 
     Returns
     -------
@@ -238,14 +572,121 @@ def to01andbinary(I, t):
     """
 
     I = I.astype(np.float32, copy=False)
-    data_min = np.nanmin(I)
-    data_max = np.nanmax(I)
+    if data_range is None:
+        data_min = np.nanmin(I)
+        data_max = np.nanmax(I)
+    else:
+        data_min, data_max = data_range
     df = np.float32(data_max - data_min)
     mn = np.float32(data_min)
     scl = ne.evaluate("(I-mn)/df > t", truediv=True)
     return scl.astype(np.bool)
 
 
+def _radius_limits(ROIsize, ROIzoom, zoom_factor):
+    """Valid range of the ACF ellipsoid radii (radius_max, radius_min).
+    Any ellipsoid with a radius > ROIsize/2 is an outlier. Radii < 1 voxel are meaningless.
+    Without zoom the radii are in units of ROIsize."""
+
+    if ROIzoom:
+        if zoom_factor is None:
+            # default of zoom_center
+            zoom_factor = 2
+        return ROIsize * zoom_factor / 2, 1
+    return 1 / 2, 1 / ROIsize
+
+
+def _mask_binning(bounds, shape):
+    """Largest binning of the integral image of a mask for which all ROI bounds [z0, z1, y0, y1, x0, x1] lie on the
+    bin edges: the mask coverage of the ROIs is exact (see integral_image.IntegralImage) with binning^3 times less memory.
+    Bounds clipped to the image end are not considered (the last bin ends at the image end).
+    """
+
+    binning = 0
+    for axis, n in enumerate(shape):
+        c = np.asarray(bounds)[:, 2 * axis : 2 * axis + 2].ravel()
+        c = c[(c != n) & (c != n - 1)]
+        if c.size:
+            binning = np.gcd(binning, np.gcd.reduce(c))
+    return max(int(binning), 1)
+
+
+def fabric_components(evecs, radii, radius_max=np.inf, radius_min=0, dtype=np.float32):
+    """Fabric tensor components, eigenvalues and Degree of Anisotropy of a set of fabric ellipsoids.
+    Vectorized post-processing of fabric_pointset and fabric_snake. Can be applied to externally computed ellipsoids.
+
+    Parameters
+    ----------
+    evecs : float
+        (Nx3x3) Ellipsoid eigenvectors.
+    radii : float
+        (Nx3) Ellipsoid radii.
+    radius_max : float
+        Ellipsoids with a radius > radius_max are outliers (NaN output).
+        fabric_pointset uses ROIsize*zoom_factor/2 (zoomed ACF) or 1/2 (ACF without zoom: radii in units of ROIsize).
+    radius_min : float
+        Ellipsoids with a radius < radius_min are outliers (NaN output).
+        fabric_pointset uses 1 voxel (zoomed ACF) or 1/ROIsize (ACF without zoom).
+    dtype
+        Data type of the outputs. Defaults to np.float32.
+
+    Returns
+    -------
+    evecs : float
+        (Nx3x3) Ellipsoid eigenvectors.
+    radii : float
+        (Nx3) Absolute ellipsoid radii.
+    evals : float
+        (Nx3) Ellipsoid eigenvalues.
+    fabric_comp : float
+        (Nx6) Ellipsoid tensor components with order: XX, YY, ZZ, XY, YZ, XZ
+    DA : float
+        (N) Degree of Anisotropy (ratio between major and minor fabric ellipsoid axes)
+    """
+
+    n_points = radii.shape[0]
+    evecs_out = np.empty([n_points, 3, 3], dtype=dtype)
+    radii_out = np.empty([n_points, 3], dtype=dtype)
+    evals = np.empty([n_points, 3], dtype=dtype)
+    fabric_comp = np.empty([n_points, 6], dtype=dtype)
+    DA = np.empty(n_points, dtype=dtype)
+
+    evecs_out[...] = evecs
+
+    # take abs value of the radii vector
+    np.abs(radii, out=radii_out, casting="unsafe")
+
+    # compute Degree of Anisotropy
+    with np.errstate(invalid="ignore", divide="ignore"):
+        np.divide(np.max(radii_out, 1), np.min(radii_out, 1), out=DA)
+
+    # Remove potential outliers based on the ellipsoid radii
+    with np.errstate(invalid="ignore"):
+        idx = np.any(radii_out > radius_max, axis=1) | np.any(
+            radii_out < radius_min, axis=1
+        )
+    radii_out[idx, :] = np.nan
+    DA[idx] = np.nan
+
+    # Ellipsoid eigenvalues
+    with np.errstate(divide="ignore"):
+        np.divide(1, radii_out**2, out=evals)
+
+    # Symmetric ellipsoid tensor components: sum_k evals_k v_k v_k.T with the eigenvectors v_k as rows
+    # (evecs.T @ diag(evals) @ evecs). Independent of the sign and order of the eigenvectors.
+    # one einsum per component on strided views (no copies of the eigenvectors)
+    for c, (i, j) in enumerate([(0, 0), (1, 1), (2, 2), (0, 1), (1, 2), (0, 2)]):
+        np.einsum(
+            "nk,nk,nk->n",
+            evecs_out[:, :, i],
+            evals,
+            evecs_out[:, :, j],
+            out=fabric_comp[:, c],
+        )
+
+    return evecs_out, radii_out, evals, fabric_comp, DA
+
+
 def fabric_snake(
     I,
     ROIspacing,
@@ -255,8 +696,23 @@ def fabric_snake(
     ROIzoom=False,
     zoom_size=None,
     zoom_factor=None,
+    method="marching_cubes",
+    regularize=None,
+    regularize_divs=10,
+    mask_coverage=1.0,
+    mask_binning=None,
+    batch_size=64,
+    fft_backend=None,
+    fft_workers=None,
+    fabric_method="ACF",
+    ST_sigma=1.0,
+    ST_binning=None,
+    ST_filename=None,
 ):
     """Compute fabric tensor of an image using a snake method.
+    The fabric is computed for the ROIs centered on a regular grid with ROIspacing.
+    ROIs are processed in batches: the ACFs of a batch are computed with one stacked FFT and the ellipsoids are fitted with
+    ellipsoid_fit.ellipsoid_fit_batch. ROIs outside of I_mask are skipped with a summed-area table of the mask (O(1) per ROI).
 
     Parameters
     ----------
@@ -265,10 +721,12 @@ def fabric_snake(
     ROIspacing
         Spacing of the Region Of Interest for the analysis.
         Based on the image size and on ROIspacing the analysis is performed on a structured grif of size (N_slices x N_cols x N_rows).
+        Grid point [k, j, i] has voxel coordinates [z, y, x] = (ROIspacing * ([k, j, i] + 1)).
+        The outputs can be exported as VTK image with origin and spacing equal to ROIspacing.
     ROIsize
         Size of the Region Of Interest for the analysis.
     I_mask
-        3D binary mask with the same size as image data.
+        3D binary mask with the same size as image data, or its IntegralImage.
     ACF_threshold : int
         ACF threshold value (0-1 range).
     ROIzoom : bool
@@ -277,11 +735,39 @@ def fabric_snake(
         Size of the zoomed center.
     zoom_factor
         Zoom factor for imresize.
+    method : str
+        Ellipsoid fit method: 'marching_cubes', 'pymcubes' or 'moments' (see fabric_pointset).
+    regularize : str
+        Regularize the ACF envelope before the ellipsoid fit ('cubic' or 'spherical').
+    regularize_divs : int
+        Number of divisions of the envelope regularization.
+    mask_coverage : float
+        Minimum fraction of ROI voxels inside I_mask. Defaults to 1 (ROIs touching the masked part are skipped).
+    mask_binning : int
+        Binning of the integral image of I_mask. Defaults to the largest binning with the ROI bounds of the grid on the
+        bin edges (exact coverage, e.g. 6 for ROIspacing=12 and ROIsize=12).
+    batch_size : int
+        Number of ROIs processed together.
+    fft_backend : str
+        FFT backend of the ACF: 'numpy', 'scipy' (default) or 'pyfftw'.
+        FFT plans and buffers are reused by all ROIs. ROIs clipped at the image boundary are padded to ROIsize.
+    fft_workers : int
+        Number of FFT threads. -1 uses all CPUs.
+    fabric_method : str
+        'ACF': Fit of the ellipsoid to the thresholded Auto Correlation Function of each ROI (default).
+        'structure_tensor': Gradient structure tensor integrated over each ROI (see fabric_structure_tensor).
+        The gradient is computed once for the whole image and each ROI costs O(1). The ACF parameters are ignored.
+    ST_sigma : float
+        Gradient scale of the structure tensor.
+    ST_binning : int
+        Binning of the integral images of the structure tensor components. Defaults to ROIsize // 16 (at least 1).
+    ST_filename : str
+        Store the integral images of the structure tensor components as files (see structure_tensor).
 
     Returns
     -------
     evecs : float
-        (N_slices x N_cols x N_rows x 3 x 3) Fabric tensor eigenvectors as the columns of a 3x3 matrix for each point in pointset.
+        (N_slices x N_cols x N_rows x 3 x 3) Fabric tensor eigenvectors as the rows of a 3x3 matrix for each point in pointset.
     radii : float
         (N_slices x N_cols x N_rows x 3) Ellipsoid radii.
     evals : float
@@ -290,126 +776,1005 @@ def fabric_snake(
         (N_slices x N_cols x N_rows x 6) Ellipsoid tensor components with order: XX, YY, ZZ, XY, YZ, XZ
     Danis : float
         (N_slices x N_cols x N_rows) Degree of Anisotropy (ratio between major and minor fabric ellipsoid axes)
+        Skipped ROIs are NaN.
     """
 
     if ROIsize > ROIspacing:
-        raise ValueError()
+        raise ValueError("ROIsize cannot be larger than ROIspacing.")
 
     # parameters
-    halfROIsize = ROIsize / 2
-    # I_size = [I.shape[0] - 1, I.shape[1] - 1, I.shape[2] - 1]
     I_size = [I.shape[0], I.shape[1], I.shape[2]]
-    # point_count = 0
 
     id2 = range(ROIspacing, I_size[2] - ROIspacing, ROIspacing)
     id1 = range(ROIspacing, I_size[1] - ROIspacing, ROIspacing)
     id0 = range(ROIspacing, I_size[0] - ROIspacing, ROIspacing)
-    # n_points = len(id2) * len(id1) * len(id0)
-    print(len(id0), len(id1), len(id2))
+    grid_shape = (len(id0), len(id1), len(id2))
+
+    # grid points [x, y, z] and ROI extremes
+    zz, yy, xx = np.meshgrid(id0, id1, id2, indexing="ij")
+    points = np.stack([xx.ravel(), yy.ravel(), zz.ravel()], axis=1)
+    bounds = np.array([_ROI_bounds(p, ROIsize, I_size) for p in points], dtype=np.int64)
+
+    # skip ROIs outside of the mask
+    if I_mask is None:
+        active = np.ones(points.shape[0], dtype=bool)
+    else:
+        if not isinstance(I_mask, IntegralImage):
+            if mask_binning is None:
+                mask_binning = _mask_binning(bounds, I.shape)
+            I_mask = IntegralImage.from_image(I_mask, binning=mask_binning)
+        active = I_mask.occupied(*bounds.T, fraction=mask_coverage)
+
+    if fabric_method == "structure_tensor":
+        tensor = structure_tensor(
+            I,
+            sigma=ST_sigma,
+            binning=_ST_binning(ROIsize, ST_binning),
+            filename=ST_filename,
+        )
+        results = _fabric_structure_tensor(tensor, bounds)
+        for r in results:
+            r[~active] = np.nan
+        return tuple(r.reshape(grid_shape + r.shape[1:]) for r in results)
+    elif fabric_method != "ACF":
+        raise IOError("{0} fabric method unknown.".format(fabric_method))
 
     # initialize output variables
-    Danis = np.zeros([len(id0), len(id1), len(id2)])
-    evecs = np.zeros([len(id0), len(id1), len(id2), 3, 3])
-    radii = np.zeros([len(id0), len(id1), len(id2), 3])
-    fabric_tens = np.ndarray(evecs.shape)
-    fabric_comp = np.ndarray([evecs.shape[0], evecs.shape[1], evecs.shape[2], 6])
+    n_points = points.shape[0]
+    evecs = np.full([n_points, 3, 3], np.nan)
+    radii = np.full([n_points, 3], np.nan)
+
+    kwargs = dict(
+        ACF_threshold=ACF_threshold,
+        ROIzoom=ROIzoom,
+        zoom_size=zoom_size,
+        zoom_factor=zoom_factor,
+        method=method,
+        regularize=regularize,
+        regularize_divs=regularize_divs,
+        fft_backend=fft_backend,
+        fft_workers=fft_workers,
+    )
 
-    if ROIzoom:
-        # loop all points in the set
-        for id0i, id1i, id2i in itertools.product(id0, id1, id2):
-            # for id0i in tqdm(id0):
-            #     for id1i in tqdm(id1):
-            #         for id2i in tqdm(id2):
-            # ROI extreemes
-            x0 = round(id2i - halfROIsize)
-            y0 = round(id1i - halfROIsize)
-            z0 = round(id0i - halfROIsize)
-
-            x1 = x0 + ROIsize
-            y1 = y0 + ROIsize
-            z1 = z0 + ROIsize
-
-            # check if ROI exceeds image limits
-            if x0 < 0:
-                x0 = 0
-            if y0 < 0:
-                y0 = 0
-            if z0 < 0:
-                z0 = 0
-            if x1 > I_size[2]:
-                x1 = I_size[2]
-            if y1 > I_size[1]:
-                y1 = I_size[1]
-            if z1 > I_size[0]:
-                z1 = I_size[0]
-
-            # # skip ROIs touching the masked part
-            # if np.any(I_mask[z0:z1, y0:y1, x0:x1] == 0):
-            #     continue
-
-            # extract ROI around point p
-            ROI = I[z0:z1, y0:y1, x0:x1]
-
-            # calculate ACF
-            ROIACF = ACF(ROI)
-
-            # # zoom ACF center
-            # ROIACF = zoom_center(
-            #     ROIACF, size=zoom_size, zoom_factor=zoom_factor
-            # )  # check if size of the zoom can be reduced
-
-            # envelope of normalized ACF center
-            # env_points = envelope(to01(ROIACF)>ACF_threshold)
-            env_points = envelope(to01andbinary(ROIACF, ACF_threshold))
-
-            # ellipsoid fit
-            (
-                center,
-                evecs[id0i, id1i, id2i, :, :],
-                radii[id0i, id1i, id2i, :],
-                v,
-            ) = ef.ellipsoid_fit(env_points)
-            # center, evecs[point_count, :, :], radii[point_count, :], v = ef.ellipsoid_fit(env_points*[1,-1,1])
-
-            # point_count = point_count + 1
-
-            # take abs value of the radii vector
-            radii[id0i, id1i, id2i, :] = np.abs(radii[id0i, id1i, id2i, :])
-
-            # compute Degree of Anisotropy
-            Danis[id0i, id1i, id2i] = np.max(radii[id0i, id1i, id2i, :], 1) / np.min(
-                radii[id0i, id1i, id2i, :], 1
+    # loop batches of ROIs
+    indices = np.flatnonzero(active)
+    for start in tqdm(range(0, len(indices), batch_size)):
+        batch = indices[start : start + batch_size]
+        ROIs = [I[z0:z1, y0:y1, x0:x1] for z0, z1, y0, y1, x0, x1 in bounds[batch]]
+        evecs[batch], radii[batch] = _fabric_batch(ROIs, ROIsize, **kwargs)
+
+    evecs, radii, evals, fabric_comp, Danis = fabric_components(
+        evecs, radii, *_radius_limits(ROIsize, ROIzoom, zoom_factor)
+    )
+
+    return (
+        evecs.reshape(grid_shape + (3, 3)),
+        radii.reshape(grid_shape + (3,)),
+        evals.reshape(grid_shape + (3,)),
+        fabric_comp.reshape(grid_shape + (6,)),
+        Danis.reshape(grid_shape),
+    )
+
+
+def ACF_batch(ROIs, fast_len=True, backend=None, workers=None):
+    """Calculate the 3D ACFs of a stack of equally sized images with one batched real-to-complex FFT.
+    Same result as ACF_rfft for each image.
+
+    Parameters
+    ----------
+    ROIs
+        (B x N0 x N1 x N2) Stack of 3D images.
+    fast_len : bool
+        Zero-pad the images to the next even 5-smooth FFT size before the transform.
+    backend : str or fft_backend.FFTBackend
+        FFT backend: 'numpy', 'scipy' (default) or 'pyfftw'.
+    workers : int
+        Number of FFT threads. -1 uses all CPUs.
+
+    Returns
+    -------
+    ACF
+        (B x N0 x N1 x N2) Auto Correlation Functions.
+    """
+
+    ROIs = np.asarray(ROIs)
+    if ROIs.dtype.itemsize <= 2 or ROIs.dtype == np.float32:
+        dtype = np.float32
+    else:
+        dtype = np.float64
+
+    shape = ROIs.shape[1:]
+    if fast_len:
+        fft_shape = tuple(2 * next_fast_len((n + 1) // 2, real=True) for n in shape)
+    else:
+        fft_shape = tuple(shape)
+
+    fft = fftb.get_backend(backend, workers)
+
+    # copy the images in the zero-padded FFT input buffer
+    a = fft.real_buffer((ROIs.shape[0],) + fft_shape, dtype)
+    n0, n1, n2 = shape
+    a[:, n0:] = 0
+    a[:, :n0, n1:] = 0
+    a[:, :n0, :n1, n2:] = 0
+    a[:, :n0, :n1, :n2] = ROIs
+
+    return _ACF_centered(fft, a, fft_shape, shape)
+
+
+def _fabric_batch(
+    ROIs,
+    ROIsize,
+    ACF_threshold=0.5,
+    ROIzoom=False,
+    zoom_size=None,
+    zoom_factor=None,
+    method="marching_cubes",
+    regularize=None,
+    regularize_divs=10,
+    fft_backend=None,
+    fft_workers=None,
+):
+    """Fabric ellipsoids of a list of ROIs (batched version of _fabric_ROI).
+    ROIs of size ROIsize are processed with ACF_batch; clipped ROIs with ACF. Envelopes are fitted with ellipsoid_fit_batch.
+
+    Returns
+    -------
+    evecs : float
+        (Bx3x3) Ellipsoid eigenvectors.
+    radii : float
+        (Bx3) Ellipsoid radii.
+    """
+
+    n_ROIs = len(ROIs)
+    evecs = np.full([n_ROIs, 3, 3], np.nan)
+    radii = np.full([n_ROIs, 3], np.nan)
+
+    # calculate ACF
+    full = [k for k, ROI in enumerate(ROIs) if ROI.shape == (ROIsize,) * 3]
+    ACFs = [None] * n_ROIs
+    if full:
+        for k, ROIACF in zip(
+            full,
+            ACF_batch(
+                np.stack([ROIs[k] for k in full]),
+                backend=fft_backend,
+                workers=fft_workers,
+            ),
+        ):
+            ACFs[k] = ROIACF
+    for k in range(n_ROIs):
+        if ACFs[k] is None:
+            ACFs[k] = ACF(
+                ROIs[k], shape=[ROIsize] * 3, backend=fft_backend, workers=fft_workers
             )
 
-            # Remove potential outliers based on the ellipsoid radii:
-            # any ellipsoid with a radius > ROIsize/2 is removed
-            if np.any(radii[id0i, id1i, id2i, :] > ROIsize * zoom_factor / 2, axis=3):
-                radii[id0i, id1i, id2i, :] = np.nan
-                Danis[id0i, id1i, id2i] = np.nan
-
-            # ellipsoid radii < 1 voxel are meaningless
-            if np.any(radii[id0i, id1i, id2i, :] < 1, axis=3):
-                radii[id0i, id1i, id2i, :] = np.nan
-                Danis[id0i, id1i, id2i] = np.nan
-
-            # Ellipsoid eigenvalues
-            evals = 1 / (radii[id0i, id1i, id2i, :] ** 2)
-
-            # Symmetric ellipsoid tensor components
-            # for cell in range(0, evecs.shape[0]):
-            fabric_tens[id0i, id1i, id2i, :, :] = np.matmul(
-                evecs[id0i, id1i, id2i, :, :],
-                np.matmul(
-                    (evals * np.identity(3)),
-                    np.transpose(evecs[id0i, id1i, id2i, :, :]),
-                ),
+    if ROIzoom:
+        # zoom ACF center
+        ACFs = [zoom_center(a, size=zoom_size, zoom_factor=zoom_factor) for a in ACFs]
+        scale = 1
+    else:
+        # the ellipsoid envelope coordinates are scaled to 0-1
+        scale = ROIsize
+
+    # envelope of normalized ACF and ellipsoid fit
+    bws = [to01andbinary(a, ACF_threshold) for a in ACFs]
+
+    if method == "moments":
+        for k, bw in enumerate(bws):
+            center, evecs[k], radii[k] = _ellipsoid(bw, method=method, scale=scale)
+        return evecs, radii
+
+    env_points = []
+    for bw in bws:
+        points = envelope(bw, method=method)
+        if regularize is not None:
+            points = ef.data_regularize(points, type=regularize, divs=regularize_divs)
+        env_points.append(points / scale)
+
+    offsets = np.cumsum([0] + [len(points) for points in env_points])
+    center, evecs, radii, v = ef.ellipsoid_fit_batch(
+        np.concatenate(env_points), offsets
+    )
+
+    return evecs, radii
+
+
+def _ROI_bounds(p, ROIsize, I_size):
+    """ROI extremes [z0, z1, y0, y1, x0, x1] around point p = [x, y, z], clipped to the image limits I_size."""
+
+    halfROIsize = ROIsize / 2
+
+    # ROI extreemes
+    x0 = round(p[0] - halfROIsize)
+    y0 = round(p[1] - halfROIsize)
+    z0 = round(p[2] - halfROIsize)
+
+    x1 = x0 + ROIsize
+    y1 = y0 + ROIsize
+    z1 = z0 + ROIsize
+
+    # check if ROI exceeds image limits
+    if x0 < 0:
+        x0 = 0
+    if y0 < 0:
+        y0 = 0
+    if z0 < 0:
+        z0 = 0
+    if x1 > I_size[2]:
+        x1 = I_size[2]
+    if y1 > I_size[1]:
+        y1 = I_size[1]
+    if z1 > I_size[0]:
+        z1 = I_size[0]
+
+    return z0, z1, y0, y1, x0, x1
+
+
+def _fabric_ROI(
+    ROI,
+    ROIsize,
+    ACF_threshold=0.5,
+    ROIzoom=False,
+    zoom_size=None,
+    zoom_factor=None,
+    method="marching_cubes",
+    regularize=None,
+    regularize_divs=10,
+    fft_backend=None,
+    fft_workers=None,
+    fabric_method="ACF",
+    MIL_threshold=None,
+    ACF_cache=None,
+):
+    """Fabric ellipsoid of one ROI of fabric_pointset.
+
+    Returns
+    -------
+    evecs : float
+        (3x3) Ellipsoid eigenvectors.
+    radii : float
+        (3) Ellipsoid radii.
+    """
+
+    if fabric_method == "MIL":
+        center, evecs, radii = MIL_ellipsoid(np.asarray(ROI) > MIL_threshold)
+        return evecs, radii
+
+    # calculate ACF
+    if ACF_cache is None:
+        ROIACF = ACF(ROI, shape=[ROIsize] * 3, backend=fft_backend, workers=fft_workers)
+    else:
+        ROIACF = _cached_ACF(ROI, ROIsize, ACF_cache, fft_backend, fft_workers)
+
+    if ROIzoom:
+        # zoom ACF center
+        ROIACF = zoom_center(
+            ROIACF, size=zoom_size, zoom_factor=zoom_factor
+        )  # check if size of the zoom can be reduced
+        scale = 1
+    else:
+        # the ellipsoid envelope coordinates are scaled to 0-1
+        scale = ROIsize
+
+    # envelope of normalized ACF and ellipsoid fit
+    # the ACF intensity is normalized to the 0-1 range
+    # env_points = envelope(to01(ROIACF) > ACF_threshold)
+    center, evecs, radii = _ellipsoid(
+        to01andbinary(ROIACF, ACF_threshold),
+        method=method,
+        scale=scale,
+        regularize=regularize,
+        regularize_divs=regularize_divs,
+    )
+
+    return evecs, radii
+
+
+def _cached_ACF(ROI, ROIsize, cache, fft_backend=None, fft_workers=None):
+    """ACF of ROI read from the ACF cache (acf_cache.ACFCache). The key is the hash of the ROI data."""
+
+    ROI = np.asarray(ROI)
+    key = acf_cache.cache_key(
+        ROI, ROIsize, fftb.get_backend(fft_backend, fft_workers).name
+    )
+    cached = cache.get(key)
+    if cached is not None:
+        return cached["ACF"]
+
+    ROIACF = ACF(ROI, shape=[ROIsize] * 3, backend=fft_backend, workers=fft_workers)
+    cache.put(key, ACF=ROIACF.astype(np.float32, copy=False))
+    return ROIACF
+
+
+class _ChunkCache:
+    """Read-through LRU cache of the storage chunks of a chunked array (zarr array, h5py dataset, ..).
+    ROIs are assembled from the cached chunks, so that each chunk is read (and decompressed) once
+    as long as the chunks shared by successive ROIs fit in the cache.
+
+    Parameters
+    ----------
+    data
+        Array-like supporting slicing.
+    chunks : tuple
+        Chunk shape. Defaults to data.chunks.
+    max_bytes : int
+        Maximum size of the cached chunks in bytes.
+    """
+
+    def __init__(self, data, chunks=None, max_bytes=2**31):
+        self.data = data
+        self.shape = tuple(data.shape)
+        self.dtype = np.dtype(data.dtype)
+        self.chunks = tuple(chunks if chunks is not None else data.chunks)
+        self.max_bytes = max_bytes
+        self._cache = collections.OrderedDict()
+        self._nbytes = 0
+        self.reads = 0
+        self.hits = 0
+        # ROIs can be read by concurrent threads: chunks being read are marked by an event
+        self._lock = threading.Lock()
+        self._loading = {}
+
+    def _chunk(self, index):
+        with self._lock:
+            if index in self._cache:
+                self._cache.move_to_end(index)
+                self.hits += 1
+                return self._cache[index]
+            loading = self._loading.get(index)
+            if loading is None:
+                self._loading[index] = threading.Event()
+
+        if loading is not None:
+            # another thread is reading the chunk
+            loading.wait()
+            with self._lock:
+                if index in self._cache:
+                    self.hits += 1
+                    return self._cache[index]
+            return self._chunk(index)
+
+        try:
+            block = np.asarray(
+                self.data[
+                    tuple(
+                        slice(i * c, min((i + 1) * c, n))
+                        for i, c, n in zip(index, self.chunks, self.shape)
+                    )
+                ]
             )
-            fabric_comp[id0i, id1i, id2i, :] = fabric_tens[
-                id0i, id1i, id2i, [0, 1, 2, 0, 1, 0], [0, 1, 2, 1, 2, 2]
-            ]
+            with self._lock:
+                self.reads += 1
+                self._cache[index] = block
+                self._nbytes += block.nbytes
+                while self._nbytes > self.max_bytes and len(self._cache) > 1:
+                    self._nbytes -= self._cache.popitem(last=False)[1].nbytes
+        finally:
+            # release the waiting threads also if the read fails: they retry the read
+            with self._lock:
+                self._loading.pop(index).set()
+        return block
+
+    def __getitem__(self, key):
+        bounds = [s.indices(n)[:2] for s, n in zip(key, self.shape)]
+        out = np.empty([b1 - b0 for b0, b1 in bounds], dtype=self.dtype)
+        ranges = [
+            range(b0 // c, (b1 - 1) // c + 1) if b1 > b0 else range(0)
+            for (b0, b1), c in zip(bounds, self.chunks)
+        ]
+
+        for offset in np.ndindex(*[len(r) for r in ranges]):
+            index = tuple(r[o] for r, o in zip(ranges, offset))
+            block = self._chunk(index)
+            src, dst = [], []
+            for i, c, (b0, b1) in zip(index, self.chunks, bounds):
+                c0 = i * c
+                lo, hi = max(b0, c0), min(b1, c0 + c)
+                src.append(slice(lo - c0, hi - c0))
+                dst.append(slice(lo - b0, hi - b0))
+            out[tuple(dst)] = block[tuple(src)]
+
+        return out
+
+
+def _chunk_order(pointset, ROIsize, chunks):
+    """Order of the points sorting their ROIs by storage chunk (z, y, x)."""
+
+    origin = np.maximum(np.round(np.asarray(pointset) - ROIsize / 2), 0)
+    return np.lexsort(
+        (
+            origin[:, 0] // chunks[2],
+            origin[:, 1] // chunks[1],
+            origin[:, 2] // chunks[0],
+        )
+    )
+
+
+def _ROI_reader(I, ROIsize, cache_size=2**31):
+    """ROI source for fabric_pointset. numpy arrays (and memmaps) are sliced directly.
+    Other array-likes (zarr, h5py, ..) are read through a _ChunkCache of their storage chunks
+    (or of ROIsize blocks if the chunks are unknown).
+
+    Returns
+    -------
+    reader
+        Image or _ChunkCache.
+    chunks : tuple
+        Chunk shape used to order the points. None for numpy arrays.
+    """
+
+    if isinstance(I, (np.ndarray, _ChunkCache)):
+        return I, None
+
+    chunks = getattr(I, "chunks", None)
+    if chunks is None:
+        chunks = (ROIsize,) * 3
+    return _ChunkCache(I, chunks, max_bytes=cache_size), tuple(chunks)
+
+
+def _fabric_points(
+    I,
+    pointset,
+    indices,
+    evecs,
+    radii,
+    ROIsize,
+    progress=False,
+    prefetch=0,
+    read_workers=1,
+    compute_workers=1,
+    done=None,
+    **kwargs,
+):
+    """Fit the fabric ellipsoid of the points pointset[indices]. Results are written in the evecs and radii arrays.
+    If given, done(i, evecs[i], radii[i], error) is called after each point. Failed points are then reported through
+    done with the error message instead of raising the exception."""
+
+    if prefetch > 0:
+        return _fabric_points_pipeline(
+            I,
+            pointset,
+            indices,
+            evecs,
+            radii,
+            ROIsize,
+            progress=progress,
+            prefetch=prefetch,
+            read_workers=read_workers,
+            compute_workers=compute_workers,
+            done=done,
+            **kwargs,
+        )
+
+    I_size = [I.shape[0] - 1, I.shape[1] - 1, I.shape[2] - 1]
+
+    if progress:
+        indices = tqdm(indices)
+
+    # loop all points in the set
+    for i in indices:
+        z0, z1, y0, y1, x0, x1 = _ROI_bounds(pointset[i], ROIsize, I_size)
+
+        # extract ROI around point p
+        ROI = I[z0:z1, y0:y1, x0:x1]
+
+        if done is None:
+            evecs[i, :, :], radii[i, :] = _fabric_ROI(ROI, ROIsize, **kwargs)
+        else:
+            _fabric_point_done(i, ROI, ROIsize, evecs, radii, done, **kwargs)
+
+
+def _fabric_point_done(i, ROI, ROIsize, evecs, radii, done, **kwargs):
+    """Fit the fabric ellipsoid of point i and report it through done(i, evecs[i], radii[i], error)."""
+
+    try:
+        evecs[i, :, :], radii[i, :] = _fabric_ROI(ROI, ROIsize, **kwargs)
+        error = None
+    except Exception as e:
+        evecs[i, :, :] = np.nan
+        radii[i, :] = np.nan
+        error = "{0}: {1}".format(type(e).__name__, e)
+    done(i, evecs[i], radii[i], error)
+
+
+def _fabric_points_pipeline(
+    I,
+    pointset,
+    indices,
+    evecs,
+    radii,
+    ROIsize,
+    progress=False,
+    prefetch=8,
+    read_workers=2,
+    compute_workers=1,
+    done=None,
+    **kwargs,
+):
+    """Staged version of _fabric_points overlapping the ROI reads with the ACF and ellipsoid fit.
+    A pool of read_workers threads prefetches the next ROIs into a queue of at most prefetch ROIs,
+    which is emptied by compute_workers threads.
+
+    Returns
+    -------
+    stats : dict
+        Wall time [s], busy time [s] and utilization (busy time / (wall time * workers)) of the read and compute
+        stages, and the time the compute stage waited for the ROIs.
+    """
+
+    import queue
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    I_size = [I.shape[0] - 1, I.shape[1] - 1, I.shape[2] - 1]
+    ROIs = queue.Queue(maxsize=prefetch)
+    busy = {"read": 0.0, "compute": 0.0, "wait": 0.0}
+    busy_lock = threading.Lock()
+    pbar = tqdm(total=len(indices)) if progress else None
+
+    def read(i):
+        t0 = time.perf_counter()
+        z0, z1, y0, y1, x0, x1 = _ROI_bounds(pointset[i], ROIsize, I_size)
+        ROI = I[z0:z1, y0:y1, x0:x1]
+        with busy_lock:
+            busy["read"] += time.perf_counter() - t0
+        return ROI
+
+    stop = threading.Event()
+
+    def put(item):
+        # the queue bounds the number of ROIs read ahead of the compute stage
+        while not stop.is_set():
+            try:
+                ROIs.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def feed(readers):
+        for i in indices:
+            # a compute failure stops the reads
+            if stop.is_set():
+                return
+            future = readers.submit(read, i)
+            if not put((i, future)):
+                future.cancel()
+                return
+        for _ in range(compute_workers):
+            put(None)
+
+    def compute():
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            try:
+                item = ROIs.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is None:
+                return
+            i, ROI = item
+            try:
+                ROI = ROI.result()
+                t1 = time.perf_counter()
+                if done is None:
+                    evecs[i, :, :], radii[i, :] = _fabric_ROI(ROI, ROIsize, **kwargs)
+                else:
+                    _fabric_point_done(i, ROI, ROIsize, evecs, radii, done, **kwargs)
+            except BaseException:
+                # stop the other stages
+                stop.set()
+                raise
+            t2 = time.perf_counter()
+            with busy_lock:
+                busy["wait"] += t1 - t0
+                busy["compute"] += t2 - t1
+            if pbar is not None:
+                pbar.update(1)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=read_workers) as readers:
+        try:
+            with ThreadPoolExecutor(max_workers=compute_workers + 1) as stages:
+                feeder = stages.submit(feed, readers)
+                workers = [stages.submit(compute) for _ in range(compute_workers)]
+                for future in workers + [feeder]:
+                    future.result()
+        finally:
+            # cancel the reads of the ROIs left in the queue after a failure
+            readers.shutdown(cancel_futures=True)
+    wall = time.perf_counter() - start
+
+    if pbar is not None:
+        pbar.close()
+
+    stats = _merge_pipeline_stats(
+        [
+            {
+                "wall_time": wall,
+                "read_time": busy["read"],
+                "compute_time": busy["compute"],
+                "compute_wait": busy["wait"],
+                "read_workers": read_workers,
+                "compute_workers": compute_workers,
+            }
+        ]
+    )
+    if progress:
+        _print_pipeline_stats(stats)
+    return stats
+
+
+def _merge_pipeline_stats(stats):
+    """Sum the stage times of several runs of _fabric_points_pipeline (e.g. the tasks of the worker processes)
+    and compute the stage utilizations."""
+
+    merged = {
+        key: sum(s[key] for s in stats)
+        for key in ["wall_time", "read_time", "compute_time", "compute_wait"]
+    }
+    merged["read_workers"] = stats[0]["read_workers"]
+    merged["compute_workers"] = stats[0]["compute_workers"]
+    merged["read_utilization"] = merged["read_time"] / max(
+        merged["wall_time"] * merged["read_workers"], 1e-12
+    )
+    merged["compute_utilization"] = merged["compute_time"] / max(
+        merged["wall_time"] * merged["compute_workers"], 1e-12
+    )
+    return merged
+
+
+def _print_pipeline_stats(stats):
+    print(
+        "ROI pipeline: read utilization {0:.0%}, compute utilization {1:.0%}, compute waited {2:.1f} s for ROIs".format(
+            stats["read_utilization"],
+            stats["compute_utilization"],
+            stats["compute_wait"],
+        )
+    )
+
+
+# arrays attached by the fabric_pointset worker processes
+_pool_arrays = {}
+
+
+def _share_array(a=None, shape=None, dtype=None):
+    """Allocate array in shared memory. The array is initialized with a or with zeros.
+
+    Returns
+    -------
+    shm : SharedMemory
+        Shared memory block.
+    spec : tuple
+        Specification for attaching the array in the worker processes.
+    array : ndarray
+        Array backed by the shared memory block.
+    """
+
+    from multiprocessing import shared_memory
+
+    if a is not None:
+        shape, dtype = a.shape, a.dtype
+    dtype = np.dtype(dtype)
+    shm = shared_memory.SharedMemory(
+        create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1)
+    )
+    array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    if a is None:
+        array[...] = 0
+    else:
+        array[...] = a
+
+    return shm, ("shm", shm.name, shape, dtype.str), array
+
+
+def _attach_array(spec):
+    """Attach array in a worker process given its specification."""
+
+    if spec[0] == "shm":
+        from multiprocessing import shared_memory
+
+        name, shape, dtype = spec[1:]
+        shm = shared_memory.SharedMemory(name=name)
+        # keep a reference to the shared memory block for the lifetime of the worker
+        _pool_arrays[name] = shm
+        return np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+    elif spec[0] == "memmap":
+        filename, offset, shape, dtype, order = spec[1:]
+        return np.memmap(
+            filename, mode="r", offset=offset, shape=shape, dtype=dtype, order=order
+        )
+
+    elif spec[0] == "h5py":
+        import h5py
+
+        filename, name = spec[1:]
+        return h5py.File(filename, "r")[name]
 
     else:
-        print("here")
+        return spec[1]
+
+
+def _pool_init(specs, kwargs, cache_size, record_failures=False):
+    # one process per CPU: avoid oversubscription by the numexpr threads
+    ne.set_num_threads(1)
+    for key, spec in specs.items():
+        _pool_arrays[key] = _attach_array(spec)
+    # each worker keeps its own cache of the chunks of its (contiguous) points
+    _pool_arrays["I"], _ = _ROI_reader(_pool_arrays["I"], kwargs["ROIsize"], cache_size)
+    _pool_arrays["kwargs"] = kwargs
+    _pool_arrays["record_failures"] = record_failures
+
+
+def _pool_task(start, stop):
+    failures = {}
+
+    def done(i, evecs_i, radii_i, error):
+        if error is not None:
+            failures[i] = error
+
+    stats = _fabric_points(
+        _pool_arrays["I"],
+        _pool_arrays["pointset"],
+        _pool_arrays["order"][start:stop],
+        _pool_arrays["evecs"],
+        _pool_arrays["radii"],
+        done=done if _pool_arrays["record_failures"] else None,
+        **_pool_arrays["kwargs"],
+    )
+    return start, stop, failures, stats
+
+
+def _n_jobs(n_jobs):
+    """Number of worker processes. -1 uses all CPUs available to the process."""
+
+    if n_jobs is None:
+        return 1
+    if n_jobs < 0:
+        if hasattr(os, "sched_getaffinity"):
+            return len(os.sched_getaffinity(0))
+        return os.cpu_count()
+    return n_jobs
+
+
+def _fabric_points_parallel(
+    I,
+    pointset,
+    evecs,
+    radii,
+    ROIsize,
+    n_jobs,
+    chunksize=None,
+    order=None,
+    cache_size=2**31,
+    done=None,
+    **kwargs,
+):
+    """Process-parallel version of _fabric_points.
+    The image is shared with the worker processes through shared memory (or through its file if I is a np.memmap).
+    Other array-likes (zarr, h5py) are opened by each worker and read through its own chunk cache.
+    The workers process contiguous tasks of the points in given order and write their results directly in shared evecs and radii arrays.
+    If given, done is called for the points of each completed task (see _fabric_points).
+    """
+
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    if order is None:
+        order = np.arange(pointset.shape[0])
+    n_points = len(order)
+    if chunksize is None:
+        chunksize = max(1, min(256, n_points // (4 * n_jobs)))
+
+    shms = []
+    try:
+        specs = {"pointset": ("array", np.asarray(pointset)), "order": ("array", order)}
+
+        if isinstance(I, _ChunkCache):
+            I = I.data
+
+        if isinstance(I, np.memmap) and isinstance(I.base, mmap.mmap):
+            specs["I"] = (
+                "memmap",
+                I.filename,
+                I.offset,
+                I.shape,
+                I.dtype.str,
+                "F" if I.flags.f_contiguous and not I.flags.c_contiguous else "C",
+            )
+        elif isinstance(I, np.ndarray):
+            shm, specs["I"], _ = _share_array(I)
+            shms.append(shm)
+        elif type(I).__module__.startswith("h5py"):
+            specs["I"] = ("h5py", I.file.filename, I.name)
+        else:
+            specs["I"] = ("array", I)
+
+        shm, specs["evecs"], evecs_shared = _share_array(evecs)
+        shms.append(shm)
+        shm, specs["radii"], radii_shared = _share_array(radii)
+        shms.append(shm)
+
+        tasks = [
+            (start, min(start + chunksize, n_points))
+            for start in range(0, n_points, chunksize)
+        ]
+
+        with ProcessPoolExecutor(
+            max_workers=n_jobs,
+            initializer=_pool_init,
+            initargs=(
+                specs,
+                dict(kwargs, ROIsize=ROIsize),
+                cache_size,
+                done is not None,
+            ),
+        ) as executor:
+            futures = [executor.submit(_pool_task, *task) for task in tasks]
+            stats = []
+            with tqdm(total=n_points) as pbar:
+                for future in as_completed(futures):
+                    start, stop, failures, task_stats = future.result()
+                    if task_stats is not None:
+                        stats.append(task_stats)
+                    if done is not None:
+                        for i in order[start:stop]:
+                            done(i, evecs_shared[i], radii_shared[i], failures.get(i))
+                    pbar.update(stop - start)
+
+        evecs[...] = evecs_shared
+        radii[...] = radii_shared
+
+        # ROI pipeline of the worker processes
+        if stats:
+            _print_pipeline_stats(_merge_pipeline_stats(stats))
+
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+
+
+class _Checkpoint:
+    """On-disk results of a resumable fabric_pointset run.
+
+    Parameters
+    ----------
+    directory : str
+        Checkpoint directory. The results of a previous run with the same pointset and parameters are reopened.
+    pointset
+        (Nx3) Points coordinates [x, y, z].
+    ROIsize
+        Size of the Region Of Interest.
+    settings : list
+        Fabric parameters of the run.
+    radius_max, radius_min : float
+        Valid range of the ellipsoid radii (see fabric_components).
+    every : int
+        Number of completed points between flushes.
+    """
+
+    PENDING, DONE, FAILED = 0, 1, 2
+
+    def __init__(
+        self, directory, pointset, ROIsize, settings, radius_max, radius_min, every
+    ):
+        import json
+        from numpy.lib.format import open_memmap
+
+        n_points = pointset.shape[0]
+        meta = {
+            "n_points": n_points,
+            "ROIsize": ROIsize,
+            "settings": repr(settings),
+            "key": acf_cache.cache_key(np.asarray(pointset), ROIsize, settings),
+        }
+
+        os.makedirs(directory, exist_ok=True)
+        meta_file = os.path.join(directory, "meta.json")
+        shapes = {
+            "evecs": (n_points, 3, 3),
+            "radii": (n_points, 3),
+            "fabric_comp": (n_points, 6),
+            "DA": (n_points,),
+        }
+        if os.path.exists(meta_file):
+            with open(meta_file) as f:
+                if json.load(f)["key"] != meta["key"]:
+                    raise ValueError(
+                        "Checkpoint {0} was created for a different pointset or parameters.".format(
+                            directory
+                        )
+                    )
+            mode = "r+"
+        else:
+            mode = "w+"
+
+        for name, shape in shapes.items():
+            setattr(
+                self,
+                name,
+                open_memmap(
+                    os.path.join(directory, name + ".npy"),
+                    mode=mode,
+                    dtype=np.float32,
+                    shape=None if mode == "r+" else shape,
+                ),
+            )
+        self.status = open_memmap(
+            os.path.join(directory, "status.npy"),
+            mode=mode,
+            dtype=np.int8,
+            shape=None if mode == "r+" else (n_points,),
+        )
+        if mode == "w+":
+            # the arrays exist before meta.json: a run killed before this point restarts from scratch
+            for name in shapes:
+                getattr(self, name)[...] = np.nan
+                getattr(self, name).flush()
+            self.status.flush()
+            with open(meta_file, "w") as f:
+                json.dump(meta, f, indent=2)
+
+        self.pointset = pointset
+        self.radius_max = radius_max
+        self.radius_min = radius_min
+        self.every = every
+        self.failures_file = os.path.join(directory, "failures.jsonl")
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def done(self, i, evecs, radii, error=None):
+        """Record the result of point i. Thread-safe."""
+
+        with self._lock:
+            self._pending.append((i, np.array(evecs), np.array(radii), error))
+            if len(self._pending) >= self.every:
+                self._flush()
+
+    def flush(self):
+        """Write the pending results to disk."""
+
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        import json
+
+        if not self._pending:
+            return
+
+        indices = np.array([p[0] for p in self._pending])
+        evecs, radii, evals, fabric_comp, DA = fabric_components(
+            np.stack([p[1] for p in self._pending]),
+            np.stack([p[2] for p in self._pending]),
+            self.radius_max,
+            self.radius_min,
+        )
+        self.evecs[indices] = evecs
+        self.radii[indices] = radii
+        self.fabric_comp[indices] = fabric_comp
+        self.DA[indices] = DA
+        for name in ["evecs", "radii", "fabric_comp", "DA"]:
+            getattr(self, name).flush()
+
+        failures = [(i, error) for i, e, r, error in self._pending if error is not None]
+        if failures:
+            with open(self.failures_file, "a") as f:
+                for i, error in failures:
+                    record = {
+                        "index": int(i),
+                        "point": [float(c) for c in self.pointset[i]],
+                        "error": error,
+                    }
+                    f.write(json.dumps(record) + "\n")
+
+        # the status is written last: a run killed during the flush recomputes the points
+        failed = np.array([error is not None for i, e, r, error in self._pending])
+        self.status[indices] = np.where(failed, self.FAILED, self.DONE)
+        self.status.flush()
+        self._pending = []
 
 
 def fabric_pointset(
@@ -420,13 +1785,35 @@ def fabric_pointset(
     ROIzoom=False,
     zoom_size=None,
     zoom_factor=None,
+    method="marching_cubes",
+    regularize=None,
+    regularize_divs=10,
+    fft_backend=None,
+    fft_workers=None,
+    n_jobs=None,
+    cache_size=2**31,
+    prefetch=0,
+    read_workers=2,
+    compute_workers=1,
+    mask=None,
+    mask_coverage=0.5,
+    mask_binning=None,
+    fabric_method="ACF",
+    ST_sigma=1.0,
+    ST_binning=None,
+    ST_filename=None,
+    MIL_threshold=None,
+    cache=None,
+    checkpoint=None,
+    checkpoint_every=1000,
 ):
     """Compute fabric tensor of an image at given set of points.
 
     Parameters
     ----------
     I
-        3D image data.
+        3D image data. numpy array or any array-like supporting slicing (np.memmap, zarr array, h5py dataset, ..).
+        Only the ROIs around the points are read from disk-backed arrays.
     pointset
         (Nx3) Points coordinates [x, y, z].
     ROIsize
@@ -439,11 +1826,75 @@ def fabric_pointset(
         Size of the zoomed center.
     zoom_factor
         Zoom factor for imresize.
+    method : str
+        Ellipsoid fit method.
+        'marching_cubes': Fit to the envelope of the ACF (skimage's marching cubes).
+        'pymcubes': Fit to the envelope of the ACF (PyMCubes).
+        'moments': Ellipsoid from the second moments of the thresholded ACF blob. Mesh-free and faster.
+    regularize : str
+        Regularize the ACF envelope before the ellipsoid fit ('cubic' or 'spherical').
+        The fit runs on the mean points of the envelope sectors instead of on all vertices (see ellipsoid_fit.data_regularize).
+    regularize_divs : int
+        Number of divisions of the envelope regularization.
+    fft_backend : str
+        FFT backend of the ACF: 'numpy', 'scipy' (default) or 'pyfftw'.
+        FFT plans and buffers are reused by all ROIs. ROIs clipped at the image boundary are padded to ROIsize.
+    fft_workers : int
+        Number of FFT threads. -1 uses all CPUs.
+    n_jobs : int
+        Number of worker processes. -1 uses all available CPUs. Defaults to 1 (serial execution).
+        The image is placed once in shared memory (a np.memmap image is opened from its file by each worker).
+        Results are identical to the serial execution.
+    cache_size : int
+        Size in bytes of the cache of storage chunks of array-likes other than numpy arrays.
+        The points are processed in order of storage chunk, so that each chunk is read and decompressed once.
+        The results are returned in the original order of the points.
+    prefetch : int
+        Number of ROIs read ahead of the ACF and ellipsoid fit. If > 0, a pool of read_workers threads
+        prefetches the ROIs while compute_workers threads compute the fabric (in each worker process if n_jobs > 1).
+        Hides the latency of disk-backed images (network file systems). The utilization of the read and compute stages is reported.
+        Defaults to 0 (no prefetching).
+    read_workers : int
+        Number of ROI reader threads.
+    compute_workers : int
+        Number of compute threads.
+    mask
+        3D binary (bone) mask with the same size as image data, or its IntegralImage (integral_image.IntegralImage).
+        Points whose ROI has less than mask_coverage of its voxels inside the mask are rejected (NaN output) without computing the ACF.
+    mask_coverage : float
+        Minimum fraction of ROI voxels inside the mask.
+    mask_binning : int
+        Binning of the integral image of the mask. Defaults to the largest binning with all ROI bounds on the bin edges
+        (exact coverage, as fabric_snake). Points off a regular grid give 1 (full resolution table).
+    fabric_method : str
+        'ACF': Fit of the ellipsoid to the thresholded Auto Correlation Function of each ROI (default).
+        'structure_tensor': Gradient structure tensor integrated over each ROI (see fabric_structure_tensor).
+        The gradient is computed once for the whole image and each ROI costs O(1). The ACF parameters are ignored.
+        'MIL': Ellipsoid fit to the Mean Intercept Length of the ROI thresholded at MIL_threshold (see MIL_ellipsoid).
+        Radii are in voxels. The ACF parameters are ignored.
+    ST_sigma : float
+        Gradient scale of the structure tensor.
+    ST_binning : int
+        Binning of the integral images of the structure tensor components. Defaults to ROIsize // 16 (at least 1).
+    ST_filename : str
+        Store the integral images of the structure tensor components as files (see structure_tensor).
+    MIL_threshold : float
+        Image threshold of the MIL fabric method.
+    cache : acf_cache.ACFCache
+        On-disk cache of the ROI ACFs (level 'acf') or of the fitted ellipsoids (level 'fit') of previous runs.
+        The cache hit rate is reported. Hits of worker processes (n_jobs > 1) with level 'acf' are not counted.
+    checkpoint : str
+        Directory of the checkpoint of a resumable run. The results of the completed points (evecs, radii, fabric_comp, DA)
+        and their status (0: pending, 1: done, 2: failed) are flushed to .npy files every checkpoint_every points.
+        Failed fits are recorded in failures.jsonl instead of aborting the run (NaN output).
+        A run restarted with the same checkpoint, pointset and parameters skips the completed (and failed) points.
+    checkpoint_every : int
+        Number of completed points between checkpoint flushes.
 
     Returns
     -------
     evecs : float
-        (Nx3x3) Fabric tensor eigenvectors as the columns of a 3x3 matrix for each point in pointset.
+        (Nx3x3) Fabric tensor eigenvectors as the rows of a 3x3 matrix for each point in pointset.
     radii : float
         (Nx3) Ellipsoid radii.
     evals : float
@@ -456,149 +1907,347 @@ def fabric_pointset(
 
     # parameters
     n_points = pointset.shape[0]
-    halfROIsize = ROIsize / 2
-    I_size = [I.shape[0] - 1, I.shape[1] - 1, I.shape[2] - 1]
-    point_count = 0
+    n_jobs = _n_jobs(n_jobs)
+    kwargs = dict(
+        ACF_threshold=ACF_threshold,
+        ROIzoom=ROIzoom,
+        zoom_size=zoom_size,
+        zoom_factor=zoom_factor,
+        method=method,
+        regularize=regularize,
+        regularize_divs=regularize_divs,
+        fft_backend=fft_backend,
+        fft_workers=fft_workers,
+        prefetch=prefetch,
+        read_workers=read_workers,
+        compute_workers=compute_workers,
+        fabric_method=fabric_method,
+        MIL_threshold=MIL_threshold,
+    )
 
     # initialize output variables
     evecs = np.zeros([n_points, 3, 3])
     radii = np.zeros([n_points, 3])
-    fabric_tens = np.ndarray(evecs.shape)
-    fabric_comp = np.ndarray([evecs.shape[0], 6])
 
-    if ROIzoom:
-        # loop all points in the set
-        for p in tqdm(pointset):
-            # ROI extreemes
-            x0 = round(p[0] - halfROIsize)
-            y0 = round(p[1] - halfROIsize)
-            z0 = round(p[2] - halfROIsize)
-
-            x1 = x0 + ROIsize
-            y1 = y0 + ROIsize
-            z1 = z0 + ROIsize
-
-            # check if ROI exceeds image limits
-            if x0 < 0:
-                x0 = 0
-            if y0 < 0:
-                y0 = 0
-            if z0 < 0:
-                z0 = 0
-            if x1 > I_size[2]:
-                x1 = I_size[2]
-            if y1 > I_size[1]:
-                y1 = I_size[1]
-            if z1 > I_size[0]:
-                z1 = I_size[0]
-
-            # extract ROI around point p
-            ROI = I[z0:z1, y0:y1, x0:x1]
-
-            # calculate ACF
-            ROIACF = ACF(ROI)
-
-            # zoom ACF center
-            ROIACF = zoom_center(
-                ROIACF, size=zoom_size, zoom_factor=zoom_factor
-            )  # check if size of the zoom can be reduced
-
-            # envelope of normalized ACF center
-            # env_points = envelope(to01(ROIACF)>ACF_threshold)
-            env_points = envelope(to01andbinary(ROIACF, ACF_threshold))
-
-            # ellipsoid fit
-            center, evecs[point_count, :, :], radii[point_count, :], v = (
-                ef.ellipsoid_fit(env_points)
+    # ROIs of disk-backed arrays are read by storage chunk
+    reader, chunks = _ROI_reader(I, ROIsize, cache_size)
+    if chunks is None:
+        order = np.arange(n_points)
+    else:
+        order = _chunk_order(pointset, ROIsize, chunks)
+
+    # reject the points with ROIs outside of the mask
+    if mask is not None:
+        I_size = [I.shape[0] - 1, I.shape[1] - 1, I.shape[2] - 1]
+        bounds = np.array(
+            [_ROI_bounds(p, ROIsize, I_size) for p in pointset], dtype=np.int64
+        ).reshape(-1, 6)
+        if not isinstance(mask, IntegralImage):
+            if mask_binning is None:
+                mask_binning = _mask_binning(bounds, I.shape)
+            mask = IntegralImage.from_image(mask, binning=mask_binning)
+        rejected = ~mask.occupied(*bounds.T, fraction=mask_coverage)
+        evecs[rejected] = np.nan
+        radii[rejected] = np.nan
+        order = order[~rejected[order]]
+        print(
+            "{0} of {1} points rejected (ROI mask coverage < {2})".format(
+                np.count_nonzero(rejected), n_points, mask_coverage
             )
-            # center, evecs[point_count, :, :], radii[point_count, :], v = ef.ellipsoid_fit(env_points*[1,-1,1])
+        )
 
-            point_count = point_count + 1
+    if fabric_method == "structure_tensor":
+        results = fabric_structure_tensor(
+            I,
+            pointset,
+            ROIsize,
+            sigma=ST_sigma,
+            binning=ST_binning,
+            filename=ST_filename,
+            n_jobs=n_jobs,
+        )
+        if mask is not None:
+            for r in results:
+                r[rejected] = np.nan
+        return results
+    elif fabric_method == "MIL" and MIL_threshold is None:
+        raise ValueError("MIL_threshold is required by the MIL fabric method.")
+    elif fabric_method not in ["ACF", "MIL"]:
+        raise IOError("{0} fabric method unknown.".format(fabric_method))
+
+    # fabric parameters (without the execution parameters) identifying cached and checkpointed results
+    runtime = [
+        "fft_backend",
+        "fft_workers",
+        "prefetch",
+        "read_workers",
+        "compute_workers",
+    ]
+    settings = sorted((k, v) for k, v in kwargs.items() if k not in runtime)
+    settings.append(("fft_backend", fftb.get_backend(fft_backend).name))
 
+    # Remove potential outliers based on the ellipsoid radii:
+    # MIL longer than ROIsize: less than one intercept per test line
+    if fabric_method == "MIL":
+        radius_max, radius_min = ROIsize, 1
+    else:
+        radius_max, radius_min = _radius_limits(ROIsize, ROIzoom, zoom_factor)
+
+    # skip the points fitted by previous runs
+    if cache is not None and cache.level == "fit":
+        I_key = acf_cache.image_key(I)
+        I_size = [I.shape[0] - 1, I.shape[1] - 1, I.shape[2] - 1]
+        keys = {}
+        missing = []
+        for i in order:
+            bounds = [int(b) for b in _ROI_bounds(pointset[i], ROIsize, I_size)]
+            keys[i] = acf_cache.cache_key(I_key, bounds, ROIsize, settings)
+            cached = cache.get(keys[i])
+            if cached is None:
+                missing.append(i)
+            else:
+                evecs[i], radii[i] = cached["evecs"], cached["radii"]
+        order = np.array(missing, dtype=np.int64)
+    elif cache is not None:
+        kwargs["ACF_cache"] = cache
+
+    # resume from the checkpoint of a previous run
+    done = None
+    if checkpoint is not None:
+        store = _Checkpoint(
+            checkpoint,
+            pointset,
+            ROIsize,
+            settings,
+            radius_max,
+            radius_min,
+            checkpoint_every,
+        )
+        completed = store.status != _Checkpoint.PENDING
+        evecs[completed] = store.evecs[completed]
+        radii[completed] = store.radii[completed]
+        print(
+            "{0} of {1} points completed by previous runs ({2} failed)".format(
+                np.count_nonzero(completed),
+                n_points,
+                np.count_nonzero(store.status == _Checkpoint.FAILED),
+            )
+        )
+        order = order[~completed[order]]
+        done = store.done
+
+    if n_jobs > 1 and len(order) > 1:
+        _fabric_points_parallel(
+            reader,
+            pointset,
+            evecs,
+            radii,
+            ROIsize,
+            n_jobs=n_jobs,
+            order=order,
+            cache_size=cache_size,
+            done=done,
+            **kwargs,
+        )
     else:
-        # loop all points in the set
-        for p in tqdm(pointset):
-            # ROI extreemes
-            x0 = round(p[0] - halfROIsize)
-            y0 = round(p[1] - halfROIsize)
-            z0 = round(p[2] - halfROIsize)
-
-            x1 = x0 + ROIsize
-            y1 = y0 + ROIsize
-            z1 = z0 + ROIsize
-
-            # check if ROI exceeds image limits
-            if x0 < 0:
-                x0 = 0
-            if y0 < 0:
-                y0 = 0
-            if z0 < 0:
-                z0 = 0
-            if x1 > I_size[2]:
-                x1 = I_size[2]
-            if y1 > I_size[1]:
-                y1 = I_size[1]
-            if z1 > I_size[0]:
-                z1 = I_size[0]
-
-            # extract ROI around point p
-            ROI = I[z0:z1, y0:y1, x0:x1]
-
-            # calculate ACF
-            ROIACF = ACF(ROI)
-
-            # envelope of normalized ACF
-            # the ACF intensity is normalized to the 0-1 range
-            # env_points = envelope(to01(ROIACF) > ACF_threshold)
-            env_points = envelope(to01andbinary(ROIACF, ACF_threshold))
-
-            # ellipsoid fit
+        _fabric_points(
+            reader,
+            pointset,
+            order,
+            evecs,
+            radii,
+            ROIsize,
+            progress=True,
+            done=done,
+            **kwargs,
+        )
+
+    if checkpoint is not None:
+        store.flush()
+
+    if cache is not None:
+        if cache.level == "fit":
+            for i in order:
+                # failed or skipped points (NaN) are computed again by the next run
+                if np.all(np.isfinite(evecs[i])) and np.all(np.isfinite(radii[i])):
+                    cache.put(keys[i], evecs=evecs[i], radii=radii[i])
+        print(cache)
+
+    return fabric_components(evecs, radii, radius_max, radius_min)
+
+
+def _fabric_ROI_sweep(
+    ROI,
+    ROIsize,
+    ACF_thresholds,
+    zooms,
+    method="marching_cubes",
+    regularize=None,
+    regularize_divs=10,
+    fft_backend=None,
+    fft_workers=None,
+):
+    """Fabric ellipsoids of one ROI for all combinations of zoom settings and ACF thresholds.
+    The ACF is computed once. The range of the (zoomed) ACF is computed once per zoom setting.
+
+    Returns
+    -------
+    evecs : float
+        (Px3x3) Ellipsoid eigenvectors.
+    radii : float
+        (Px3) Ellipsoid radii.
+    """
+
+    ROIACF = ACF(ROI, shape=[ROIsize] * 3, backend=fft_backend, workers=fft_workers)
+
+    evecs = []
+    radii = []
+    for zoom in zooms:
+        if zoom is None:
             # the ellipsoid envelope coordinates are scaled to 0-1
-            center, evecs[point_count, :, :], radii[point_count, :], v = (
-                ef.ellipsoid_fit(env_points / ROIsize)
+            ACF_zoom = ROIACF.astype(np.float32, copy=False)
+            scale = ROIsize
+        else:
+            ACF_zoom = zoom_center(ROIACF, size=zoom[0], zoom_factor=zoom[1]).astype(
+                np.float32, copy=False
             )
-            # center, evecs[point_count, :, :], radii[point_count, :], v = ef.ellipsoid_fit((env_points*[1,-1,1])/ROIsize)
+            scale = 1
+        data_range = (np.nanmin(ACF_zoom), np.nanmax(ACF_zoom))
+
+        for t in ACF_thresholds:
+            center, evecs_t, radii_t = _ellipsoid(
+                to01andbinary(ACF_zoom, t, data_range),
+                method=method,
+                scale=scale,
+                regularize=regularize,
+                regularize_divs=regularize_divs,
+            )
+            evecs.append(evecs_t)
+            radii.append(radii_t)
 
-            point_count = point_count + 1
+    return np.array(evecs), np.array(radii)
 
-    # take abs value of the radii vector
-    radii = np.abs(radii)
 
-    # compute Degree of Anisotropy
-    DA = np.max(radii, 1) / np.min(radii, 1)
+def fabric_sweep(
+    I,
+    pointset,
+    ROIsize,
+    ACF_thresholds=(0.5,),
+    zooms=(None,),
+    method="marching_cubes",
+    regularize=None,
+    regularize_divs=10,
+    fft_backend=None,
+    fft_workers=None,
+    cache_size=2**31,
+):
+    """Compute fabric tensor of an image at given set of points for a list of ACF thresholds and zoom settings.
+    The ACF of each ROI is computed once and reused by all settings: sensitivity studies cost about as much as
+    the envelope and ellipsoid fit stages.
 
-    # Remove potential outliers based on the ellipsoid radii:
-    # any ellipsoid with a radius > ROIsize/2 is removed
-    idx = np.any(radii > ROIsize * zoom_factor / 2, axis=1)
-    radii[idx, :] = np.nan
-    DA[idx] = np.nan
+    Parameters
+    ----------
+    I
+        3D image data. numpy array or any array-like supporting slicing (see fabric_pointset).
+    pointset
+        (Nx3) Points coordinates [x, y, z].
+    ROIsize
+        Size of the Region Of Interest for the analysis.
+    ACF_thresholds : list
+        ACF threshold values (0-1 range).
+    zooms : list
+        Zoom settings of the ACF center. Each setting is None (no zoom) or a tuple (zoom_size, zoom_factor) (see zoom_center).
+    method : str
+        Ellipsoid fit method: 'marching_cubes', 'pymcubes' or 'moments' (see fabric_pointset).
+    regularize : str
+        Regularize the ACF envelope before the ellipsoid fit ('cubic' or 'spherical').
+    regularize_divs : int
+        Number of divisions of the envelope regularization.
+    fft_backend : str
+        FFT backend of the ACF: 'numpy', 'scipy' (default) or 'pyfftw'.
+    fft_workers : int
+        Number of FFT threads. -1 uses all CPUs.
+    cache_size : int
+        Size in bytes of the chunk cache of array-likes other than numpy arrays.
 
-    # ellipsoid radii < 1 voxel are meaningless
-    idx = np.any(radii < 1, axis=1)
-    radii[idx, :] = np.nan
-    DA[idx] = np.nan
+    Returns
+    -------
+    evecs : float
+        (PxNx3x3) Fabric tensor eigenvectors for each parameter setting and point.
+    radii : float
+        (PxNx3) Ellipsoid radii.
+    evals : float
+        (PxNx3) Ellipsoid eigenvalues.
+    fabric_comp : float
+        (PxNx6) Ellipsoid tensor components with order: XX, YY, ZZ, XY, YZ, XZ
+    DA : float
+        (PxN) Degree of Anisotropy (ratio between major and minor fabric ellipsoid axes)
+    params : list
+        Parameter settings (dict with keys 'ACF_threshold', 'ROIzoom', 'zoom_size', 'zoom_factor') along the first axis.
+        Settings are ordered by zoom setting, then by ACF threshold.
+    """
 
-    # Ellipsoid eigenvalues
-    evals = 1 / (radii**2)
+    params = [
+        dict(
+            ACF_threshold=t,
+            ROIzoom=zoom is not None,
+            zoom_size=None if zoom is None else zoom[0],
+            zoom_factor=None if zoom is None else zoom[1],
+        )
+        for zoom in zooms
+        for t in ACF_thresholds
+    ]
 
-    # Symmetric ellipsoid tensor components
-    for cell in range(0, evecs.shape[0]):
-        fabric_tens[cell, :, :] = np.matmul(
-            evecs[cell, :, :],
-            np.matmul(
-                (evals[cell, :] * np.identity(3)), np.transpose(evecs[cell, :, :])
-            ),
+    # initialize output variables
+    n_points = pointset.shape[0]
+    evecs = np.zeros([len(params), n_points, 3, 3])
+    radii = np.zeros([len(params), n_points, 3])
+
+    reader, chunks = _ROI_reader(I, ROIsize, cache_size)
+    if chunks is None:
+        order = np.arange(n_points)
+    else:
+        order = _chunk_order(pointset, ROIsize, chunks)
+
+    I_size = [I.shape[0] - 1, I.shape[1] - 1, I.shape[2] - 1]
+
+    # loop all points in the set
+    for i in tqdm(order):
+        z0, z1, y0, y1, x0, x1 = _ROI_bounds(pointset[i], ROIsize, I_size)
+        evecs[:, i], radii[:, i] = _fabric_ROI_sweep(
+            reader[z0:z1, y0:y1, x0:x1],
+            ROIsize,
+            ACF_thresholds,
+            zooms,
+            method=method,
+            regularize=regularize,
+            regularize_divs=regularize_divs,
+            fft_backend=fft_backend,
+            fft_workers=fft_workers,
         )
-        fabric_comp[cell, :] = fabric_tens[cell, [0, 1, 2, 0, 1, 0], [0, 1, 2, 1, 2, 2]]
-        # fabric_comp[cell, :] = fabric_tens[cell, [2, 1, 0, 1, 0, 0], [2, 1, 0, 2, 1, 2]]
-        # evecs[cell, :, :] = np.flipud(evecs[cell, :, :])
 
-    return evecs, radii, evals, fabric_comp, DA
-    # return evecs, np.flipud(radii), np.flipud(evals), fabric_comp, DA
+    results = [
+        fabric_components(
+            evecs[p],
+            radii[p],
+            *_radius_limits(ROIsize, param["ROIzoom"], param["zoom_factor"]),
+        )
+        for p, param in enumerate(params)
+    ]
+
+    return tuple(np.stack(r) for r in zip(*results)) + (params,)
 
 
 def fabric(
-    I, ACF_threshold=0.5, zoom=False, zoom_size=None, zoom_factor=None, ACFplot=None
+    I,
+    ACF_threshold=0.5,
+    zoom=False,
+    zoom_size=None,
+    zoom_factor=None,
+    ACFplot=None,
+    method="marching_cubes",
+    fft_backend=None,
+    fft_workers=None,
 ):
     """Compute fabric tensor of a given image.
 
@@ -616,11 +2265,17 @@ def fabric(
         Zoom factor for imresize.
     ACFplot
         PLot of ACF.
+    method : str
+        Ellipsoid fit method: 'marching_cubes', 'pymcubes' or 'moments' (see fabric_pointset).
+    fft_backend : str
+        FFT backend of the ACF: 'numpy', 'scipy' (default) or 'pyfftw'.
+    fft_workers : int
+        Number of FFT threads. -1 uses all CPUs.
 
     Returns
     -------
     evecs : float
-        (3x3) Fabric tensor eigenvectors as the columns of a 3x3 matrix.
+        (3x3) Fabric tensor eigenvectors as the rows of a 3x3 matrix.
     radii : float
         Ellipsoid radii.
     evals : float
@@ -632,7 +2287,7 @@ def fabric(
     """
 
     # calculate ACF
-    ACF_I = ACF(I)
+    ACF_I = ACF(I, backend=fft_backend, workers=fft_workers)
 
     if zoom:
         # zoom ACF center
@@ -646,11 +2301,10 @@ def fabric(
         ax2.imshow(ACF_I[:, int(ACF_I.shape[1] / 2), :])
         ax3.imshow(ACF_I[:, :, int(ACF_I.shape[2] / 2)])
 
-    # envelope of normalized ACF center
-    env_points = envelope(to01andbinary(ACF_I, ACF_threshold))
-
-    # ellipsoid fit
-    center, evecs, radii, v = ef.ellipsoid_fit(env_points)
+    # envelope of normalized ACF center and ellipsoid fit
+    center, evecs, radii = _ellipsoid(
+        to01andbinary(ACF_I, ACF_threshold), method=method
+    )
 
     # compute Degree of Anisotropy
     DA = np.max(radii) / np.min(radii)
@@ -658,10 +2312,196 @@ def fabric(
     # Ellipsoid eigenvalues
     evals = 1 / (radii**2)
 
-    # Symmetric ellipsoid tensor components
+    # Symmetric ellipsoid tensor components (eigenvectors as rows)
     fabric_tens = np.matmul(
-        evecs, np.matmul((evals * np.identity(3)), np.transpose(evecs))
+        np.transpose(evecs), np.matmul((evals * np.identity(3)), evecs)
     )
     fabric_comp = fabric_tens[[0, 1, 2, 0, 1, 0], [0, 1, 2, 1, 2, 2]]
 
     return evecs, radii, evals, fabric_comp, DA
+
+
+def structure_tensor(
+    I, sigma=1.0, binning=1, chunk_size=None, filename=None, n_jobs=None
+):
+    """Integral images of the components of the gradient structure tensor of a 3D image.
+    The image gradient is computed with Gaussian derivative filters in z-tiles with halos of int(4*sigma+0.5) slices.
+    The gradient outer products are accumulated tile by tile in the integral images (see integral_image.IntegralImage),
+    so that the structure tensor of any box (ROI) is obtained in O(1). The gradient is never stored for the whole image.
+
+    Parameters
+    ----------
+    I
+        3D image data. numpy array or any array-like supporting slicing along z (np.memmap, zarr array, ..).
+    sigma : float
+        Standard deviation of the Gaussian derivative filters (gradient scale).
+    binning : int
+        Binning of the integral images. Reduces their size by binning^3 (see integral_image.IntegralImage).
+        The six float64 integral images take 48 / binning^3 bytes per voxel of I (48 bytes without binning).
+    chunk_size : int
+        Number of slices of the z-tiles. Defaults to 32 (rounded to a multiple of binning).
+    filename : str
+        Store the integral images as filename + '_XX.npy', .. files (written through memory maps) instead of in memory.
+    n_jobs : int
+        Number of threads computing the gradient tiles. -1 uses all CPUs. Defaults to 1.
+
+    Returns
+    -------
+    tensor : list
+        IntegralImage of the tensor components with order: XX, YY, ZZ, XY, YZ, XZ
+    """
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    shape = tuple(I.shape)
+    if chunk_size is None:
+        chunk_size = 32
+    chunk_size = binning * max(1, round(chunk_size / binning))
+    halo = int(4.0 * sigma + 0.5)
+    n_jobs = _n_jobs(n_jobs)
+
+    names = ["XX", "YY", "ZZ", "XY", "YZ", "XZ"]
+    builders = [
+        IntegralImageBuilder(
+            shape,
+            binning,
+            np.float64,
+            None if filename is None else filename + "_" + name + ".npy",
+        )
+        for name in names
+    ]
+
+    def gradient_products(z0):
+        z1 = min(z0 + chunk_size, shape[0])
+        r0, r1 = max(z0 - halo, 0), min(z1 + halo, shape[0])
+        tile = np.asarray(I[r0:r1]).astype(np.float32, copy=False)
+        # gradient [x, y, z] of the tile without halo
+        g = [
+            ndimage.gaussian_filter(tile, sigma, order=order, mode="nearest")[
+                z0 - r0 : z1 - r0
+            ]
+            for order in ([0, 0, 1], [0, 1, 0], [1, 0, 0])
+        ]
+        return [
+            g[i] * g[j] for i, j in [(0, 0), (1, 1), (2, 2), (0, 1), (1, 2), (0, 2)]
+        ]
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        pending = collections.deque()
+        for z0 in tqdm(range(0, shape[0], chunk_size)):
+            pending.append(executor.submit(gradient_products, z0))
+            if len(pending) >= 2 * n_jobs:
+                for builder, product in zip(builders, pending.popleft().result()):
+                    builder.append(product)
+        while pending:
+            for builder, product in zip(builders, pending.popleft().result()):
+                builder.append(product)
+
+    return [builder.finish() for builder in builders]
+
+
+def _ST_binning(ROIsize, binning=None):
+    """Default binning of the structure tensor integral images: ROIsize // 16 (at least 1).
+    ROI bounds are interpolated within the bins of the integral images (see integral_image.IntegralImage).
+    """
+
+    if binning is None:
+        binning = max(1, ROIsize // 16)
+    return binning
+
+
+def _fabric_structure_tensor(tensor, bounds):
+    """Fabric from the structure tensor of the boxes [z0, z1, y0, y1, x0, x1] (one row per box)."""
+
+    n_boxes = bounds.shape[0]
+    comp = np.stack([component.mean(*bounds.T) for component in tensor], axis=1)
+    J = comp[:, [0, 3, 5, 3, 1, 4, 5, 4, 2]].reshape(n_boxes, 3, 3)
+
+    # normalized tensor (unit trace)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        J = J / np.trace(J, axis1=1, axis2=2)[:, None, None]
+
+    evals = np.full((n_boxes, 3), np.nan)
+    evecs = np.full((n_boxes, 3, 3), np.nan)
+    valid = np.all(np.isfinite(J), axis=(1, 2))
+    w, v = np.linalg.eigh(J[valid])
+    evals[valid] = w
+    # eigenvectors as rows (as ellipsoid_fit)
+    evecs[valid] = np.transpose(v, (0, 2, 1))
+
+    # ellipsoid x^T J x = 1: the major axis is the direction of smallest intensity variation
+    with np.errstate(invalid="ignore", divide="ignore"):
+        radii = 1 / np.sqrt(evals)
+    idx = ~np.all(np.isfinite(radii), axis=1)
+    radii[idx, :] = np.nan
+
+    # same post-processing as the ACF and MIL fabric: fabric_comp are the components of J
+    return fabric_components(evecs, radii)
+
+
+def fabric_structure_tensor(
+    I,
+    pointset,
+    ROIsize,
+    sigma=1.0,
+    binning=None,
+    tensor=None,
+    filename=None,
+    n_jobs=None,
+):
+    """Compute fabric tensor of an image at given set of points from the gradient structure tensor.
+    Fast alternative to the ACF: the gradient is computed once for the whole image (see structure_tensor)
+    and integrated over the ROIs of size ROIsize in O(1) per point.
+    The fabric ellipsoid is x^T J x = 1 for the structure tensor J of the ROI normalized to unit trace:
+    its major axis is the direction of smallest intensity variation (trabecular orientation).
+
+    Parameters
+    ----------
+    I
+        3D image data. Not used if tensor is given.
+    pointset
+        (Nx3) Points coordinates [x, y, z].
+    ROIsize
+        Size of the Region Of Interest for the analysis.
+    sigma : float
+        Gradient scale (see structure_tensor).
+    binning : int
+        Binning of the integral images (see structure_tensor). Defaults to ROIsize // 16 (at least 1).
+    tensor : list
+        Precomputed structure_tensor of I. Reuse it for several pointsets or ROI sizes.
+    filename : str
+        Store the integral images as files (see structure_tensor).
+    n_jobs : int
+        Number of threads computing the gradient.
+
+    Returns
+    -------
+    evecs : float
+        (Nx3x3) Eigenvectors of the normalized structure tensor (as rows).
+    radii : float
+        (Nx3) Ellipsoid radii (1/sqrt(evals)).
+    evals : float
+        (Nx3) Eigenvalues of the normalized structure tensor.
+    fabric_comp : float
+        (Nx6) Normalized structure tensor components with order: XX, YY, ZZ, XY, YZ, XZ
+        Same layout as the ACF fabric (see fabric_components), but with unit trace: normalize the ACF fabric_comp
+        by their trace (XX + YY + ZZ) to compare the two.
+    DA : float
+        Degree of Anisotropy (ratio between major and minor fabric ellipsoid axes: sqrt(max(evals)/min(evals)))
+    """
+
+    if tensor is None:
+        tensor = structure_tensor(
+            I,
+            sigma=sigma,
+            binning=_ST_binning(ROIsize, binning),
+            filename=filename,
+            n_jobs=n_jobs,
+        )
+
+    I_size = [n - 1 for n in tensor[0].shape]
+    bounds = np.array(
+        [_ROI_bounds(p, ROIsize, I_size) for p in np.asarray(pointset)], dtype=np.int64
+    ).reshape(-1, 6)
+
+    return _fabric_structure_tensor(tensor, bounds)
@@ -39,35 +39,189 @@ except ImportError:
 
 
 def average_sinogram_by_interval(
-    _projs, slicer=1, remove_last_n_to_make_suited_size_for_reshape="auto"
+    _projs,
+    slicer=1,
+    remove_last_n_to_make_suited_size_for_reshape="auto",
+    method="mean",
+    dtype=np.uint16,
+    output=None,
+    n_jobs=None,
 ):
+    """Average groups of slicer consecutive projections.
+    Each group is read and reduced in a thread pool. Only the groups in flight (2 x n_jobs) are kept in memory:
+    the projections can be an HDF5 dataset (e.g. h5py dataset of a file opened with dxchange) and are never loaded
+    at once.
+
+    Parameters
+    ----------
+    _projs
+        Projections [angle,Y,X]. Any array supporting slicing along the first axis (numpy array, h5py dataset, zarr array).
+    slicer : int
+        Number of projections averaged.
+    remove_last_n_to_make_suited_size_for_reshape
+        None, 'auto' or int. 'auto' drops the last projections that do not fill a group. int: the projections
+        _projs[:remove_last_n_to_make_suited_size_for_reshape] are used.
+    method : str
+        'mean' or 'median' of each group.
+    dtype
+        Output data type. Defaults to np.uint16.
+    output
+        Output array (e.g. numpy memmap). If None (default), a new array is returned.
+    n_jobs : int
+        Number of threads. -1 uses all CPUs. Defaults to 1.
+
+    Returns
+    -------
+    array_reduced_by_averaging
+        Averaged projections [angle/slicer,Y,X].
     """
-    remove_last_n_to_make_suited_size_for_reshape can be an index or string: None, auto
-    """
+
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+
+    if method not in ["mean", "median"]:
+        raise IOError("{0} method unknown.".format(method))
+
+    n = _projs.shape[0]
     if remove_last_n_to_make_suited_size_for_reshape == "auto":
-        # implement the calculation of a proper last index
-        modulo = _projs.shape[0] % slicer
-        if modulo != 0:
-            remove_last_n_to_make_suited_size_for_reshape = -modulo
+        n -= n % slicer
+    elif isinstance(remove_last_n_to_make_suited_size_for_reshape, int):
+        n = len(range(n)[:remove_last_n_to_make_suited_size_for_reshape])
+
+    if n % slicer != 0:
+        raise ValueError(
+            "{0} projections cannot be averaged by groups of {1}.".format(n, slicer)
+        )
 
-    if isinstance(remove_last_n_to_make_suited_size_for_reshape, int):
-        _projs = _projs[:remove_last_n_to_make_suited_size_for_reshape, :, :]
+    shape_projs_reduced = (n // slicer,) + tuple(_projs.shape[1:])
+    if output is None:
+        output = np.empty(shape_projs_reduced, dtype=dtype)
+    elif tuple(output.shape) != shape_projs_reduced:
+        raise ValueError(
+            "Output shape {0} does not match {1}.".format(
+                output.shape, shape_projs_reduced
+            )
+        )
 
-    shape_projs = _projs.shape
+    if n_jobs is None:
+        n_jobs = 1
+    elif n_jobs < 0:
+        n_jobs = os.cpu_count()
 
-    shape_projs_reduced = (
-        shape_projs[0] // slicer,
-        slicer,
-        shape_projs[1],
-        shape_projs[2],
-    )
+    def reduce(k):
+        group = np.asarray(_projs[k * slicer : (k + 1) * slicer])
+        if method == "mean":
+            # float32 accumulator
+            group = np.mean(group, axis=0, dtype=np.float32)
+        else:
+            group = np.median(group, axis=0)
+        return group.astype(output.dtype)
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        pending = deque()
+        for k in range(shape_projs_reduced[0]):
+            pending.append((k, executor.submit(reduce, k)))
+            if len(pending) >= 2 * n_jobs:
+                p, future = pending.popleft()
+                output[p] = future.result()
+        while pending:
+            p, future = pending.popleft()
+            output[p] = future.result()
+
+    return output
 
-    array_reduced_by_averaging = _projs.reshape(shape_projs_reduced).astype(np.float32)
-    array_reduced_by_averaging = array_reduced_by_averaging.mean(axis=1)
 
-    array_reduced_by_averaging = array_reduced_by_averaging.astype(np.uint16)
+def _uint_index(data):
+    """Order-preserving view of integer data up to 16 bit as unsigned integers (histogram bin or lookup table index)."""
 
-    return array_reduced_by_averaging
+    if data.dtype.kind == "u":
+        return data
+    # flip the sign bit: the minimum maps to 0
+    udata = data.view("u{0}".format(data.dtype.itemsize))
+    return udata ^ udata.dtype.type(1 << (8 * data.dtype.itemsize - 1))
+
+
+def intensity_range(data_3D, quantiles=None, subset=True, chunk_size=32, n_jobs=None):
+    """Intensity range of 3D image data computed in one pass over z-chunks.
+    Integer data up to 16 bit: exact min, max and quantiles from the histogram of the data.
+    Other data: exact min and max (NaNs are ignored). Quantiles are estimated from a regular 3D grid sample
+    (one every 10 voxels along each axis, as data_3D[::10, ::10, ::10]).
+
+    Parameters
+    ----------
+    data_3D
+        Input 3D image data [Z,Y,X]. Any array supporting slicing along z (numpy memmap, zarr array, ..).
+    quantiles : [float, float]
+        Quantiles of the range. If None (default), the range is [min, max].
+    subset : bool
+        Estimate the quantiles of non-integer data from a sample of one every 1000 voxels (every 10th voxel along each
+        axis). If False, all voxels are used.
+    chunk_size : int
+        Number of slices per chunk.
+    n_jobs : int
+        Number of threads. -1 uses all CPUs. Defaults to 1.
+
+    Returns
+    -------
+    data_range : [float, float]
+        Intensity range.
+    """
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    dtype = np.dtype(data_3D.dtype)
+    histogram = dtype.kind in "ui" and dtype.itemsize <= 2
+    offset = np.iinfo(dtype).min if histogram else 0
+    step = 10 if subset else 1
+
+    if n_jobs is None:
+        n_jobs = 1
+    elif n_jobs < 0:
+        n_jobs = os.cpu_count()
+
+    def statistics(z0):
+        chunk = np.asarray(data_3D[z0 : z0 + chunk_size])
+        if histogram:
+            return np.bincount(
+                _uint_index(chunk.ravel()), minlength=2 ** (8 * dtype.itemsize)
+            )
+        sample = None
+        if quantiles is not None:
+            # 3D grid sample (a stride of the flattened chunk would alias with the row length);
+            # the z offset continues the grid of the previous chunks
+            sample = chunk[(-z0) % step :: step, ::step, ::step].ravel()
+            if dtype.kind == "f":
+                sample = sample[~np.isnan(sample)]
+            sample = sample.copy()
+        if dtype.kind == "f":
+            chunk = chunk[~np.isnan(chunk)]
+        if chunk.size == 0:
+            return np.inf, -np.inf, sample
+        return chunk.min(), chunk.max(), sample
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        results = executor.map(statistics, range(0, data_3D.shape[0], chunk_size))
+
+        if histogram:
+            counts = sum(results)
+            values = np.flatnonzero(counts)
+            if quantiles is None:
+                return [values[0] + offset, values[-1] + offset]
+            # smallest value with cumulative count >= q * N (and >= 1: q = 0 gives the min)
+            cdf = np.cumsum(counts)
+            return [
+                np.searchsorted(cdf, max(q * cdf[-1], 1)) + offset for q in quantiles
+            ]
+
+        data_min, data_max, samples = np.inf, -np.inf, []
+        for chunk_min, chunk_max, sample in results:
+            data_min = min(data_min, chunk_min)
+            data_max = max(data_max, chunk_max)
+            samples.append(sample)
+
+    if quantiles is None:
+        return [data_min, data_max]
+    return list(np.quantile(np.concatenate(samples), quantiles))
 
 
 def touint(
@@ -78,13 +232,16 @@ def touint(
     numexpr=True,
     subset=True,
     nchunk=None,
+    n_jobs=None,
 ):
     """Normalize and convert data to unsigned integer.
+    The data is processed in z-chunks (see process_chunked): the intensity range is computed in one pass (see intensity_range)
+    and the chunks are converted in a thread pool directly into the output. Peak memory is the output plus a few chunks.
 
     Parameters
     ----------
     data_3D
-        Input data.
+        Input data. Any array supporting slicing along z (numpy memmap, zarr array, ..).
     dtype
         Output data type ('uint8' or 'uint16').
     data_range : [float, float]
@@ -92,9 +249,13 @@ def touint(
     quantiles : [float, float]
         Define data range for data normalization through input data quantiles. If data_range is given this input is ignored.
     numexpr : bool
-        Use fast numerical expression evaluator for NumPy (memory expensive).
+        Not used. Kept for compatibility: the chunks are converted in place with numpy.
     subset : bool
-        Use subset of the input data for quantile calculation.
+        Use subset of the input data for quantile calculation (non-integer data only, see intensity_range).
+    nchunk : int
+        Number of slices per chunk. Defaults to 32.
+    n_jobs : int
+        Number of threads. -1 uses all CPUs. Defaults to 1.
 
     Returns
     -------
@@ -102,81 +263,17 @@ def touint(
         Normalized data.
     """
 
-    def convertfloat(data_3D):
-        return (
-            data_3D.astype(np.float32, copy=False),
-            np.float32(data_max - data_min),
-            np.float32(data_min),
-        )
-
-    def convertint(data_3D, nchunk):
-        if nchunk is not None:
-            data_int = np.zeros(data_3D.shape, dtype=dtype)
-            slcs = [
-                np.s_[offset : offset + nchunk]
-                for offset in range(0, data_3D.shape[0], nchunk)
-            ]
-            for slices in slcs:
-                if dtype == "uint8":
-                    data_int[slices] = convert8bit(data_3D[slices])
-                elif dtype == "uint16":
-                    data_int[slices] = convert16bit(data_3D[slices])
-            return data_int
-
-        if dtype == "uint8":
-            return convert8bit(data_3D)
-        elif dtype == "uint16":
-            return convert16bit(data_3D)
-
-    def convert16bit(data_3D):
-        data_3D, df, mn = convertfloat(data_3D)
-
-        if numexpr:
-            import numexpr as ne
-
-            scl = ne.evaluate("0.5+65535*(data_3D-mn)/df", truediv=True)
-            ne.evaluate("where(scl<0,0,scl)", out=scl)
-            ne.evaluate("where(scl>65535,65535,scl)", out=scl)
-            return scl.astype(np.uint16)
-        else:
-            data_3D = 0.5 + 65535 * (data_3D - mn) / df
-            data_3D[data_3D < 0] = 0
-            data_3D[data_3D > 65535] = 65535
-            return np.uint16(data_3D)
-
-    def convert8bit(data_3D):
-        data_3D, df, mn = convertfloat(data_3D)
+    if np.dtype(dtype) not in [np.uint8, np.uint16]:
+        raise ValueError("{0} output data type not supported.".format(dtype))
 
-        if numexpr:
-            import numexpr as ne
+    if nchunk is None:
+        nchunk = 32
 
-            scl = ne.evaluate("0.5+255*(data_3D-mn)/df", truediv=True)
-            ne.evaluate("where(scl<0,0,scl)", out=scl)
-            ne.evaluate("where(scl>255,255,scl)", out=scl)
-            return scl.astype(np.uint8)
-        else:
-            data_3D_float = 0.5 + 255 * (data_3D - mn) / df
-            data_3D_float[data_3D < 0] = 0
-            data_3D_float[data_3D > 255] = 255
-            return np.uint8(data_3D)
-
-    if data_range == None:
+    if data_range is None:
         # if quantiles is empty data is scaled based on its min and max values
-        if quantiles == None:
-            data_min = np.nanmin(data_3D)
-            data_max = np.nanmax(data_3D)
-            data_max = data_max - data_min
-            return convertint(data_3D, nchunk)
-        else:
-            if subset:
-                [data_min, data_max] = np.quantile(
-                    np.ravel(data_3D[0::10, 0::10, 0::10]), quantiles
-                )
-            else:
-                [data_min, data_max] = np.quantile(np.ravel(data_3D), quantiles)
-
-            return convertint(data_3D, nchunk)
-
+        data_min, data_max = intensity_range(
+            data_3D, quantiles, subset=subset, chunk_size=nchunk, n_jobs=n_jobs
+        )
     else:
         # ignore quantiles input if given
         if quantiles is not None:
@@ -184,31 +281,106 @@ def touint(
 
         data_min = data_range[0]
         data_max = data_range[1]
-        return convertint(data_3D, nchunk)
+
+    vmax = np.iinfo(dtype).max
+    scale = np.float32(vmax / np.float32(data_max - data_min))
+    mn = np.float32(data_min)
+
+    def convert(chunk):
+        chunk = chunk.astype(np.float32)
+        chunk -= mn
+        chunk *= scale
+        chunk += 0.5
+        np.clip(chunk, 0, vmax, out=chunk)
+        return chunk.astype(dtype)
+
+    dtype_in = np.dtype(data_3D.dtype)
+    if dtype_in.kind in "ui" and dtype_in.itemsize <= 2:
+        # lookup table of all input values: one gather per voxel
+        info = np.iinfo(dtype_in)
+        lut = convert(np.arange(info.min, info.max + 1))
+
+        def convert_chunk(chunk):
+            return lut[_uint_index(chunk)]
+
+    else:
+        convert_chunk = convert
+
+    return process_chunked(
+        data_3D, convert_chunk, dtype=dtype, chunk_size=nchunk, n_jobs=n_jobs
+    )
 
 
-def to01(data_3D):
+def to01(data_3D, chunk_size=32, n_jobs=None):
     """Normalize data to 0-1 range.
+    The data is processed in z-chunks (see touint). Peak memory is the output plus a few chunks.
 
     Parameters
     ----------
     data_3D
         Input data.
+    chunk_size : int
+        Number of slices per chunk.
+    n_jobs : int
+        Number of threads. -1 uses all CPUs. Defaults to 1.
 
     Returns
     -------
     data_3D : float32
         Normalized data.
     """
-    import numexpr as ne
 
-    data_3D = data_3D.astype(np.float32, copy=False)
-    data_min = np.nanmin(data_3D)
-    data_max = np.nanmax(data_3D)
+    data_min, data_max = intensity_range(data_3D, chunk_size=chunk_size, n_jobs=n_jobs)
     df = np.float32(data_max - data_min)
     mn = np.float32(data_min)
-    scl = ne.evaluate("(data_3D-mn)/df", truediv=True)
-    return scl.astype(np.float32)
+
+    def normalize(chunk):
+        chunk = chunk.astype(np.float32)
+        chunk -= mn
+        chunk /= df
+        return chunk
+
+    return process_chunked(
+        data_3D, normalize, dtype=np.float32, chunk_size=chunk_size, n_jobs=n_jobs
+    )
+
+
+def midplanes(data_3D, slice_x=-1, slice_y=-1, slice_z=-1):
+    """Orthogonal planes through 3D dataset.
+
+    Parameters
+    ----------
+    data_3D
+        Input 3D image data or tuple of (XY, XZ, YZ) planes (e.g. from ISQmethods.readmidplanes).
+        Planes are returned unchanged.
+    slice_x : int
+        X-slice number. Defaults to the mid-plane.
+    slice_y : int
+        Y-slice number. Defaults to the mid-plane.
+    slice_z : int
+        Z-slice number. Defaults to the mid-plane.
+
+    Returns
+    -------
+    XY, XZ, YZ
+        Orthogonal planes.
+    """
+
+    if isinstance(data_3D, (tuple, list)):
+        return tuple(data_3D)
+
+    if slice_x == -1:
+        slice_x = int(data_3D.shape[2] / 2)
+    if slice_y == -1:
+        slice_y = int(data_3D.shape[1] / 2)
+    if slice_z == -1:
+        slice_z = int(data_3D.shape[0] / 2)
+
+    return (
+        data_3D[int(slice_z), :, :],
+        data_3D[:, int(slice_y), :],
+        data_3D[:, :, int(slice_x)],
+    )
 
 
 def writemidplanes(data_3D, fileout, slice_x=-1, slice_y=-1, slice_z=-1):
@@ -218,7 +390,7 @@ def writemidplanes(data_3D, fileout, slice_x=-1, slice_y=-1, slice_z=-1):
     Parameters
     ----------
     data
-        Input 3D image data.
+        Input 3D image data or tuple of (XY, XZ, YZ) planes.
     fileout : str
         Output .PNG image file name.
     slice_x : int
@@ -229,44 +401,20 @@ def writemidplanes(data_3D, fileout, slice_x=-1, slice_y=-1, slice_z=-1):
         Z-slice number.
     """
 
-    if data_3D.ndim == 3:
-        if slice_x == -1:
-            slice_x = int(data_3D.shape[2] / 2)
-        if slice_y == -1:
-            slice_y = int(data_3D.shape[1] / 2)
-        if slice_z == -1:
-            slice_z = int(data_3D.shape[0] / 2)
+    if isinstance(data_3D, (tuple, list)) or data_3D.ndim == 3:
+        planes = midplanes(data_3D, slice_x, slice_y, slice_z)
 
         filename, ext = os.path.splitext(fileout)
-        with open(filename + "_XY.png", "wb") as midplaneXY:
-            pngWriter = png.Writer(
-                data_3D.shape[2],
-                data_3D.shape[1],
-                greyscale=True,
-                alpha=False,
-                bitdepth=8,
-            )
-            pngWriter.write(midplaneXY, touint(data_3D[int(slice_z), :, :]))
-
-        with open(filename + "_XZ.png", "wb") as midplaneXZ:
-            pngWriter = png.Writer(
-                data_3D.shape[2],
-                data_3D.shape[0],
-                greyscale=True,
-                alpha=False,
-                bitdepth=8,
-            )
-            pngWriter.write(midplaneXZ, touint(data_3D[:, int(slice_y), :]))
-
-        with open(filename + "_YZ.png", "wb") as midplaneYZ:
-            pngWriter = png.Writer(
-                data_3D.shape[1],
-                data_3D.shape[0],
-                greyscale=True,
-                alpha=False,
-                bitdepth=8,
-            )
-            pngWriter.write(midplaneYZ, touint(data_3D[:, :, int(slice_x)]))
+        for plane, name in zip(planes, ["XY", "XZ", "YZ"]):
+            with open(filename + "_" + name + ".png", "wb") as midplane:
+                pngWriter = png.Writer(
+                    plane.shape[1],
+                    plane.shape[0],
+                    greyscale=True,
+                    alpha=False,
+                    bitdepth=8,
+                )
+                pngWriter.write(midplane, touint(plane))
 
 
 def writemidplanesDxchange(
@@ -278,7 +426,7 @@ def writemidplanesDxchange(
     Parameters
     ----------
     data_3D
-        Input 3D image data.
+        Input 3D image data or tuple of (XY, XZ, YZ) planes.
     fileout : str
         Output .PNG image file name.
     slice_x : int
@@ -289,30 +437,16 @@ def writemidplanesDxchange(
         Z-slice number.
     """
 
-    if data_3D.ndim == 3:
-        if slice_x == -1:
-            slice_x = int(data_3D.shape[2] / 2)
-        if slice_y == -1:
-            slice_y = int(data_3D.shape[1] / 2)
-        if slice_z == -1:
-            slice_z = int(data_3D.shape[0] / 2)
+    if isinstance(data_3D, (tuple, list)) or data_3D.ndim == 3:
+        planes = midplanes(data_3D, slice_x, slice_y, slice_z)
 
         filename, ext = os.path.splitext(fileout)
-        dxchange.writer.write_tiff(
-            touint(data_3D[int(slice_z), :, :]),
-            fname=filename + "_XY.tiff",
-            dtype=dtype,
-        )
-        dxchange.writer.write_tiff(
-            touint(data_3D[:, int(slice_y), :]),
-            fname=filename + "_XZ.tiff",
-            dtype=dtype,
-        )
-        dxchange.writer.write_tiff(
-            touint(data_3D[:, :, int(slice_x)]),
-            fname=filename + "_YZ.tiff",
-            dtype=dtype,
-        )
+        for plane, name in zip(planes, ["XY", "XZ", "YZ"]):
+            dxchange.writer.write_tiff(
+                touint(plane),
+                fname=filename + "_" + name + ".tiff",
+                dtype=dtype,
+            )
 
 
 def plot_midplanes(data_3D, slice_x=-1, slice_y=-1, slice_z=-1):
@@ -321,7 +455,7 @@ def plot_midplanes(data_3D, slice_x=-1, slice_y=-1, slice_z=-1):
     Parameters
     ----------
     data_3D
-        Input 3D image data.
+        Input 3D image data or tuple of (XY, XZ, YZ) planes.
     slice_x : int
         X-slice number.
     slice_y : int
@@ -330,17 +464,12 @@ def plot_midplanes(data_3D, slice_x=-1, slice_y=-1, slice_z=-1):
         Z-slice number.
     """
 
-    if slice_x == -1:
-        slice_x = int(data_3D.shape[2] / 2)
-    if slice_y == -1:
-        slice_y = int(data_3D.shape[1] / 2)
-    if slice_z == -1:
-        slice_z = int(data_3D.shape[0] / 2)
+    XY, XZ, YZ = midplanes(data_3D, slice_x, slice_y, slice_z)
 
     fig, (ax1, ax2, ax3) = plt.subplots(1, 3)
-    ax1.imshow(data_3D[slice_z, :, :])
-    ax2.imshow(data_3D[:, slice_y, :])
-    ax3.imshow(data_3D[:, :, slice_x])
+    ax1.imshow(XY)
+    ax2.imshow(XZ)
+    ax3.imshow(YZ)
 
 
 def plot_projections(data_3D, projection="max"):
@@ -366,56 +495,245 @@ def plot_projections(data_3D, projection="max"):
         ax3.imshow(np.min(data_3D, 2))
 
 
-def read_tiff_stack(filename, data_range=None, zfill=4):
-    """Read stack of tiff files. Searches all files in parent folder and opens them as a stack of images.
+class TiffStack:
+    """Lazy 3D volume of a stack of 2D TIFF files (one file per slice).
+    The directory is indexed once by the slice number parsed from the file names (last group of digits).
+    Only the files of the requested z-slices are decoded, in a thread pool. Indexing follows numpy ([Z,Y,X]).
+
+    Parameters
+    ----------
+    filename
+        One of the stack images. All files of the folder with the same name pattern are part of the stack.
+    n_jobs : int
+        Number of decoding threads. -1 uses all CPUs. Defaults to 1.
+    cache : str
+        Persistent cache of the decoded slices (.npy file). Decoded slices are stored in a np.memmap and are
+        read from it by later instances. The cache is rebuilt if the files of the stack change.
+
+    Examples
+    --------
+    >>> stack = TiffStack('/data/scan/slice_0000.tif', n_jobs=8, cache='/scratch/scan.npy')
+    >>> stack.shape
+    (2000, 1024, 1024)
+    >>> ROI = stack[500:600, 200:400, 200:400]
+    >>> I = stack[stack.index(100, 200)]
+    """
+
+    def __init__(self, filename, n_jobs=None, cache=None):
+        directory = os.path.dirname(os.path.abspath(filename))
+        name = os.path.basename(filename)
+        match = re.search(r"(\d+)(\D*)$", name)
+        if match is None:
+            raise ValueError("No slice number in file name {0}.".format(name))
+        prefix, suffix = name[: match.start(1)], match.group(2)
+        pattern = re.compile(re.escape(prefix) + r"(\d+)" + re.escape(suffix) + "$")
+
+        # index the directory once by slice number
+        files = {}
+        for f in os.listdir(directory):
+            m = pattern.match(f)
+            if m is not None and os.path.isfile(os.path.join(directory, f)):
+                files[int(m.group(1))] = os.path.join(directory, f)
+        self.slice_numbers = np.array(sorted(files))
+        self.files = [files[n] for n in self.slice_numbers]
+
+        with tifffile.TiffFile(self.files[0]) as tif:
+            page = tif.pages[0]
+            self.shape = (len(self.files),) + tuple(page.shape)
+            self.dtype = np.dtype(page.dtype)
+        self.ndim = 3
+
+        if n_jobs is None:
+            n_jobs = 1
+        elif n_jobs < 0:
+            n_jobs = os.cpu_count()
+        self.n_jobs = n_jobs
+
+        self._cache = None
+        self._cached = None
+        if cache is not None:
+            self._open_cache(cache)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return "TiffStack({0} slices {1}-{2}, shape={3}, dtype={4})".format(
+            len(self.files),
+            self.slice_numbers[0],
+            self.slice_numbers[-1],
+            self.shape,
+            self.dtype,
+        )
+
+    def _open_cache(self, cache):
+        import json
+        from numpy.lib.format import open_memmap
+
+        manifest = {
+            "shape": list(self.shape),
+            "dtype": self.dtype.str,
+            "files": [
+                [os.path.basename(f), os.stat(f).st_size, os.stat(f).st_mtime_ns]
+                for f in self.files
+            ],
+        }
+        manifest_file = cache + ".json"
+        status_file = cache + ".slices.npy"
+
+        valid = False
+        if os.path.exists(manifest_file) and os.path.exists(status_file):
+            with open(manifest_file) as f:
+                valid = json.load(f) == manifest
+
+        if valid:
+            self._cache = open_memmap(cache, mode="r+")
+            self._cached = open_memmap(status_file, mode="r+")
+        else:
+            self._cache = open_memmap(
+                cache, mode="w+", dtype=self.dtype, shape=self.shape
+            )
+            self._cached = open_memmap(
+                status_file, mode="w+", dtype=bool, shape=(self.shape[0],)
+            )
+            with open(manifest_file, "w") as f:
+                json.dump(manifest, f)
+
+    def index(self, start, end=None):
+        """z-indices of the slices with slice number in [start, end).
+
+        Returns
+        -------
+        z : slice
+            Slice of the z-indices.
+        """
+
+        if end is None:
+            end = start + 1
+        z0, z1 = np.searchsorted(self.slice_numbers, [start, end])
+        if z1 <= z0:
+            raise ValueError(
+                "No slices in range [{0}, {1}). Stack slices: {2}-{3}.".format(
+                    start, end, self.slice_numbers[0], self.slice_numbers[-1]
+                )
+            )
+        return slice(int(z0), int(z1))
+
+    def _read(self, z, out):
+        with tifffile.TiffFile(self.files[z]) as tif:
+            tif.asarray(out=out)
+
+    def read(self, z):
+        """Read slices z (list of z-indices) as a 3D array. Missing slices are decoded in parallel."""
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        z = np.asarray(z, dtype=np.intp)
+        out = np.empty((len(z),) + self.shape[1:], dtype=self.dtype)
+
+        missing = np.arange(len(z))
+        if self._cache is not None:
+            cached = self._cached[z]
+            out[cached] = self._cache[z[cached]]
+            missing = missing[~cached]
+
+        if len(missing) > 0:
+            with ThreadPoolExecutor(max_workers=self.n_jobs) as executor:
+                for future in [
+                    executor.submit(self._read, z[k], out[k]) for k in missing
+                ]:
+                    future.result()
+
+            if self._cache is not None:
+                self._cache[z[missing]] = out[missing]
+                self._cache.flush()
+                self._cached[z[missing]] = True
+                self._cached.flush()
+
+        return out
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if key and key[0] is Ellipsis:
+            key = (slice(None),) * (4 - len(key)) + key[1:]
+        z = np.arange(self.shape[0])[key[0]] if key else np.arange(self.shape[0])
+        data = self.read(np.atleast_1d(z))
+        if np.ndim(z) == 0:
+            data = data[0]
+        return data[(Ellipsis,) + key[1:]] if len(key) > 1 else data
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[:]
+        return data if dtype is None else data.astype(dtype, copy=False)
+
+
+def read_tiff_stack(filename, data_range=None, zfill=4, n_jobs=None, lazy=False):
+    """Read stack of tiff files. Searches all files in parent folder with the same name pattern and opens them as a stack of images.
 
     Parameters
     ----------
     filename
         One of the stack images.
     data_range : [int, int]
-        Control load slices range.
+        Control load slices range: slice numbers [start, end) parsed from the file names.
     zfill : int
-        Number of leading zeros in file names.
+        Number of leading zeros in file names. Not used (the slice numbers are parsed from the file names).
+    n_jobs : int
+        Number of decoding threads. -1 uses all CPUs. Defaults to 1.
+    lazy : bool
+        Return a lazy TiffStack (of the whole stack) instead of reading the data.
 
-    TO DO:
-    ----------
-    - check that folder contains only .TIFF files; skip the rest
+    Returns
+    -------
+    data_3D
+        Image stack [Z,Y,X].
     """
 
-    # search all files in parent folder; create filenames list
-    stack_files = [
-        os.path.join(os.path.dirname(filename), f)
-        for f in os.listdir(os.path.dirname(filename))
-        if os.path.isfile(os.path.join(os.path.dirname(filename), f))
-    ]
-    stack_files.sort()
-
-    if data_range is not None:
-        import re
-
-        slice_in = [
-            i
-            for i, item in enumerate(stack_files)
-            if re.search(str(data_range[0]).zfill(4) + ".", item)
-        ]
-        slice_end = [
-            i
-            for i, item in enumerate(stack_files)
-            if re.search(str(data_range[1]).zfill(4) + ".", item)
-        ]
-
-        if len(slice_in) == 1 and len(slice_end) == 1:
-            stack_files = stack_files[slice_in[0] : slice_end[0]]
-        else:
-            import warnings
+    stack = TiffStack(filename, n_jobs=n_jobs)
+    if lazy:
+        return stack
 
-            warnings.warn(
-                "Given slice range is ambiguous or non existing.. loading whole stack."
-            )
+    if data_range is None:
+        return stack[:]
+    return stack[stack.index(data_range[0], data_range[1])]
 
-    # load stack using tifffile
-    return tifffile.imread(stack_files)
+
+def _stack_fnames(fname, n, start=0, digit=5, ext=".jp2", overwrite=False):
+    """Names of the n files of an image stack. The directory is listed once.
+    If overwrite is False, existing files are not replaced: a suffix -1, -2, .. is added to their names
+    (as dxchange.writer._suggest_new_fname).
+    """
+
+    if not fname.endswith(ext):
+        fname = fname + ext
+    body = os.path.splitext(fname)[0]
+    directory = os.path.dirname(os.path.abspath(fname))
+    os.makedirs(directory, exist_ok=True)
+    existing = set(os.listdir(directory))
+
+    fnames = []
+    for m in range(start, start + n):
+        _fname = body + "_" + "{0:0={1}d}".format(m, digit) + ext
+        if not overwrite:
+            _body = os.path.splitext(_fname)[0]
+            k = 0
+            while os.path.basename(_fname) in existing:
+                k += 1
+                _fname = _body + "-" + str(k) + ext
+            existing.add(os.path.basename(_fname))
+        fnames.append(_fname)
+    return fnames
+
+
+def _jp2_init(nthreads):
+    """Codec setup of each writer process."""
+
+    glymur.set_option("lib.num_threads", nthreads)
+
+
+def _jp2_write(fname, image, compratio):
+    glymur.Jp2k(fname, data=image, cratios=[compratio])
 
 
 def write_jpeg2000_stack(
@@ -428,14 +746,21 @@ def write_jpeg2000_stack(
     nthreads=1,
     compratio=10,
     overwrite=False,
+    n_jobs=None,
+    chunk_size=16,
+    executor="thread",
+    verbose=False,
 ):
     """
     Write data to stack of JPEG2000 files using glymur. Inspired by dxchange.write_tiff_stack
+    The file names are resolved before writing. Slices are read in chunks and encoded in a pool of n_jobs workers.
+    Only the chunk being read and the slices in flight (2 x n_jobs) are kept in memory: data can be a lazy volume
+    (e.g. numpy memmap from ISQmethods.ISQmemmap, zarr array, TiffStack) and is streamed to disk.
 
     Parameters
     ----------
-    data : ndarray
-        Array data to be saved.
+    data
+        Array data to be saved. Any array supporting slicing.
     fname : str
         Base file name to which the data is saved. ``.jp2`` extension
         will be appended if it does not already have one.
@@ -448,24 +773,93 @@ def write_jpeg2000_stack(
     digit : int, optional
         Number of digits in indexing stacked files.
     nthreads : int, optional
-        Number of threads for parallel write.
+        Number of OpenJPEG threads of each encoder.
     compratio : int, optional
         Compression ratio.
     overwrite: bool, optional
         if True, overwrites the existing file if the file exists.
+    n_jobs : int, optional
+        Number of slices encoded in parallel. -1 uses all CPUs. Defaults to 1.
+    chunk_size : int, optional
+        Number of slices read from data at once.
+    executor : str, optional
+        'thread' (OpenJPEG releases the GIL) or 'process' pool of encoders.
+    verbose : bool, optional
+        Show progress bar and throughput (slices/s).
+
+    Returns
+    -------
+    fnames : list
+        Names of the written files.
     """
 
-    fname, data = dxchange.writer._init_write(data, fname, ".jp2", dtype, True)
-    body = dxchange.writer.get_body(fname)
-    ext = dxchange.writer.get_extension(fname)
-    _data = np.swapaxes(data, 0, axis)
-    for m in range(start, start + data.shape[axis]):
-        _fname = body + "_" + "{0:0={1}d}".format(m, digit) + ext
-        if not overwrite:
-            _fname = dxchange.writer._suggest_new_fname(_fname, digit=1)
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+    import time
+
+    if executor not in ["thread", "process"]:
+        raise IOError("{0} executor unknown.".format(executor))
+
+    if n_jobs is None:
+        n_jobs = 1
+    elif n_jobs < 0:
+        n_jobs = os.cpu_count()
 
-        glymur.set_option("lib.num_threads", nthreads)
-        glymur.Jp2k(_fname, data=_data[m - start], cratios=[compratio])
+    n = data.shape[axis]
+    fnames = _stack_fnames(fname, n, start, digit, ".jp2", overwrite)
+
+    if executor == "thread":
+        _jp2_init(nthreads)
+        pool = ThreadPoolExecutor(max_workers=n_jobs)
+    else:
+        pool = ProcessPoolExecutor(
+            max_workers=n_jobs, initializer=_jp2_init, initargs=(nthreads,)
+        )
+
+    if verbose:
+        from tqdm import tqdm
+
+        progress = tqdm(total=n, unit="slice")
+
+    t0 = time.perf_counter()
+    with pool:
+        pending = deque()
+        for z0 in range(0, n, chunk_size):
+            z1 = min(z0 + chunk_size, n)
+            index = [slice(None)] * data.ndim
+            index[axis] = slice(z0, z1)
+            chunk = np.moveaxis(np.asarray(data[tuple(index)]), axis, 0)
+            if dtype is not None:
+                chunk = chunk.astype(dtype, copy=False)
+
+            for m in range(z1 - z0):
+                pending.append(
+                    pool.submit(
+                        _jp2_write,
+                        fnames[z0 + m],
+                        np.ascontiguousarray(chunk[m]),
+                        compratio,
+                    )
+                )
+                if len(pending) >= 2 * n_jobs:
+                    pending.popleft().result()
+                    if verbose:
+                        progress.update()
+        while pending:
+            pending.popleft().result()
+            if verbose:
+                progress.update()
+
+    if verbose:
+        progress.close()
+    elapsed = time.perf_counter() - t0
+    logging.info(
+        "write_jpeg2000_stack: {0} slices in {1:.1f} s ({2:.1f} slices/s)".format(
+            n, elapsed, n / elapsed if elapsed > 0 else np.inf
+        )
+    )
+
+    return fnames
 
 
 def bbox(bw, pad=0, dsize=None, verbose=None):
@@ -580,3 +974,162 @@ def crop(data_3D, crop_origin, crop_size):
         crop_origin[0] : crop_origin[0] + crop_size[0],
         crop_origin[1] : crop_origin[1] + crop_size[1],
     ]
+
+
+def _zoom_range(o0, o1, scale, n_in, margin):
+    """Input range [i0, i1) sampled by the output rows [o0, o1) of a zoom with input/output scale."""
+
+    i0 = int(np.floor(o0 * scale)) - margin
+    i1 = int(np.floor((o1 - 1) * scale)) + 2 + margin
+    return max(i0, 0), min(i1, n_in)
+
+
+def process_chunked(
+    data_3D,
+    func=None,
+    halo=0,
+    zoom=None,
+    order=1,
+    mode="constant",
+    output=None,
+    dtype=None,
+    chunk_size=64,
+    n_jobs=None,
+):
+    """Out-of-core processing of 3D image in z-tiles with halos.
+    Each tile of the input is read with a halo of slices, processed with func, cropped and (optionally) zoomed.
+    Tiles are processed in a thread pool and written to the output as they are completed.
+    Only the tiles in flight are kept in memory (2 x n_jobs).
+
+    For functions with a finite support along z (e.g. scipy.ndimage.gaussian_filter with halo >= int(truncate*sigma+0.5),
+    pointwise thresholds) the result matches the whole-volume call. The zoom follows scipy.ndimage.zoom
+    (grid_mode=False) and is exact for order <= 1.
+
+    Parameters
+    ----------
+    data_3D
+        Input 3D image data [Z,Y,X]. Any array supporting slicing along z (e.g. numpy memmap from ISQmethods.ISQmemmap, zarr array).
+    func
+        Function applied to each tile. Takes and returns a 3D array of the same shape.
+    halo : int
+        Number of extra slices read on each side of the tile for func.
+    zoom : float or [float, float, float]
+        Zoom factor [Z,Y,X] applied after func.
+    order : int
+        Spline interpolation order of the zoom.
+    mode : str
+        Boundary mode of the zoom (see scipy.ndimage.zoom).
+    output
+        Output array (e.g. numpy memmap or zarr array). If None (default), a new array is returned.
+    dtype
+        Output data type if output is None. Defaults to the input data type.
+    chunk_size : int
+        Number of output slices per tile.
+    n_jobs : int
+        Number of threads. -1 uses all CPUs. Defaults to 1.
+
+    Returns
+    -------
+    output
+        Processed data.
+
+    Examples
+    --------
+    Gaussian filter, threshold and zoom of an ISQ scan:
+
+    >>> def filt(tile):
+    ...     tile = gaussian_filter(tile, sigma=1.3)
+    ...     np.putmask(tile, tile < 1000, 2000)
+    ...     return tile
+    >>> small = process_chunked(ISQmemmap(filename), filt, halo=int(4 * 1.3 + 0.5) + 1, zoom=0.1)
+    """
+
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+    from scipy import ndimage
+
+    in_shape = tuple(data_3D.shape)
+    if zoom is None:
+        out_shape = in_shape
+        scale = None
+    else:
+        zoom = np.broadcast_to(np.asarray(zoom, dtype=np.float64), (3,))
+        out_shape = tuple(int(round(n * z)) for n, z in zip(in_shape, zoom))
+        # scipy.ndimage.zoom maps the corners of input and output (grid_mode=False)
+        scale = np.array(
+            [
+                (n_in - 1) / (n_out - 1) if n_out > 1 else 1.0
+                for n_in, n_out in zip(in_shape, out_shape)
+            ]
+        )
+        # the last output coordinates must not be rounded out of the input
+        for axis in range(3):
+            while scale[axis] * (out_shape[axis] - 1) > in_shape[axis] - 1:
+                scale[axis] = np.nextafter(scale[axis], -np.inf)
+        # spline prefiltering is global: extend the tiles where its effect has decayed
+        margin = 0 if order <= 1 else 12
+
+    if output is None:
+        if dtype is None:
+            dtype = data_3D.dtype
+        output = np.empty(out_shape, dtype=dtype)
+    elif tuple(output.shape) != out_shape:
+        raise ValueError(
+            "Output shape {0} does not match {1}.".format(output.shape, out_shape)
+        )
+
+    if n_jobs is None:
+        n_jobs = 1
+    elif n_jobs < 0:
+        n_jobs = os.cpu_count()
+
+    def process(o0, o1):
+        # input slices needed for the output tile
+        if zoom is None:
+            i0, i1 = o0, o1
+        else:
+            i0, i1 = _zoom_range(o0, o1, scale[0], in_shape[0], margin)
+
+        r0, r1 = max(i0 - halo, 0), min(i1 + halo, in_shape[0])
+        tile = np.asarray(data_3D[r0:r1])
+        if func is not None:
+            tile = func(tile)
+        tile = tile[i0 - r0 : i1 - r0]
+
+        if zoom is None:
+            return tile.astype(output.dtype, copy=False)
+
+        # the last coordinate can be rounded out of the input: move it back inside
+        offset = o0 * scale[0] - i0
+        if i1 == in_shape[0]:
+            while offset + scale[0] * (o1 - 1 - o0) > i1 - 1 - i0:
+                offset = np.nextafter(offset, -np.inf)
+
+        # full matrix: a diagonal matrix is applied as zoom and shift with a different rounding
+        return ndimage.affine_transform(
+            tile,
+            np.diag(scale),
+            offset=[offset, 0, 0],
+            output_shape=(o1 - o0,) + out_shape[1:],
+            output=output.dtype,
+            order=order,
+            mode=mode,
+        )
+
+    tiles = [
+        (o0, min(o0 + chunk_size, out_shape[0]))
+        for o0 in range(0, out_shape[0], chunk_size)
+    ]
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        pending = deque()
+        for o0, o1 in tiles:
+            pending.append((o0, o1, executor.submit(process, o0, o1)))
+            if len(pending) >= 2 * n_jobs:
+                p0, p1, future = pending.popleft()
+                output[p0:p1] = future.result()
+        while pending:
+            p0, p1, future = pending.popleft()
+            output[p0:p1] = future.result()
+
+    return output
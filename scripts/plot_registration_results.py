@@ -45,7 +45,7 @@ sys.path.append('/usr/terminus/data-xrm-01/stamplab/users/giiori/code/pyfabric')
 sys.path.append('/usr/terminus/data-xrm-01/stamplab/users/giiori/code/ORMIR_XCT')
 sys.path.append('/usr/terminus/data-xrm-01/stamplab/users/giiori/code/recon_utils')
 
-from ISQmethods import ISQload, readheader
+from ISQmethods import readmidplanes, readheader
 from recon_utils import to01
 
 data_dir = "/usr/terminus/data-xrm-01/stamplab/external/tacosound/"
@@ -141,9 +141,8 @@ for specimen_id, specimen in enumerate(target_folders):
     print(f"QCT center: cz2={cz2}, cy2={cy2}, cx2={cx2}")
 
     # image_data_yz, _, _ = np.zeros((y_size, z_size), dtype=np.int16), None, None
-    image_data_yz, _, _ = ISQload(file_path, x_min=cx1, y_min=0, z_min=0, x_size=1, y_size=y_size, z_size=z_size)
-    image_data_xz, _, _ = ISQload(file_path, x_min=0, y_min=cy1, z_min=0, x_size=x_size, y_size=1, z_size=z_size)
-    image_data_xy, _, _ = ISQload(file_path, x_min=0, y_min=0, z_min=cz1, x_size=x_size, y_size=y_size, z_size=1)
+    # the three planes are read in one sequential pass over the ISQ slices
+    image_data_xy, image_data_xz, image_data_yz = readmidplanes(file_path, slice_x=cx1, slice_y=cy1, slice_z=cz1, z_size=z_size, header=header)
 
     print(f"Loaded ISQ slices for {specimen} in {time.time() - start_time:.2f} seconds")
     print(f"image_data_yz shape: {image_data_yz.shape}, dtype: {image_data_yz.dtype}")
@@ -152,15 +151,15 @@ for specimen_id, specimen in enumerate(target_folders):
 
     if bg == "QCT":
         planes = [
-            (cv2.resize(to01(array_QCT[:, :, cx2]), (y_size, z_size), interpolation=cv2.INTER_LINEAR), to01(image_data_yz[:, :, 0])),
-            (cv2.resize(to01(array_QCT[:, cy2, :]), (x_size, z_size), interpolation=cv2.INTER_LINEAR), to01(image_data_xz[:, 0, :])),
-            (cv2.resize(to01(array_QCT[cz2, :, :]), (y_size, x_size), interpolation=cv2.INTER_LINEAR), to01(image_data_xy[0, :, :])),
+            (cv2.resize(to01(array_QCT[:, :, cx2]), (y_size, z_size), interpolation=cv2.INTER_LINEAR), to01(image_data_yz)),
+            (cv2.resize(to01(array_QCT[:, cy2, :]), (x_size, z_size), interpolation=cv2.INTER_LINEAR), to01(image_data_xz)),
+            (cv2.resize(to01(array_QCT[cz2, :, :]), (y_size, x_size), interpolation=cv2.INTER_LINEAR), to01(image_data_xy)),
         ]
     else:
         planes = [
-            (to01(image_data_yz[:, :, 0]), cv2.resize(to01(array_QCT[:, :, cx2]), (y_size, z_size), interpolation=cv2.INTER_LINEAR)),
-            (to01(image_data_xz[:, 0, :]), cv2.resize(to01(array_QCT[:, cy2, :]), (x_size, z_size), interpolation=cv2.INTER_LINEAR)),
-            (to01(image_data_xy[0, :, :]), cv2.resize(to01(array_QCT[cz2, :, :]), (y_size, x_size), interpolation=cv2.INTER_LINEAR)),
+            (to01(image_data_yz), cv2.resize(to01(array_QCT[:, :, cx2]), (y_size, z_size), interpolation=cv2.INTER_LINEAR)),
+            (to01(image_data_xz), cv2.resize(to01(array_QCT[:, cy2, :]), (x_size, z_size), interpolation=cv2.INTER_LINEAR)),
+            (to01(image_data_xy), cv2.resize(to01(array_QCT[cz2, :, :]), (y_size, x_size), interpolation=cv2.INTER_LINEAR)),
         ]
 
     # plot merge of the two images
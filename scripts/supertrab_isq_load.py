@@ -8,7 +8,8 @@ sys.path.append(os.path.abspath(".."))
 sys.path.append(os.path.abspath("~/myterminus/code/pyfabric/"))
 # sys.path.append(os.path.abspath("/home/mwahlin/myterminus/2025/trab_master/CT_pipeline/pyfabric/tests"))
 
-from ISQmethods import ISQload
+from ISQmethods import ISQmemmap, readheader
+from recon_utils import process_chunked
 
 #filtering and image processing
 import numpy as np
@@ -49,23 +50,22 @@ for subfolder in target_folders:
     file_path = os.path.join(folder_path, isq_file)
 
     #TODO change to all slices
-    #Load image
-    image_data, ISQheader, filename = ISQload(file_path, x_min=0, y_min=0, z_min=0, x_size=4608, y_size=4608, z_size=5105)
-    # image_data, ISQheader, filename = ISQload(file_path)
+    #Open image (memory map: slices are read from disk tile by tile)
+    ISQheader = readheader(file_path)
+    filename = file_path
+    image_data = ISQmemmap(file_path, ISQheader)[:5105, :4608, :4608]
 
     #Process image
-    image_data[:] = gaussian_filter(image_data, sigma=sigma)
-    np.putmask(image_data, image_data < 1000, 2000)
-
-    #create an empty array to store results of downsampling
-    new_shape = tuple(round(s * scale_factor) for s in image_data.shape)
-    downsampled_image = np.empty(new_shape, dtype=np.int16)
-
-    # downsample image
-    zoom(image_data, scale_factor_array, order=1, output=downsampled_image).astype(np.int16)
-
-    # free memory from raw image
-    del image_data
+    def process_tile(tile):
+        tile = gaussian_filter(tile, sigma=sigma)
+        np.putmask(tile, tile < 1000, 2000)
+        return tile
+
+    # filter, threshold and downsample image in z-tiles with halos of the Gaussian support
+    # tiles of 16 output slices (~160 input slices): the halo and zoom margin are re-read for a few % of the slices.
+    # Each tile in work takes ~2 x 170 x 4608^2 x 2 bytes (~14 GB): n_jobs bounds the memory use
+    downsampled_image = process_chunked(image_data, process_tile, halo=int(4 * sigma + 0.5), zoom=scale_factor_array,
+                                        order=1, dtype=np.int16, chunk_size=16, n_jobs=4)
 
     #Save image as .mha
     sitk_image = sitk.GetImageFromArray(downsampled_image)
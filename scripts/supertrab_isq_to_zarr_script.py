@@ -11,17 +11,13 @@ import sys
 import time
 import numpy as np
 import zarr
+from numcodecs import Blosc
 from pathlib import Path
 
-#for storing metadata
-def convert_header(header):
-    return {key: int(value) if isinstance(value, (np.integer, np.int16, np.int32, np.int64)) else value 
-            for key, value in header.items()}
-
 # import pyfabric
 sys.path.append(os.path.abspath(os.path.dirname(__file__) + "/.."))
 sys.path.append("/home/mwahlin/myterminus/2025/trab_master/CT_pipeline/pyfabric/tests")
-from ISQmethods import ISQload
+from ISQmethods import ISQ2zarr
 
 # Define paths
 STORAGE = "/usr/terminus/data-xrm-01/stamplab/external/tacosound/HR-pQCT_II"
@@ -44,8 +40,9 @@ target_folders = [
     "2019_L"
 ]
 
-# Define chunk size
+# Define chunk size and compressor
 chunk_size = (128, 512, 512)
+compressor = Blosc(cname="zstd", clevel=3, shuffle=Blosc.BITSHUFFLE)
 
 # Read the .isq (to a numpy array?)
 for subfolder in target_folders:
@@ -57,20 +54,15 @@ for subfolder in target_folders:
     isq_file = isq_files[0]
     file_path = os.path.join(folder_path, isq_file)
 
-    #Load image
-    image_data, ISQheader, filename = ISQload(file_path)
-    print(image_data.shape)
-
     #Create .zarr group
     sample_group = root.create_group(subfolder)
 
-    #Save data to .zarr
+    #Stream image to .zarr (native int16, multiscale pyramid and ISQ header attributes)
     print(f"Saving image data for {subfolder}")
-    sample_group.create_dataset("image", data=image_data, chunks=chunk_size, dtype=np.float32)
+    image_group = ISQ2zarr(file_path, sample_group.create_group("image"), chunk_size=chunk_size, levels=4,
+                           compressor=compressor)
+    print(image_group["0"].shape)
 
-    # Free memory
-    del image_data
-    
     print(f"{subfolder} processed in {time.time() - start_time:.2f} seconds")
 
 # Print stored structure
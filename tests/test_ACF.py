@@ -0,0 +1,59 @@
+import warnings
+import numpy as np
+import pytest
+import pyfabric
+
+
+def test_ACF_rfft_matches_fftn():
+    rng = np.random.default_rng(0)
+    for shape in [(40, 40, 40), (37, 40, 41), (21, 22, 23)]:
+        I = (rng.random(shape) * 1000).astype(np.int16)
+        ACF_ref = pyfabric.ACF(I, method="fftn")
+
+        for fast_len in [False, True]:
+            ACF_I = pyfabric.ACF(I, method="rfft", fast_len=fast_len)
+            assert ACF_I.shape == I.shape
+            assert ACF_I.dtype == np.float32
+            assert np.argmax(ACF_I) == np.argmax(ACF_ref)
+
+        # without padding the circular ACF is reproduced up to single precision
+        ACF_I = pyfabric.ACF(I, method="rfft", fast_len=False)
+        assert np.allclose(ACF_I, ACF_ref, rtol=0, atol=1e-5 * ACF_ref.max())
+
+
+def test_ACF_backends():
+    rng = np.random.default_rng(1)
+    I = (rng.random((40, 40, 40)) * 1000).astype(np.uint16)
+    ROI = I[:37, :, :39]
+    ACF_ref = pyfabric.ACF(I, method="fftn")
+    ACF_ROI_ref = pyfabric.ACF(ROI, shape=[40] * 3, backend="numpy")
+
+    for backend in ["numpy", "scipy", "pyfftw"]:
+        for workers in [None, 2]:
+            # repeated calls reuse the cached plans and buffers
+            for _ in range(2):
+                ACF_I = pyfabric.ACF(I, backend=backend, workers=workers)
+                assert np.allclose(ACF_I, ACF_ref, rtol=0, atol=1e-5 * ACF_ref.max())
+
+            # clipped ROIs are padded to the canonical shape
+            ACF_ROI = pyfabric.ACF(
+                ROI, shape=[40] * 3, backend=backend, workers=workers
+            )
+            assert ACF_ROI.shape == ROI.shape
+            assert np.allclose(
+                ACF_ROI, ACF_ROI_ref, rtol=0, atol=1e-5 * ACF_ROI_ref.max()
+            )
+
+
+def test_FFTBackend_abstract():
+    import fft_backend
+
+    with pytest.raises(TypeError):
+        fft_backend.FFTBackend()
+
+    # numpy backend without deprecated implicit axes
+    I = np.random.default_rng(2).random((8, 10, 12))
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        ACF_I = pyfabric.ACF(I, backend="numpy")
+    assert np.allclose(ACF_I, pyfabric.ACF(I, method="fftn"))
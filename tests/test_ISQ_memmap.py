@@ -0,0 +1,139 @@
+import struct
+import numpy as np
+import ISQmethods
+from ISQdata import ISQdata
+
+
+def write_ISQ(filename, data, offset_blocks=1):
+    """Write (z, y, x) int16 data to a minimal Scanco ISQ file."""
+
+    z_dim, y_dim, x_dim = data.shape
+    header = bytearray(512 * (offset_blocks + 1))
+    header[0:16] = b"CTDATA-HEADER_V1"
+    struct.pack_into("3i", header, 44, x_dim, y_dim, z_dim)
+    struct.pack_into("3i", header, 56, 10 * x_dim, 10 * y_dim, 10 * z_dim)
+    header[128:136] = b"phantom "
+    struct.pack_into("I", header, 508, offset_blocks)
+    with open(filename, "wb") as fid:
+        fid.write(header)
+        fid.write(data.astype("<i2").tobytes())
+
+
+def test_ISQ_memmap(tmp_path):
+    rng = np.random.default_rng(0)
+    data = rng.integers(-1000, 5000, (20, 17, 13), dtype=np.int16)
+    filename = str(tmp_path / "phantom.ISQ")
+    write_ISQ(filename, data)
+
+    header = ISQmethods.readheader(filename)
+    assert (header["z_dim"], header["y_dim"], header["x_dim"]) == data.shape
+    assert header["offset"] == 1024
+
+    assert np.array_equal(ISQmethods.ISQmemmap(filename), data)
+
+    sub, header, _ = ISQmethods.ISQload(filename, 3, 2, 5, 7, 10, 4)
+    assert np.array_equal(sub, data[5:9, 2:12, 3:10])
+
+    full, header, _ = ISQmethods.ISQload(filename)
+    assert np.array_equal(full, data)
+
+    # ISQdata: 1-based indices and (y, x, z) layout
+    assert ISQdata.readheader(filename)["x_dim"] == data.shape[2]
+    sub = ISQdata.readdata(filename, 4, 3, 6, 7, 10, 4)
+    assert np.array_equal(sub, np.transpose(data[5:9, 2:12, 3:10], (1, 2, 0)))
+
+
+def test_ISQ_planes(tmp_path):
+    rng = np.random.default_rng(1)
+    data = rng.integers(-1000, 5000, (21, 17, 13), dtype=np.int16)
+    filename = str(tmp_path / "phantom.ISQ")
+    write_ISQ(filename, data)
+
+    assert np.array_equal(ISQmethods.readplane(filename, "XY", 4), data[4])
+    assert np.array_equal(ISQmethods.readplane(filename, "XZ", 5), data[:, 5, :])
+    assert np.array_equal(ISQmethods.readplane(filename, "YZ"), data[:, :, 6])
+
+    # thin slabs, z range and thumbnails
+    slab = ISQmethods.readplane(filename, "YZ", 2, thickness=3, z_min=1, z_size=15)
+    assert np.array_equal(slab, data[1:16, :, 2:5])
+    plane = ISQmethods.readplane(filename, "XZ", 5, stride=2)
+    assert np.array_equal(plane, data[::2, 5, ::2])
+    slab = ISQmethods.readplane(filename, "XZ", 2, thickness=3, stride=2, z_min=1, z_size=15)
+    assert np.array_equal(slab, data[1:16:2, 2:5, ::2])
+
+    # small read blocks give the same result
+    blocks = [
+        (z, s.copy()) for z, s in ISQmethods.readslices(filename, 3, 20, block_bytes=1000)
+    ]
+    assert len(blocks) > 1
+    assert np.array_equal(np.concatenate([z for z, s in blocks]), np.arange(3, 20))
+    assert np.array_equal(np.concatenate([s for z, s in blocks]), data[3:20])
+
+    for stride in [1, 3]:
+        XY, XZ, YZ = ISQmethods.readmidplanes(filename, stride=stride)
+        assert np.array_equal(XY, data[10, ::stride, ::stride])
+        assert np.array_equal(XZ, data[::stride, 8, ::stride])
+        assert np.array_equal(YZ, data[::stride, ::stride, 6])
+
+
+def block_mean(data, f):
+    """Reference block average with incomplete blocks averaged over the available voxels."""
+
+    starts = [np.arange(0, n, f) for n in data.shape]
+    sums = data.astype(np.float64)
+    counts = np.ones(data.shape)
+    for axis in range(3):
+        sums = np.add.reduceat(sums, starts[axis], axis=axis)
+        counts = np.add.reduceat(counts, starts[axis], axis=axis)
+    return sums / counts
+
+
+def test_ISQdata_resample(tmp_path):
+    from scipy import ndimage
+
+    rng = np.random.default_rng(2)
+    data = rng.integers(-1000, 5000, (23, 17, 13), dtype=np.int16)
+    filename = str(tmp_path / "phantom.ISQ")
+    write_ISQ(filename, data)
+
+    for f in [2, 3, 5]:
+        ref = np.transpose(block_mean(data, f), (1, 2, 0))
+        resampled = ISQdata.resample(filename, f, dtype=np.float64)
+        assert np.allclose(resampled, ref)
+        assert np.array_equal(ISQdata.resample(filename, f), np.rint(ref).astype(np.int16))
+
+        sigma = (f - 1) / 2
+        smooth = ndimage.gaussian_filter(data.astype(np.float64), sigma, mode="nearest")
+        ref = np.transpose(block_mean(smooth, f), (1, 2, 0))
+        resampled = ISQdata.resample(filename, f, method="gaussian", output=str(tmp_path / "r.npy"), dtype=np.float32)
+        assert np.allclose(resampled, ref, atol=1e-2)
+        assert np.array_equal(np.load(str(tmp_path / "r.npy")), resampled)
+
+    sub = ISQdata.readslices(filename, 1024, 17, 13, 3, 7)
+    assert np.array_equal(sub, np.transpose(data[2:7], (1, 2, 0)))
+
+
+def test_ISQ2zarr(tmp_path):
+    rng = np.random.default_rng(3)
+    data = rng.integers(-1000, 5000, (37, 29, 13), dtype=np.int16)
+    filename = str(tmp_path / "phantom.ISQ")
+    write_ISQ(filename, data)
+
+    group = ISQmethods.ISQ2zarr(filename, str(tmp_path / "phantom.zarr"), chunk_size=(8, 8, 8), levels=3)
+    assert np.array_equal(group["0"][:], data)
+    # each block writes whole chunks at every level
+    assert [group[str(k)].chunks for k in range(3)] == [(8, 8, 8), (4, 4, 8), (2, 2, 8)]
+
+    # each level is the 2x box mean of the previous level
+    level = data
+    for k in range(1, 3):
+        padded = np.pad(level, [(0, n % 2) for n in level.shape], mode="edge").astype(np.float64)
+        z, y, x = padded.shape
+        level = np.rint(padded.reshape(z // 2, 2, y // 2, 2, x // 2, 2).mean(axis=(1, 3, 5))).astype(np.int16)
+        assert group[str(k)].dtype == np.int16
+        assert np.array_equal(group[str(k)][:], level)
+
+    multiscales = group.attrs["multiscales"][0]
+    assert [d["path"] for d in multiscales["datasets"]] == ["0", "1", "2"]
+    assert multiscales["datasets"][2]["coordinateTransformations"][0]["scale"] == [40.0, 40.0, 40.0]
+    assert group.attrs["ISQheader"]["z_dim"] == 37
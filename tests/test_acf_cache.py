@@ -0,0 +1,80 @@
+import os
+import numpy as np
+import pyfabric
+from acf_cache import ACFCache, image_key
+from test_fabric_pointset import ROI_PARAMS, anisotropic_image, random_points
+
+
+def test_ACF_cache(tmp_path):
+    I = anisotropic_image()
+    points = random_points(I)
+    reference = pyfabric.fabric_pointset(I, points, **ROI_PARAMS)
+
+    for level in ["acf", "fit"]:
+        cache = ACFCache(str(tmp_path / level), level=level)
+        first = pyfabric.fabric_pointset(I, points, cache=cache, **ROI_PARAMS)
+        assert cache.hits == 0 and cache.misses == len(points)
+
+        second = pyfabric.fabric_pointset(I, points, cache=cache, **ROI_PARAMS)
+        assert cache.hits == len(points)
+        for a, b, c in zip(first, second, reference):
+            assert np.allclose(a, c, equal_nan=True)
+            assert np.array_equal(a, b, equal_nan=True)
+
+    # the ACF cache is shared by runs with different thresholds
+    cache = ACFCache(str(tmp_path / "acf"), level="acf")
+    params = dict(ROI_PARAMS, ACF_threshold=0.5)
+    pyfabric.fabric_pointset(I, points, cache=cache, **params)
+    assert cache.hit_rate == 1.0
+
+    # the fit cache is not
+    cache = ACFCache(str(tmp_path / "fit"), level="fit")
+    pyfabric.fabric_pointset(I, points, cache=cache, **params)
+    assert cache.hits == 0
+
+    # the image identity changes with the image data
+    I2 = I.copy()
+    assert image_key(I2) == image_key(I)
+    I2[0, 0, 0] += 1
+    assert image_key(I2) != image_key(I)
+
+
+def test_ACF_cache_eviction(tmp_path):
+    cache = ACFCache(str(tmp_path))
+    rng = np.random.default_rng(0)
+    for i in range(10):
+        cache.put(str(i), ACF=rng.random((20, 20, 20)).astype(np.float32))
+        # last use time
+        os.utime(cache._path(str(i)), ns=(i * 10**9, i * 10**9))
+    size = os.path.getsize(cache._path("0"))
+
+    # the least recently used entries are evicted first
+    cache.max_bytes = int(3.5 * size)
+    cache.evict()
+    assert sorted(os.listdir(str(tmp_path))) == ["7.npz", "8.npz", "9.npz"]
+    assert cache.get("9") is not None
+    assert cache.get("0") is None
+
+    # entries are evicted on put
+    cache.put("10", ACF=rng.random((20, 20, 20)).astype(np.float32))
+    assert len(os.listdir(str(tmp_path))) == 3
+    assert cache.get("7") is None
+
+    # overwritten entries are not counted twice
+    nbytes = cache._nbytes
+    cache.put("10", ACF=rng.random((20, 20, 20)).astype(np.float32))
+    assert cache._nbytes == nbytes
+
+
+def test_ACF_cache_failed_points(tmp_path):
+    I = anisotropic_image()
+    # constant region: the ACF fit of the first point fails
+    I[:, :, :25] = 7
+    points = np.array([[10, 20, 20], [40, 20, 20]], dtype=float)
+
+    cache = ACFCache(str(tmp_path / "fit"), level="fit")
+    pyfabric.fabric_pointset(
+        I, points, cache=cache, checkpoint=str(tmp_path / "checkpoint"), **ROI_PARAMS
+    )
+    # failed points are not cached
+    assert len(os.listdir(str(tmp_path / "fit"))) == 1
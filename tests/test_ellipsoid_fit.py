@@ -0,0 +1,102 @@
+import numpy as np
+import ellipsoid_fit as ef
+from scipy.spatial.transform import Rotation
+
+
+def random_ellipsoid_points(rng, n_points):
+    """Noisy points on the surface of a random ellipsoid."""
+
+    radii = rng.uniform(2, 10, 3)
+    rotation = Rotation.random(random_state=rng).as_matrix()
+    u = rng.normal(size=(n_points, 3))
+    u /= np.linalg.norm(u, axis=1)[:, None]
+    return (
+        (u * radii) @ rotation.T
+        + rng.uniform(-20, 20, 3)
+        + rng.normal(scale=0.05, size=(n_points, 3))
+    )
+
+
+def ellipsoid_matrix(evecs, radii):
+    """Ellipsoid matrix from eigenvectors (rows) and radii."""
+
+    return evecs.T @ np.diag(1 / radii**2) @ evecs
+
+
+def test_ellipsoid_fit_batch():
+    rng = np.random.default_rng(0)
+    clouds = [random_ellipsoid_points(rng, n) for n in [500, 30, 4, 2000, 0, 100]]
+    offsets = np.concatenate([[0], np.cumsum([c.shape[0] for c in clouds])])
+
+    center, evecs, radii, v = ef.ellipsoid_fit_batch(np.concatenate(clouds), offsets)
+    assert center.shape == (6, 3)
+    assert evecs.shape == (6, 3, 3)
+    assert radii.shape == (6, 3)
+
+    for k, X in enumerate(clouds):
+        if X.shape[0] < 9:
+            # too few points for a fit
+            assert np.all(np.isnan(radii[k]))
+            continue
+
+        center_ref, evecs_ref, radii_ref, v_ref = ef.ellipsoid_fit(X)
+        assert np.allclose(center[k], center_ref)
+        assert np.allclose(v[k], v_ref)
+        assert np.allclose(np.sort(radii[k]), np.sort(radii_ref))
+        assert np.allclose(
+            ellipsoid_matrix(evecs[k], radii[k]),
+            ellipsoid_matrix(evecs_ref, radii_ref),
+        )
+
+
+def data_regularize_reference(data, type, divs):
+    """Sector means computed with one mask per sector."""
+
+    limits = np.stack([np.min(data, axis=0), np.max(data, axis=0)], axis=1)
+    regularized = []
+
+    if type == "cubic":
+        X, Y, Z = [np.linspace(*limits[c], num=divs) for c in range(3)]
+        for i in range(divs - 1):
+            for j in range(divs - 1):
+                for k in range(divs - 1):
+                    mask = (
+                        (data[:, 0] >= X[i])
+                        & (data[:, 0] < X[i + 1])
+                        & (data[:, 1] >= Y[j])
+                        & (data[:, 1] < Y[j + 1])
+                        & (data[:, 2] >= Z[k])
+                        & (data[:, 2] < Z[k + 1])
+                    )
+                    if np.any(mask):
+                        regularized.append(np.mean(data[mask], axis=0))
+
+    else:
+        d_c = data - limits.mean(axis=1)
+        r_s = np.linalg.norm(d_c, axis=1)
+        theta = np.arccos(d_c[:, 2] / r_s)
+        phi = np.arctan2(d_c[:, 1], d_c[:, 0])
+        u = np.linspace(0, np.pi, num=divs)
+        v = np.linspace(-np.pi, np.pi, num=2 * divs)
+        for i in range(divs - 1):
+            for j in range(2 * divs - 1):
+                mask = (
+                    (theta >= u[i])
+                    & (theta < u[i + 1])
+                    & (phi >= v[j])
+                    & (phi < v[j + 1])
+                )
+                if np.any(mask):
+                    regularized.append(np.mean(data[mask], axis=0))
+
+    return np.array(regularized)
+
+
+def test_data_regularize():
+    rng = np.random.default_rng(1)
+    data = random_ellipsoid_points(rng, 3000)
+
+    for type in ["cubic", "spherical"]:
+        for divs in [5, 10]:
+            regularized = ef.data_regularize(data, type=type, divs=divs)
+            assert np.allclose(regularized, data_regularize_reference(data, type, divs))
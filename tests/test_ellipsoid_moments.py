@@ -0,0 +1,46 @@
+"""Accuracy of the mesh-free (second moments) ellipsoid fit against the marching cubes envelope fit on synthetic ellipsoids."""
+
+import numpy as np
+import pyfabric
+from scipy.spatial.transform import Rotation
+
+
+def synthetic_ellipsoid(radii, rotation, size=64):
+    """Binary image of an ellipsoid with given radii [X, Y, Z] and rotation matrix, centered in a cube."""
+
+    z, y, x = np.mgrid[:size, :size, :size] - size / 2
+    coors = np.stack([x, y, z], axis=-1) @ rotation
+    return np.sum((coors / radii) ** 2, axis=-1) <= 1
+
+
+def axes_error(evecs, radii, evecs_ref, radii_ref):
+    """Relative error of the sorted radii and misalignment angle [deg] of the major axis."""
+
+    order = np.argsort(np.abs(radii))
+    order_ref = np.argsort(radii_ref)
+    radii_error = (
+        np.abs(np.abs(radii[order]) - radii_ref[order_ref]) / radii_ref[order_ref]
+    )
+    cos = np.abs(np.dot(evecs[order[-1]], evecs_ref[order_ref[-1]]))
+    return radii_error, np.degrees(np.arccos(min(cos, 1)))
+
+
+def test_ellipsoid_moments_vs_marching_cubes():
+    rng = np.random.default_rng(0)
+    errors = {"moments": [], "marching_cubes": []}
+
+    for _ in range(10):
+        radii_ref = rng.permutation([6.0, 11.0, 18.0]) * rng.uniform(0.9, 1.1, 3)
+        rotation = Rotation.random(random_state=rng).as_matrix()
+        bw = synthetic_ellipsoid(radii_ref, rotation)
+
+        # ellipsoid axes are the columns of the rotation matrix
+        for method in errors:
+            center, evecs, radii = pyfabric._ellipsoid(bw, method=method)
+            errors[method].append(axes_error(evecs, radii, rotation.T, radii_ref))
+
+    for method, e in errors.items():
+        radii_error = np.max([r for r, a in e])
+        angle_error = np.max([a for r, a in e])
+        assert radii_error < 0.05, method
+        assert angle_error < 2, method
@@ -0,0 +1,542 @@
+import numpy as np
+from scipy import ndimage
+import pyfabric
+
+ROI_PARAMS = dict(
+    ROIsize=20, ACF_threshold=0.33, ROIzoom=True, zoom_size=10, zoom_factor=2
+)
+
+
+def anisotropic_image(shape=(48, 56, 52), seed=0):
+    """Smoothed noise elongated along x."""
+
+    rng = np.random.default_rng(seed)
+    I = ndimage.gaussian_filter(rng.random(shape), sigma=(1.5, 1.5, 4))
+    return (I * 1000).astype(np.int16)
+
+
+def random_points(I, n_points=30, seed=1):
+    rng = np.random.default_rng(seed)
+    # points [x, y, z]. ROIs close to the image boundary are clipped
+    return rng.uniform(5, np.array(I.shape[::-1]) - 5, (n_points, 3))
+
+
+def assert_same_fabric(result, reference):
+    for a, b in zip(result, reference):
+        assert np.array_equal(a, b, equal_nan=True)
+
+
+def test_fabric_pointset_array_likes(tmp_path):
+    import h5py
+    import zarr
+
+    I = anisotropic_image()
+    points = random_points(I)
+    reference = pyfabric.fabric_pointset(I, points, **ROI_PARAMS)
+
+    z = zarr.open(
+        str(tmp_path / "I.zarr"),
+        mode="w",
+        shape=I.shape,
+        chunks=(16, 16, 16),
+        dtype=I.dtype,
+    )
+    z[:] = I
+    with h5py.File(str(tmp_path / "I.h5"), "w") as f:
+        f.create_dataset("I", data=I, chunks=(8, 32, 32))
+
+    with h5py.File(str(tmp_path / "I.h5"), "r") as f:
+        for data in [z, f["I"]]:
+            assert_same_fabric(
+                pyfabric.fabric_pointset(data, points, **ROI_PARAMS), reference
+            )
+            assert_same_fabric(
+                pyfabric.fabric_pointset(data, points, n_jobs=2, **ROI_PARAMS),
+                reference,
+            )
+
+
+def test_chunk_cache_reads_each_chunk_once():
+    I = anisotropic_image(shape=(40, 40, 40))
+    cache = pyfabric._ChunkCache(I, chunks=(10, 10, 10))
+    points = random_points(I, n_points=200)
+
+    for i in pyfabric._chunk_order(points, 20, cache.chunks):
+        z0, z1, y0, y1, x0, x1 = pyfabric._ROI_bounds(points[i], 20, [39, 39, 39])
+        assert np.array_equal(cache[z0:z1, y0:y1, x0:x1], I[z0:z1, y0:y1, x0:x1])
+
+    assert cache.reads <= 64
+
+
+def test_chunk_cache_failed_read():
+    import time
+    import pytest
+    from concurrent.futures import ThreadPoolExecutor
+
+    I = anisotropic_image(shape=(20, 20, 20))
+
+    class FlakyArray:
+        shape, dtype = I.shape, I.dtype
+        failures = 1
+
+        def __getitem__(self, key):
+            if FlakyArray.failures > 0:
+                FlakyArray.failures -= 1
+                # a second thread waits for the chunk meanwhile
+                time.sleep(0.2)
+                raise OSError("truncated file")
+            return I[key]
+
+    cache = pyfabric._ChunkCache(FlakyArray(), chunks=(10, 10, 10))
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        first = executor.submit(cache.__getitem__, (slice(0, 5),) * 3)
+        time.sleep(0.05)
+        waiting = executor.submit(cache.__getitem__, (slice(0, 5),) * 3)
+        with pytest.raises(OSError):
+            first.result(timeout=5)
+        # the waiting thread retries the read
+        assert np.array_equal(waiting.result(timeout=5), I[:5, :5, :5])
+    assert np.array_equal(cache[:5, :5, :5], I[:5, :5, :5])
+
+
+def test_fabric_pointset_prefetch(tmp_path):
+    import zarr
+
+    I = anisotropic_image()
+    points = random_points(I)
+    reference = pyfabric.fabric_pointset(I, points, **ROI_PARAMS)
+
+    z = zarr.open(
+        str(tmp_path / "I.zarr"),
+        mode="w",
+        shape=I.shape,
+        chunks=(16, 16, 16),
+        dtype=I.dtype,
+    )
+    z[:] = I
+    for data in [I, z]:
+        for compute_workers in [1, 3]:
+            result = pyfabric.fabric_pointset(
+                data,
+                points,
+                prefetch=4,
+                read_workers=2,
+                compute_workers=compute_workers,
+                **ROI_PARAMS,
+            )
+            assert_same_fabric(result, reference)
+    assert_same_fabric(
+        pyfabric.fabric_pointset(z, points, prefetch=4, n_jobs=2, **ROI_PARAMS),
+        reference,
+    )
+
+
+def test_pipeline_stats(capsys):
+    I = anisotropic_image()
+    points = random_points(I, n_points=8)
+    for n_jobs in [None, 2]:
+        pyfabric.fabric_pointset(I, points, prefetch=2, n_jobs=n_jobs, **ROI_PARAMS)
+        assert "ROI pipeline: read utilization" in capsys.readouterr().out
+
+
+def test_pipeline_stops_on_error():
+    import pytest
+
+    I = anisotropic_image(shape=(30, 30, 30))
+    points = np.full((50, 3), np.nan)
+    with pytest.raises(Exception):
+        pyfabric.fabric_pointset(I, points, prefetch=2, compute_workers=2, **ROI_PARAMS)
+
+    class CountingArray(np.ndarray):
+        reads = 0
+
+        def __getitem__(self, key):
+            CountingArray.reads += 1
+            return np.asarray(self)[key]
+
+    # a compute failure stops the reads
+    points = random_points(I, n_points=2000)
+    n_points = len(points)
+    with pytest.raises(IOError):
+        pyfabric._fabric_points_pipeline(
+            I.view(CountingArray),
+            points,
+            range(n_points),
+            np.empty((n_points, 3, 3)),
+            np.empty((n_points, 3)),
+            20,
+            prefetch=4,
+            method="unknown",
+        )
+    assert CountingArray.reads < 100
+
+
+def test_ACF_batch():
+    I = anisotropic_image()
+    ROIs = np.stack([I[:20, :20, :20], I[10:30, 5:25, 20:40], I[-20:, -20:, -20:]])
+    ACFs = pyfabric.ACF_batch(ROIs)
+    for ROI, ACF_ROI in zip(ROIs, ACFs):
+        ACF_ref = pyfabric.ACF(ROI)
+        assert np.allclose(ACF_ROI, ACF_ref, rtol=0, atol=1e-5 * ACF_ref.max())
+
+    # the batched FFT runs through the FFT backends
+    for backend in ["numpy", "scipy", "pyfftw"]:
+        ACFs_backend = pyfabric.ACF_batch(ROIs, backend=backend)
+        assert np.allclose(ACFs_backend, ACFs, rtol=0, atol=1e-5 * ACFs.max())
+
+
+def test_fabric_snake():
+    I = anisotropic_image()
+    ROIspacing, ROIsize = 12, 12
+    mask = np.ones(I.shape, dtype=bool)
+    mask[:, :, :20] = False
+    params = dict(ACF_threshold=0.33, ROIzoom=True, zoom_size=6, zoom_factor=2)
+
+    evecs, radii, evals, fabric_comp, DA = pyfabric.fabric_snake(
+        I, ROIspacing, ROIsize, I_mask=mask, **params
+    )
+    grid_shape = tuple(
+        len(range(ROIspacing, n - ROIspacing, ROIspacing)) for n in I.shape
+    )
+    assert DA.shape == grid_shape
+    assert radii.shape == grid_shape + (3,)
+    assert fabric_comp.shape == grid_shape + (6,)
+
+    # grid point [k, j, i] lies at [z, y, x] = ROIspacing * ([k, j, i] + 1)
+    for k, j, i in np.ndindex(DA.shape):
+        x, y, z = ROIspacing * (np.array([i, j, k]) + 1)
+        if x - ROIsize / 2 < 20:
+            # ROI touching the masked part
+            assert np.all(np.isnan(radii[k, j, i]))
+            continue
+        evecs_ref, radii_ref = pyfabric._fabric_ROI(
+            I[z - 6 : z + 6, y - 6 : y + 6, x - 6 : x + 6], ROIsize, **params
+        )
+        radii_ref = np.abs(radii_ref)
+        if np.any(radii_ref > ROIsize * 2 / 2) or np.any(radii_ref < 1):
+            # outliers
+            assert np.all(np.isnan(radii[k, j, i]))
+            continue
+        # the batched fit sorts the axes
+        order, order_ref = np.argsort(radii[k, j, i]), np.argsort(radii_ref)
+        assert np.allclose(radii[k, j, i][order], radii_ref[order_ref], rtol=1e-4)
+        assert np.allclose(
+            np.abs(evecs[k, j, i][order]), np.abs(evecs_ref[order_ref]), atol=1e-3
+        )
+    assert np.any(np.isfinite(DA))
+
+    # the default (binned) integral image of the mask gives the exact coverage
+    exact = pyfabric.fabric_snake(
+        I, ROIspacing, ROIsize, I_mask=mask, mask_binning=1, **params
+    )
+    assert np.array_equal(exact[4], DA, equal_nan=True)
+    bounds = np.array([[6, 18, 6, 18, 30, 42], [18, 30, 6, 18, 30, 42]])
+    assert pyfabric._mask_binning(bounds, I.shape) == 6
+
+
+def test_fabric_snake_matches_pointset():
+    I = anisotropic_image()
+    ROIspacing, ROIsize = 12, 12
+    params = dict(ACF_threshold=0.33, ROIzoom=True, zoom_size=6, zoom_factor=2)
+    snake = pyfabric.fabric_snake(I, ROIspacing, ROIsize, **params)
+
+    # grid points [x, y, z]
+    zz, yy, xx = np.meshgrid(
+        *[range(ROIspacing, n - ROIspacing, ROIspacing) for n in I.shape],
+        indexing="ij",
+    )
+    points = np.stack([xx.ravel(), yy.ravel(), zz.ravel()], axis=1)
+    pointset = pyfabric.fabric_pointset(I, points, ROIsize=ROIsize, **params)
+
+    # the batched (eigh) and per-point (eig) fits return eigenvectors with different sign and order
+    fabric_comp = snake[3].reshape(-1, 6)
+    assert np.any(np.isfinite(fabric_comp))
+    np.testing.assert_allclose(
+        fabric_comp, pointset[3], rtol=1e-3, atol=1e-4 * np.nanmax(np.abs(fabric_comp))
+    )
+
+
+def test_fabric_pointset_mask():
+    from integral_image import IntegralImage
+
+    I = anisotropic_image()
+    points = random_points(I)
+    mask = np.zeros(I.shape, dtype=bool)
+    mask[:, :, :26] = True
+    reference = pyfabric.fabric_pointset(I, points, **ROI_PARAMS)
+
+    result = pyfabric.fabric_pointset(
+        I, points, mask=IntegralImage.from_image(mask), mask_coverage=0.5, **ROI_PARAMS
+    )
+    inside = points[:, 0] < 26
+    rejected = np.all(np.isnan(result[0]), axis=(1, 2))
+    assert np.any(rejected) and not np.all(rejected)
+    # ROIs centered inside the mask have at least half of their voxels inside
+    assert not np.any(rejected & inside & (points[:, 0] < 20))
+    assert_same_fabric(
+        [r[~rejected] for r in result], [r[~rejected] for r in reference]
+    )
+
+    # points on a grid: binned integral image of the mask (as fabric_snake), same coverage
+    grid = np.stack(
+        np.meshgrid(range(10, 50, 10), range(10, 50, 10), range(10, 40, 10)), axis=-1
+    ).reshape(-1, 3)
+    bounds = [pyfabric._ROI_bounds(p, 20, np.array(I.shape) - 1) for p in grid]
+    assert pyfabric._mask_binning(np.array(bounds), I.shape) == 10
+    params = dict(mask_coverage=0.9, fabric_method="structure_tensor", ROIsize=20)
+    binned = pyfabric.fabric_pointset(I, grid, mask=mask, **params)
+    exact = pyfabric.fabric_pointset(I, grid, mask=mask, mask_binning=1, **params)
+    assert np.array_equal(binned[4], exact[4], equal_nan=True)
+    assert np.any(np.isnan(exact[4])) and not np.all(np.isnan(exact[4]))
+
+
+def test_structure_tensor(tmp_path):
+    I = anisotropic_image()
+    points = random_points(I)
+
+    # the chunked gradient matches the gradient of the whole image
+    tensor = pyfabric.structure_tensor(I, sigma=1.0, chunk_size=8, n_jobs=2)
+    g = [
+        ndimage.gaussian_filter(I.astype(np.float32), 1.0, order=o, mode="nearest")
+        for o in ([0, 0, 1], [0, 1, 0], [1, 0, 0])
+    ]
+    pairs = [(0, 0), (1, 1), (2, 2), (0, 1), (1, 2), (0, 2)]
+    for component, (i, j) in zip(tensor, pairs):
+        reference = np.sum((g[i] * g[j])[10:30, 5:40, 3:50], dtype=np.float64)
+        assert np.isclose(component.box_sum(10, 30, 5, 40, 3, 50), reference, rtol=1e-4)
+
+    evecs, radii, evals, fabric_comp, DA = pyfabric.fabric_pointset(
+        I, points, ROIsize=20, fabric_method="structure_tensor"
+    )
+    assert np.allclose(fabric_comp[:, :3].sum(axis=1), 1)
+    assert np.all(DA > 1)
+    # major axis (smallest intensity variation) along x
+    major = evecs[np.arange(len(points)), np.argmax(radii, axis=1)]
+    assert np.all(np.abs(major[:, 0]) > 0.9)
+
+    # same post-processing as the ACF fabric
+    reference = pyfabric.fabric_components(evecs, radii)
+    for a, b in zip((evecs, radii, evals, fabric_comp, DA), reference):
+        assert np.array_equal(a, b, equal_nan=True)
+
+    # fabric_snake integrates the same tensor on the grid
+    snake = pyfabric.fabric_snake(I, 16, 16, fabric_method="structure_tensor")
+    zz, yy, xx = np.meshgrid(
+        range(16, 32, 16), range(16, 40, 16), range(16, 36, 16), indexing="ij"
+    )
+    grid = np.stack([xx.ravel(), yy.ravel(), zz.ravel()], axis=1)
+    reference = pyfabric.fabric_structure_tensor(I, grid, 16, tensor=tensor)
+    for a, b in zip(snake, reference):
+        assert np.allclose(a.reshape(b.shape), b)
+
+    # default binning (ROIsize // 16) of integral images stored as files
+    filename = str(tmp_path / "ST")
+    binned = pyfabric.fabric_pointset(
+        I, points, ROIsize=32, fabric_method="structure_tensor", ST_filename=filename
+    )
+    tensor = pyfabric.IntegralImage.load(filename + "_XX.npy")
+    assert tensor.binning == 2
+    unbinned = pyfabric.fabric_pointset(
+        I, points, ROIsize=32, fabric_method="structure_tensor", ST_binning=1
+    )
+    assert np.allclose(binned[3], unbinned[3], atol=0.02)
+
+
+def test_MIL():
+    # plates normal to x with period 10: MIL(v) = 5 |v| / |v_x|
+    x = np.arange(100)
+    bw = np.broadcast_to((x % 10) < 5, (30, 30, 100))
+    directions = pyfabric.MIL_directions()
+    lengths = pyfabric.MIL(bw, directions)
+    crossing = directions[:, 0] != 0
+    expected = (
+        5
+        * np.linalg.norm(directions, axis=1)[crossing]
+        / np.abs(directions[crossing, 0])
+    )
+    assert np.allclose(lengths[crossing], expected, rtol=0.05)
+    assert np.all(np.isinf(lengths[~crossing]))
+
+    # MIL fabric of the structure elongated along x
+    I = anisotropic_image()
+    threshold = np.median(I)
+    center, evecs, radii = pyfabric.MIL_ellipsoid(I > threshold)
+    assert np.abs(evecs[np.argmax(np.abs(radii)), 0]) > 0.95
+
+    points = random_points(I)
+    reference = pyfabric.fabric_pointset(
+        I, points, ROIsize=24, fabric_method="MIL", MIL_threshold=threshold
+    )
+    assert np.any(np.isfinite(reference[4]))
+    assert_same_fabric(
+        pyfabric.fabric_pointset(
+            I,
+            points,
+            ROIsize=24,
+            fabric_method="MIL",
+            MIL_threshold=threshold,
+            n_jobs=2,
+        ),
+        reference,
+    )
+
+
+def test_fabric_sweep():
+    I = anisotropic_image()
+    points = random_points(I, n_points=10)
+    thresholds = [0.25, 0.33, 0.5]
+    zooms = [(10, 2), (12, 3)]
+
+    *results, params = pyfabric.fabric_sweep(
+        I, points, 20, ACF_thresholds=thresholds, zooms=zooms
+    )
+    assert len(params) == 6
+    assert results[1].shape == (6, 10, 3)
+
+    # same fabric as separate runs of fabric_pointset
+    for p, param in enumerate(params):
+        reference = pyfabric.fabric_pointset(
+            I,
+            points,
+            20,
+            ACF_threshold=param["ACF_threshold"],
+            ROIzoom=True,
+            zoom_size=param["zoom_size"],
+            zoom_factor=param["zoom_factor"],
+        )
+        for a, b in zip(results, reference):
+            assert np.allclose(a[p], b, rtol=1e-12, atol=0, equal_nan=True)
+
+    # without zoom the radii are in units of ROIsize
+    *results, params = pyfabric.fabric_sweep(I, points, 20, ACF_thresholds=[0.33])
+    assert np.nanmax(results[1]) <= 0.5
+
+    # default zoom factor (2)
+    *results, params = pyfabric.fabric_sweep(
+        I, points, 20, ACF_thresholds=[0.33], zooms=[(10, None)]
+    )
+    reference = pyfabric.fabric_pointset(
+        I, points, 20, ACF_threshold=0.33, ROIzoom=True, zoom_size=10
+    )
+    for a, b in zip(results, reference):
+        assert np.allclose(a[0], b, rtol=1e-12, atol=0, equal_nan=True)
+    assert np.nanmax(results[1]) <= 20
+
+
+def test_fabric_pointset_checkpoint(tmp_path, monkeypatch):
+    import json
+    import pytest
+
+    I = anisotropic_image()
+    points = random_points(I)
+    reference = pyfabric.fabric_pointset(I, points, **ROI_PARAMS)
+    fabric_ROI = pyfabric._fabric_ROI
+    calls = []
+
+    def killed(ROI, ROIsize, **kwargs):
+        # the run is killed at the 20th point
+        calls.append(1)
+        if len(calls) > 20:
+            raise KeyboardInterrupt
+        return fabric_ROI(ROI, ROIsize, **kwargs)
+
+    monkeypatch.setattr(pyfabric, "_fabric_ROI", killed)
+    checkpoint = str(tmp_path / "run")
+    try:
+        pyfabric.fabric_pointset(
+            I, points, checkpoint=checkpoint, checkpoint_every=8, **ROI_PARAMS
+        )
+    except KeyboardInterrupt:
+        pass
+    status = np.load(str(tmp_path / "run" / "status.npy"))
+    assert np.count_nonzero(status == 1) == 16
+
+    # the resumed run computes the remaining points only
+    calls.clear()
+    monkeypatch.setattr(pyfabric, "_fabric_ROI", fabric_ROI)
+    for prefetch in [0, 4]:
+        result = pyfabric.fabric_pointset(
+            I, points, checkpoint=checkpoint, prefetch=prefetch, **ROI_PARAMS
+        )
+        assert_same_fabric(result, reference)
+    assert np.all(np.load(str(tmp_path / "run" / "status.npy")) == 1)
+    fabric_comp = np.load(str(tmp_path / "run" / "fabric_comp.npy"))
+    assert np.allclose(fabric_comp, reference[3], rtol=1e-12, atol=0, equal_nan=True)
+
+    # failed fits are recorded and do not abort the run
+    def failing(ROI, ROIsize, **kwargs):
+        if ROI.shape[0] < ROIsize:
+            raise np.linalg.LinAlgError("Singular matrix")
+        return fabric_ROI(ROI, ROIsize, **kwargs)
+
+    monkeypatch.setattr(pyfabric, "_fabric_ROI", failing)
+    for prefetch in [0, 4]:
+        checkpoint = str(tmp_path / "failures{0}".format(prefetch))
+        result = pyfabric.fabric_pointset(
+            I, points, checkpoint=checkpoint, prefetch=prefetch, **ROI_PARAMS
+        )
+        status = np.load(checkpoint + "/status.npy")
+        with open(checkpoint + "/failures.jsonl") as f:
+            failures = [json.loads(line) for line in f]
+        assert np.count_nonzero(status == 2) == len(failures) > 0
+        assert all(np.isnan(result[4][f["index"]]) for f in failures)
+        assert "LinAlgError" in failures[0]["error"]
+
+    # checkpoints of other runs are not reused
+    with pytest.raises(ValueError):
+        pyfabric.fabric_pointset(I, points[:10], checkpoint=checkpoint, **ROI_PARAMS)
+
+
+def test_fabric_components():
+    from scipy.spatial.transform import Rotation
+
+    rng = np.random.default_rng(0)
+    evecs = Rotation.random(1000, random_state=rng).as_matrix()
+    radii = rng.uniform(-25, 25, (1000, 3))
+
+    evecs_f, radii_f, evals, fabric_comp, DA = pyfabric.fabric_components(
+        evecs, radii, radius_max=20, radius_min=1
+    )
+    assert fabric_comp.dtype == np.float32
+
+    # reference: sum_k evals_k v_k v_k.T with the eigenvectors v_k as rows
+    radii_ref = np.abs(radii)
+    DA_ref = np.max(radii_ref, 1) / np.min(radii_ref, 1)
+    idx = np.any(radii_ref > 20, axis=1) | np.any(radii_ref < 1, axis=1)
+    radii_ref[idx] = np.nan
+    DA_ref[idx] = np.nan
+    evals_ref = 1 / radii_ref**2
+    for n in range(1000):
+        fabric_tens = np.matmul(
+            evecs[n].T, np.matmul(evals_ref[n] * np.identity(3), evecs[n])
+        )
+        comp = fabric_tens[[0, 1, 2, 0, 1, 0], [0, 1, 2, 1, 2, 2]]
+        assert np.allclose(fabric_comp[n], comp, rtol=1e-5, atol=1e-7, equal_nan=True)
+
+    assert np.allclose(radii_f, radii_ref, rtol=1e-6, equal_nan=True)
+    assert np.allclose(DA, DA_ref, rtol=1e-6, equal_nan=True)
+    assert np.allclose(evals, evals_ref, rtol=1e-6, equal_nan=True)
+
+
+def test_fabric_components_invariance():
+    from scipy.spatial.transform import Rotation
+
+    rng = np.random.default_rng(1)
+    evecs = Rotation.random(100, random_state=rng).as_matrix()
+    radii = rng.uniform(1, 20, (100, 3))
+    fabric_comp = pyfabric.fabric_components(evecs, radii)[3]
+
+    # flip the sign of one eigenvector and permute the eigenvectors (with their radii)
+    order = [2, 0, 1]
+    evecs_flipped = evecs.copy()
+    evecs_flipped[:, 1] *= -1
+    fabric_comp_flipped = pyfabric.fabric_components(
+        evecs_flipped[:, order], radii[:, order]
+    )[3]
+    np.testing.assert_allclose(fabric_comp_flipped, fabric_comp, rtol=1e-5, atol=1e-7)
+
+    # full tensor of the first point: evecs.T @ diag(1 / radii**2) @ evecs
+    tensor = evecs[0].T @ np.diag(1 / radii[0] ** 2) @ evecs[0]
+    np.testing.assert_allclose(
+        fabric_comp[0], tensor[[0, 1, 2, 0, 1, 0], [0, 1, 2, 1, 2, 2]], rtol=1e-5
+    )
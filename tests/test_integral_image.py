@@ -0,0 +1,56 @@
+import numpy as np
+from integral_image import IntegralImage
+
+
+def random_boxes(shape, n_boxes, rng):
+    lower = rng.integers(-3, np.array(shape), (n_boxes, 3))
+    upper = lower + rng.integers(0, 12, (n_boxes, 3))
+    return np.stack(
+        [lower[:, 0], upper[:, 0], lower[:, 1], upper[:, 1], lower[:, 2], upper[:, 2]]
+    )
+
+
+def reference_sums(data, boxes):
+    sums = []
+    for z0, z1, y0, y1, x0, x1 in np.maximum(boxes.T, 0):
+        sums.append(data[z0:z1, y0:y1, x0:x1].sum())
+    return np.array(sums)
+
+
+def test_box_queries(tmp_path):
+    rng = np.random.default_rng(0)
+    mask = rng.random((37, 29, 23)) > 0.3
+    boxes = random_boxes(mask.shape, 500, rng)
+
+    for chunk_size in [1, 5, 64]:
+        ii = IntegralImage.from_image(mask, chunk_size=chunk_size)
+        assert np.array_equal(ii.box_sum(*boxes), reference_sums(mask, boxes))
+
+    ii = IntegralImage.from_image(
+        mask, filename=str(tmp_path / "mask_ii.npy"), chunk_size=4
+    )
+    ii = IntegralImage.load(str(tmp_path / "mask_ii.npy"))
+    assert np.array_equal(ii.box_sum(*boxes), reference_sums(mask, boxes))
+
+    # mean = BV/TV of the box
+    box = (2, 30, 3, 20, 1, 22)
+    assert np.isclose(ii.mean(*box), mask[2:30, 3:20, 1:22].mean())
+    assert ii.occupied(*box, fraction=0.6) == (mask[2:30, 3:20, 1:22].mean() >= 0.6)
+
+
+def test_binning():
+    rng = np.random.default_rng(1)
+    data = rng.random((37, 29, 23))
+    ii = IntegralImage.from_image(data, binning=4, chunk_size=3)
+
+    # exact on bin aligned boxes (and at the image boundary)
+    boxes = np.array(
+        [[0, 37, 0, 29, 0, 23], [4, 16, 8, 29, 0, 12], [8, 37, 4, 8, 20, 23]]
+    ).T
+    assert np.allclose(ii.box_sum(*boxes), reference_sums(data, boxes))
+
+    # interpolated on other boxes
+    boxes = random_boxes(data.shape, 200, rng)
+    volume = ii.volume(*boxes)
+    error = np.abs(ii.box_sum(*boxes) - reference_sums(data, boxes))
+    assert np.all(error <= 0.5 * volume + 1e-9)
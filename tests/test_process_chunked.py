@@ -0,0 +1,178 @@
+import numpy as np
+import os
+import pytest
+from scipy import ndimage
+import recon_utils
+
+
+def filter_threshold(tile):
+    tile = ndimage.gaussian_filter(tile, sigma=1.3)
+    np.putmask(tile, tile < 1000, 2000)
+    return tile
+
+
+def test_process_chunked_matches_whole_volume():
+    rng = np.random.default_rng(0)
+    data = (rng.random((57, 31, 29)) * 3000).astype(np.int16)
+    ref = filter_threshold(data.copy())
+
+    for chunk_size in [5, 16, 100]:
+        out = recon_utils.process_chunked(
+            data, filter_threshold, halo=6, chunk_size=chunk_size, n_jobs=2
+        )
+        assert np.array_equal(out, ref)
+
+    for zoom in [0.1, 0.5, (0.7, 0.4, 1.3)]:
+        for order in [0, 1]:
+            out = recon_utils.process_chunked(
+                data, filter_threshold, halo=6, zoom=zoom, order=order, chunk_size=3
+            )
+            assert np.array_equal(out, ndimage.zoom(ref, zoom, order=order))
+
+        # spline prefiltering: up to float tolerance
+        out = recon_utils.process_chunked(
+            ref.astype(np.float64), zoom=zoom, order=3, chunk_size=3
+        )
+        assert np.allclose(out, ndimage.zoom(ref.astype(np.float64), zoom, order=3))
+
+
+def test_process_chunked_output(tmp_path):
+    data = np.arange(40 * 8 * 8, dtype=np.float32).reshape(40, 8, 8)
+    output = np.lib.format.open_memmap(
+        str(tmp_path / "out.npy"), mode="w+", dtype=np.float32, shape=(20, 4, 4)
+    )
+    recon_utils.process_chunked(data, zoom=0.5, output=output, chunk_size=7)
+    assert np.allclose(
+        np.load(str(tmp_path / "out.npy")), ndimage.zoom(data, 0.5, order=1)
+    )
+
+
+def test_touint():
+    rng = np.random.default_rng(1)
+    data = (rng.normal(2000, 500, (40, 30, 20))).astype(np.int16)
+    data_float = data.astype(np.float32) / 7
+    data_float[0, 0, 0] = np.nan
+
+    # exact range of integer data from the histogram, one pass for floats
+    assert recon_utils.intensity_range(data, n_jobs=2) == [data.min(), data.max()]
+    assert np.array_equal(
+        recon_utils.intensity_range(data, quantiles=[0.01, 0.99], chunk_size=7),
+        np.quantile(data, [0.01, 0.99], method="inverted_cdf"),
+    )
+    assert recon_utils.intensity_range(data_float, chunk_size=7) == [
+        np.nanmin(data_float),
+        np.nanmax(data_float),
+    ]
+    q = recon_utils.intensity_range(data_float, quantiles=[0.01, 0.99], subset=False)
+    assert np.allclose(q, np.nanquantile(data_float, [0.01, 0.99]))
+
+    # subset: 3D grid sample, not aliased with the row length
+    x_ramp = np.linspace(0, 1, 1000, dtype=np.float32) + np.random.default_rng(
+        1
+    ).random((25, 40, 1000), dtype=np.float32)
+    q = recon_utils.intensity_range(x_ramp, quantiles=[0.05, 0.95], chunk_size=7)
+    assert np.allclose(q, np.quantile(x_ramp[::10, ::10, ::10], [0.05, 0.95]))
+    assert np.allclose(q, np.quantile(x_ramp, [0.05, 0.95]), atol=0.05)
+
+    for dtype, vmax in [("uint8", 255), ("uint16", 65535)]:
+        for data_range in [None, [1500, 2500]]:
+            mn, mx = data_range or [data.min(), data.max()]
+            ref = np.clip(
+                0.5 + vmax * (data.astype(np.float64) - mn) / (mx - mn), 0, vmax
+            )
+            out = recon_utils.touint(
+                data, dtype, data_range=data_range, nchunk=7, n_jobs=2
+            )
+            assert out.dtype == dtype
+            # float32 rounding of the values at .5
+            assert np.max(np.abs(out.astype(np.int64) - ref.astype(np.int64))) <= 1
+
+    out = recon_utils.to01(data_float, chunk_size=7, n_jobs=2)
+    ref = (data_float - np.nanmin(data_float)) / (
+        np.nanmax(data_float) - np.nanmin(data_float)
+    )
+    assert np.allclose(out, ref, equal_nan=True)
+
+
+def test_tiff_stack(tmp_path):
+    tifffile = pytest.importorskip("tifffile")
+    I = np.random.default_rng(0).integers(0, 2**16, (6, 9, 7), dtype=np.uint16)
+    for n, image in enumerate(I, start=10):
+        tifffile.imwrite(tmp_path / "slice_{0:04d}.tif".format(n), image)
+    tifffile.imwrite(tmp_path / "other_0000.tif", I[0])
+
+    stack = recon_utils.TiffStack(tmp_path / "slice_0010.tif", n_jobs=2)
+    assert stack.shape == I.shape and stack.dtype == I.dtype
+    np.testing.assert_array_equal(stack[1:4, 2:5, ::2], I[1:4, 2:5, ::2])
+    np.testing.assert_array_equal(stack[-1], I[-1])
+    np.testing.assert_array_equal(np.asarray(stack), I)
+
+    # data_range: slice numbers [start, end)
+    data = recon_utils.read_tiff_stack(tmp_path / "slice_0010.tif", [12, 15])
+    np.testing.assert_array_equal(data, I[2:5])
+    with pytest.raises(ValueError):
+        recon_utils.read_tiff_stack(tmp_path / "slice_0010.tif", [20, 30])
+
+    # persistent cache
+    cache = str(tmp_path / "stack.npy")
+    np.testing.assert_array_equal(
+        recon_utils.TiffStack(tmp_path / "slice_0010.tif", cache=cache)[2:4], I[2:4]
+    )
+    cached = recon_utils.TiffStack(tmp_path / "slice_0010.tif", cache=cache)
+    assert cached._cached.sum() == 2
+    np.testing.assert_array_equal(cached[:], I)
+
+
+def test_stack_fnames(tmp_path):
+    fname = str(tmp_path / "out" / "data")
+    fnames = recon_utils._stack_fnames(fname, 3, start=1, digit=3)
+    assert [os.path.basename(f) for f in fnames] == [
+        "data_001.jp2",
+        "data_002.jp2",
+        "data_003.jp2",
+    ]
+
+    # existing files are not replaced
+    open(fnames[0], "w").close()
+    open(fnames[0][:-4] + "-1.jp2", "w").close()
+    renamed = recon_utils._stack_fnames(fname + ".jp2", 3, start=1, digit=3)
+    assert os.path.basename(renamed[0]) == "data_001-2.jp2"
+    assert renamed[1:] == fnames[1:]
+    assert recon_utils._stack_fnames(fname, 3, 1, 3, overwrite=True) == fnames
+
+
+def test_write_jpeg2000_stack(tmp_path):
+    glymur = pytest.importorskip("glymur")
+    I = np.random.default_rng(0).integers(0, 255, (5, 32, 24), dtype=np.uint8)
+    fnames = recon_utils.write_jpeg2000_stack(
+        I, str(tmp_path / "data"), compratio=1, n_jobs=2, chunk_size=2
+    )
+    assert len(fnames) == 5
+    np.testing.assert_array_equal(glymur.Jp2k(fnames[3])[:], I[3])
+
+
+def test_average_sinogram_by_interval(tmp_path):
+    projs = np.random.default_rng(0).integers(0, 2**16, (23, 8, 6), dtype=np.uint16)
+
+    # reference: reshape of the whole stack
+    reference = projs[:21].reshape(7, 3, 8, 6).astype(np.float32).mean(axis=1)
+    averaged = recon_utils.average_sinogram_by_interval(projs, 3, n_jobs=2)
+    np.testing.assert_array_equal(averaged, reference.astype(np.uint16))
+
+    median = recon_utils.average_sinogram_by_interval(projs, 3, method="median")
+    np.testing.assert_array_equal(
+        median, np.median(projs[:21].reshape(7, 3, 8, 6), axis=1).astype(np.uint16)
+    )
+
+    averaged = recon_utils.average_sinogram_by_interval(projs, 2, -3)
+    np.testing.assert_array_equal(
+        averaged[-1], projs[18:20].mean(axis=0).astype(np.uint16)
+    )
+    with pytest.raises(ValueError):
+        recon_utils.average_sinogram_by_interval(projs, 2, None)
+
+    h5py = pytest.importorskip("h5py")
+    with h5py.File(tmp_path / "projs.h5", "w") as f:
+        dataset = f.create_dataset("exchange/data", data=projs, chunks=(1, 8, 6))
+        averaged = recon_utils.average_sinogram_by_interval(dataset, 3, n_jobs=2)
+    np.testing.assert_array_equal(averaged, reference.astype(np.uint16))